@@ -2,29 +2,31 @@
 
 from __future__ import print_function
 
-import atexit
+import contextlib
 import errno
-import fcntl
+import json
 import os
 import shutil
-import socket
-import struct
 import sys
 import time
 from collections import OrderedDict
-from multiprocessing import Process
+from statistics import median
+from concurrent.futures import ThreadPoolExecutor
 import platform
-from subprocess import Popen
 import re
 import structlog
 
 import click
 import docker.errors
-import yaml
 from PyInquirer import prompt
 from six.moves.urllib.parse import urlparse, urlunparse
+from tabulate import tabulate
 
-from ..utils import apps, dockerutil, jbapiutil, subprocess, auth, format
+from ..utils import (
+    apps, appserver, asyncapi, composebackend, containerstats, dbsnapshot, dockerutil,
+    ephemeral, gitcache, jbapiutil, logstream, manifest, pipcache, profiler, rediscache,
+    stackbench, subprocess, auth, format, reloadstats, tunnel,
+)
 from ..utils.format import echo_highlight, echo_warning, echo_success
 from ..utils.reload import create_browser_instance
 from ..utils.secrets import get_deployment_secrets
@@ -38,6 +40,9 @@ toplog = structlog.get_logger()
 
 stash = Stash("~/.config/juicebox/devlandia.toml")
 
+# The service name colors of `jb logs`
+LOG_COLORS = ["cyan", "yellow", "green", "magenta", "blue", "bright_cyan", "bright_yellow"]
+
 
 def normalize(name):
     return name.replace("_", "-")
@@ -54,7 +59,20 @@ def cli():
 
 @cli.command()
 @click.argument("applications", nargs=-1, required=True)
-def add(applications):
+@click.option("--verbose", default=False, is_flag=True, help="Print every log entry of the app load.")
+@click.option("--json", "as_json", default=False, is_flag=True,
+              help="Print a JSON report of each app load to stdout.")
+@click.option("--force", default=False, is_flag=True,
+              help="Load apps even if they haven't changed since their last load.")
+@click.option("--depth", type=int, default=None,
+              help="Only clone this many commits of history of each branch.")
+@click.option("--blobless", default=False, is_flag=True,
+              help="Clone without file contents of old commits (--filter=blob:none).")
+@click.option("--reference", default=False, is_flag=True,
+              help="Share git objects between apps through a cache in ~/.cache/juicebox/git.")
+@click.option("--mirror/--no-mirror", default=True, show_default=True,
+              help="Clone full checkouts from a local mirror that only fetches new commits.")
+def add(applications, verbose, as_json, force, depth, blobless, reference, mirror):
     """Checkout a juicebox app (or list of apps) and load it, can check out
     a specific branch by using `appslug@branchname`
     """
@@ -68,67 +86,293 @@ def add(applications):
             click.get_current_context().abort()
 
         failed_apps = []
+        reports = []
+        output = "logs" if verbose else "summary"
+        if as_json:
+            # Keep stdout clean for the JSON document
+            output = "none"
+            messages = contextlib.redirect_stdout(sys.stderr)
+        else:
+            messages = contextlib.nullcontext()
+
+        with messages:
+            _add_apps(
+                applications, failed_apps, reports, output, force,
+                clone_options={
+                    "depth": depth, "blobless": blobless, "reference": reference, "mirror": mirror,
+                },
+            )
 
-        for app in applications:
-            branch = None
-            if "@" in app:
-                app_split = app.split("@")
-                app = app_split[0]
-                branch = app_split[1]
-            app_dir = f"apps/{app}"
-            if os.path.isdir(app_dir):
-                # App already exists. We assume there's a repo here.
-                echo_highlight(
-                    f"App {app} already exists. Changing to branch {branch}."
-                )
-                if branch is not None:
-                    # TODO: If we used pathlib we could have a context manager
-                    # here to change the path
-                    # with Path(app_dir):
-                    os.chdir(app_dir)
-                    try:
-                        subprocess.check_call(["git", "fetch"])
-                        subprocess.check_call(["git", "checkout", branch])
-                    except subprocess.CalledProcessError:
-                        failed_apps.append(app)
-                        continue
-                    os.chdir("../..")
+        if as_json:
+            click.echo(json.dumps(reports, indent=2))
 
-            else:
-                # App doesn't exist, clone it
-                echo_highlight(f"Adding {app}...")
-                echo_highlight(f"Downloading app {app} from Github.")
-                github_repo_url = apps.make_github_repo_url(app)
+        if failed_apps:
+            click.echo()
+            echo_warning(f'Failed to load: {", ".join(failed_apps)}.')
+            click.get_current_context().abort()
+    except docker.errors.APIError as de:
+        echo_warning(de.message)
 
+
+def _clone_args(app, github_repo_url, depth=None, blobless=False, reference=False, mirror=False):
+    """Where to clone an app from and the extra `git clone` arguments to move
+    only what's needed for a checkout.
+    """
+    args = []
+    if depth:
+        # Keep every branch so `jb add app@branch` can switch later
+        args.extend(["--depth", str(depth), "--no-single-branch"])
+    if blobless:
+        args.append("--filter=blob:none")
+    if reference:
+        store = apps.update_reference_store(app, github_repo_url)
+        if store:
+            args.extend(["--reference-if-able", store])
+    if mirror and not args:
+        # Partial and reference clones are explicit choices, only full clones
+        # come from the mirror.
+        source = gitcache.update_mirror(app, github_repo_url)
+        if source:
+            return source, args
+    return github_repo_url, args
+
+
+def _add_apps(applications, failed_apps, reports, output, force=False, clone_options=None):
+    """Clone or checkout each app and load it through the API."""
+    clone_options = clone_options or {}
+    loaded = _manifest(custom=True)
+    for app in applications:
+        branch = None
+        if "@" in app:
+            app_split = app.split("@")
+            app = app_split[0]
+            branch = app_split[1]
+        app_dir = f"apps/{app}"
+        if os.path.isdir(app_dir):
+            # App already exists. We assume there's a repo here.
+            echo_highlight(
+                f"App {app} already exists. Changing to branch {branch}."
+            )
+            if branch is not None:
                 try:
-                    if not branch:
-                        subprocess.check_call(
-                            ["git", "clone", github_repo_url, app_dir]
-                        )
-                    else:
-                        subprocess.check_call(
-                            ["git", "clone", "-b", branch, github_repo_url, app_dir]
-                        )
-                except subprocess.CalledProcessError:
+                    apps.checkout_branch(app_dir, branch)
+                except subprocess.CalledProcessError as e:
+                    echo_warning(_git_error(e))
                     failed_apps.append(app)
                     continue
 
-            try:
-                if not jbapiutil.load_app(app, custom=True):
-                    dockerutil.run(f"/venv/bin/python manage.py loadjuiceboxapp {app}", env='custom')
-                    echo_success(f"{app} was added successfully.")
+        else:
+            # App doesn't exist, clone it
+            echo_highlight(f"Adding {app}...")
+            echo_highlight(f"Downloading app {app} from Github.")
+            github_repo_url = apps.make_github_repo_url(app)
 
-            except docker.errors.APIError as e:
-                echo_warning(f"Failed to add {app} to the Juicebox VM.")
+            source, clone_args = _clone_args(app, github_repo_url, **clone_options)
+            try:
+                if not branch:
+                    subprocess.check_call(
+                        ["git", "clone"] + clone_args + [source, app_dir]
+                    )
+                else:
+                    subprocess.check_call(
+                        ["git", "clone"] + clone_args + ["-b", branch, source, app_dir]
+                    )
+                if source != github_repo_url:
+                    # Fetch and push against Github from now on
+                    subprocess.check_call(
+                        ["git", "-C", app_dir, "remote", "set-url", "origin", github_repo_url]
+                    )
+            except subprocess.CalledProcessError:
                 failed_apps.append(app)
-                print(e.explanation)
+                continue
 
-        if failed_apps:
-            click.echo()
-            echo_warning(f'Failed to load: {", ".join(failed_apps)}.')
-            click.get_current_context().abort()
-    except docker.errors.APIError as de:
-        echo_warning(de.message)
+        app_hash = manifest.tree_hash(app_dir)
+        if not force and loaded.is_current(app, app_hash):
+            echo_success(f"{app} hasn't changed since it was last loaded, use --force to reload it.")
+            continue
+
+        try:
+            report = {}
+            start = time.time()
+            if jbapiutil.load_app(app, custom=True, output=output, report=report):
+                loaded.record(app, app_hash, time.time() - start)
+                ephemeral.record_load(app, time.time() - start, stash=stash)
+            else:
+                dockerutil.run(f"/venv/bin/python manage.py loadjuiceboxapp {app}", env='custom')
+                echo_success(f"{app} was added successfully.")
+            if report:
+                reports.append(report)
+
+        except docker.errors.APIError as e:
+            echo_warning(f"Failed to add {app} to the Juicebox VM.")
+            failed_apps.append(app)
+            print(e.explanation)
+
+
+@cli.command()
+@click.option("--custom", default=False, is_flag=True, help="Reload the apps in Juicebox Custom")
+@click.option("--concurrency", "-j", default=asyncapi.DEFAULT_CONCURRENCY, show_default=True,
+              help="How many apps to load at the same time.")
+@click.option("--force", default=False, is_flag=True,
+              help="Reload apps even if they haven't changed since their last load.")
+@click.option("--fail-fast", default=False, is_flag=True,
+              help="Stop starting new loads after the first failure.")
+@click.option("--json", "as_json", default=False, is_flag=True, help="Print the results as JSON.")
+def reload_all(custom, concurrency, force, fail_fast, as_json):
+    """Reload every app in apps/ through the Juicebox API"""
+    os.chdir(DEVLANDIA_DIR)
+    _ensure_running(custom)
+
+    app_names = apps.discover_apps()
+    if not app_names:
+        echo_highlight("No apps found in apps/.")
+        return
+    _reload_apps(app_names, custom, concurrency, force, fail_fast, as_json)
+
+
+def _ensure_running(custom):
+    running = dockerutil.is_running()
+    if not running[0 if custom else 1]:
+        name = "Custom" if custom else "Selfserve"
+        echo_warning(f"Juicebox {name} is not running.  Run jb start.")
+        click.get_current_context().abort()
+
+
+def _reload_apps(app_names, custom, concurrency, force=False, fail_fast=False, as_json=False):
+    """Load the apps that changed since their last load, concurrently."""
+    loaded = _manifest(custom)
+    hashes = {app: manifest.tree_hash(f"apps/{app}") for app in app_names}
+    if not force:
+        unchanged = [app for app in app_names if loaded.is_current(app, hashes[app])]
+        if unchanged:
+            echo_highlight(
+                f"Skipping {len(unchanged)} unchanged apps, use --force to reload them."
+            )
+        app_names = [app for app in app_names if app not in unchanged]
+        if not app_names:
+            echo_success("All apps are up to date.")
+            return
+
+    # Start the apps that took longest last time first so they don't end up
+    # running alone at the end.
+    app_names.sort(key=lambda app: loaded.duration(app, 0), reverse=True)
+    echo_highlight(f"Reloading {len(app_names)} apps, {concurrency} at a time...")
+
+    def on_result(result):
+        if result.ok:
+            loaded.record(result.app, hashes[result.app], result.duration)
+            ephemeral.record_load(result.app, result.duration, stash=stash)
+            echo_success(f"{result.app} loaded in {result.duration:.1f}s")
+        elif not result.skipped:
+            echo_warning(f"{result.app} failed: {result.error}")
+
+    with contextlib.redirect_stdout(sys.stderr) if as_json else contextlib.nullcontext():
+        results = asyncapi.load_apps(
+            app_names, custom=custom, concurrency=concurrency, on_result=on_result,
+            fail_fast=fail_fast,
+        )
+    _echo_load_results(results, as_json)
+    if ephemeral.is_active(stash=stash) and not as_json:
+        comparison = ephemeral.describe("Apps loaded", ephemeral.load_speedup(stash=stash))
+        if comparison:
+            echo_success(comparison)
+
+    failed = [r.app for r in results if not r.ok and not r.skipped]
+    skipped = [r.app for r in results if r.skipped]
+    if failed:
+        click.echo()
+        echo_warning(f'Failed to load: {", ".join(failed)}.')
+        if skipped:
+            echo_warning(f'Not attempted: {", ".join(skipped)}.')
+        click.get_current_context().abort()
+
+
+def _manifest(custom):
+    """The manifest of apps loaded into the custom or selfserve environment."""
+    return manifest.Manifest("custom" if custom else "selfserve", stash=stash)
+
+
+def _echo_load_results(results, as_json=False):
+    if as_json:
+        click.echo(json.dumps([r.as_dict() for r in results], indent=2))
+        return
+    rows = []
+    for result in sorted(results, key=lambda r: r.duration, reverse=True):
+        totals = {"created": 0, "changed": 0, "unchanged": 0}
+        for counts in result.report.get("objects", {}).values():
+            for action in totals:
+                totals[action] += counts.get(action, 0)
+        if result.ok:
+            status = "ok"
+        else:
+            status = "skipped" if result.skipped else "failed"
+        rows.append([
+            result.app,
+            status,
+            round(result.duration, 2),
+            totals["created"],
+            totals["changed"],
+            totals["unchanged"],
+        ])
+    click.echo()
+    click.echo(tabulate(rows, headers=["App", "Status", "Seconds", "Created", "Changed", "Unchanged"]))
+
+
+@cli.command()
+@click.argument("branch", required=True)
+@click.argument("applications", nargs=-1)
+@click.option("--custom", default=False, is_flag=True, help="Reload the apps in Juicebox Custom")
+@click.option("--concurrency", "-j", default=asyncapi.DEFAULT_CONCURRENCY, show_default=True,
+              help="How many apps to fetch and load at the same time.")
+@click.option("--reload/--no-reload", default=True, show_default=True,
+              help="Reload the apps that changed once every checkout is done.")
+def checkout(branch, applications, custom, concurrency, reload):
+    """Check out a branch in several apps at once, every app in apps/ by default"""
+    os.chdir(DEVLANDIA_DIR)
+    if reload:
+        _ensure_running(custom)
+
+    app_names = list(applications) or apps.discover_apps()
+    if not app_names:
+        echo_highlight("No apps found in apps/.")
+        return
+
+    echo_highlight(f"Checking out {branch} in {len(app_names)} apps...")
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        outcomes = list(executor.map(lambda app: _checkout_app(app, branch), app_names))
+    click.echo(tabulate(outcomes, headers=["App", "Status", "Commit"]))
+
+    checked_out = [app for app, status, _ in outcomes if status in ("updated", "unchanged")]
+    failed = [app for app, status, _ in outcomes if status not in ("updated", "unchanged")]
+    if failed:
+        click.echo()
+        echo_warning(f'Failed to check out {branch} in: {", ".join(failed)}.')
+
+    if reload and checked_out:
+        click.echo()
+        _reload_apps(checked_out, custom, concurrency)
+    if failed:
+        click.get_current_context().abort()
+
+
+def _checkout_app(app, branch):
+    """Check out `branch` in one app and describe the outcome."""
+    app_dir = f"apps/{app}"
+    if not os.path.isdir(app_dir):
+        return app, "missing", "not in apps/"
+    try:
+        before, after = apps.checkout_branch(app_dir, branch)
+    except subprocess.CalledProcessError as e:
+        return app, "failed", _git_error(e)
+    if before == after:
+        return app, "unchanged", after[:8]
+    return app, "updated", f"{before[:8]} -> {after[:8]}"
+
+
+def _git_error(error):
+    """The last line git wrote to stderr, which is usually the reason."""
+    lines = (error.stderr or b"").decode("utf-8", "replace").strip().splitlines()
+    return lines[-1] if lines else str(error)
 
 
 @cli.command()
@@ -137,7 +381,9 @@ def add(applications):
 @click.option("--init/--no-init", default=True, help="Initialize VCS repository")
 @click.option("--track/--no-track", default=True, help="Track remote VCS repository")
 @click.option("--custom", is_flag=True, default=False, help="Use custom instance")
-def clone(existing_app, new_app, init, track, custom):
+@click.option("--hardlink", is_flag=True, default=False,
+              help="Hard link files instead of copying them, edits in place change both apps.")
+def clone(existing_app, new_app, init, track, custom, hardlink):
     """Clones an existing application to a new one. Make sure you have a
     Github repo setup for the new app.
     """
@@ -164,6 +410,7 @@ def clone(existing_app, new_app, init, track, custom):
                     init_vcs=init,
                     track_vcs=track,
                     custom=custom,
+                    hardlink=hardlink,
                 )
             except (OSError, ValueError):
                 echo_warning("Cloning failed")
@@ -228,24 +475,16 @@ def remove(applications):
 @click.option("--app", default="", help="Watch a specific app.")
 @click.option("--reload", default=False, help="Refresh browser after file changes.", is_flag=True)
 @click.option("--custom", default=False, is_flag=True, help="Use the Juicebox Custom environment")
+@click.option("--stats", default=False, is_flag=True, help="Show p50/p95 reload timings per app and exit.")
 @cli.command()
-def watch(includejs=False, app="", reload=False, custom=False):
+def watch(includejs=False, app="", reload=False, custom=False, stats=False):
     """Watch for changes in apps and js and reload/rebuild"""
-    jb_watch_proc = Process(
-        target=dockerutil.jb_watch, kwargs={"app": app, "should_reload": reload, "custom": custom}
-    )
-    jb_watch_proc.start()
-    procs = [jb_watch_proc]
+    if stats:
+        reloadstats.print_summary()
+        return
     if reload:
         create_browser_instance(custom=custom)
-
-    if includejs:
-        js_watch_proc = Process(target=dockerutil.js_watch)
-        js_watch_proc.start()
-        procs.append(js_watch_proc)
-
-    for proc in procs:
-        proc.join()
+    dockerutil.jb_watch(app=app, should_reload=reload, custom=custom, includejs=includejs)
 
 
 @click.option("--showall", default=False, help="Show all tagged images", is_flag=True)
@@ -270,6 +509,7 @@ def populate_env_with_secrets():
 
 
 def cleanup_ssh():
+    """Remove the compose file older versions of jb wrote for the tunnel."""
     compose_fn = os.path.join(DEVLANDIA_DIR, "docker-compose-ssh.yml")
     try:
         os.remove(compose_fn)
@@ -278,31 +518,13 @@ def cleanup_ssh():
             raise
 
 
-def get_host_ip():
-    try:
-        ifname = b"docker0"
-        SIOCGIFADDR = 0x8915
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        interface = struct.pack("256s", ifname[:15])
-        addr = fcntl.ioctl(s.fileno(), SIOCGIFADDR, interface)[20:24]
-        return socket.inet_ntoa(addr)
-    except Exception as e:
-        print(
-            "[get_host_ip] Couldn't get docker0 address, falling back to slow method", e
-        )
-        out = dockerutil.client.containers.run(
-            "ubuntu:18.04", "getent hosts host.docker.internal", remove=True
-        )
-        # returns output like:
-        #   192.168.1.1    host.docker.internal
-        #   192.168.1.2    host.docker.internal
-        return out.splitlines()[0].split()[0].decode("ascii")
-
-
 def activate_ssh(environ, custom=False):
     """
     Start the SSH tunnels, and manipulate the environment variables so that
     they are pointing at the right ports.
+
+    :returns: The environment variables to set and the compose overlay that
+        passes them and the Redshift hosts to the Juicebox container
     """
 
     redshifts = {}
@@ -323,42 +545,20 @@ def activate_ssh(environ, custom=False):
         new_conn_string = urlunparse(url._replace(netloc=new_netloc))
         redshifts[envvar] = (url, localport, new_conn_string)
 
-    ssh_links = [
-        ["-L", f"0.0.0.0:{port}:{url.hostname}:5439"]
-        for (url, port, _) in redshifts.values()
-    ]
-    ssh_links = [leaf for tree in ssh_links for leaf in tree]  # flatten
-
-    command = [
-        "ssh",
-        "-T",
-        "-N",
-        "-o",
-        "ServerAliveInterval 30",
-        "-o",
-        "ServerAliveCountMax 3",
-        "-o",
-        "StrictHostKeyChecking=accept-new",
-        *ssh_links,
-        "vpn2.juiceboxdata.com",
-    ]
-    process = Popen(command)
-
-    def cleanup():
-        process.kill()
-        print("waiting for SSH tunnels to stop...")
-        while process.poll() is None:
-            time.sleep(0.2)
-        print("exit status:", process.poll())
-        cleanup_ssh()
-
-    atexit.register(cleanup)
+    forwards = [tunnel.Forward(port, url.hostname) for (url, port, _) in redshifts.values()]
+    manager = tunnel.TunnelManager(stash=stash)
+    try:
+        if manager.ensure(forwards):
+            echo_success("Reusing the SSH tunnel from an earlier jb start.")
+    except RuntimeError as e:
+        echo_warning(str(e))
+        click.get_current_context().abort()
+    _echo_tunnel_status(*manager.status())
+    manager.watch()
 
-    compose_fn = os.path.join(DEVLANDIA_DIR, "docker-compose-ssh.yml")
-    host_addr = get_host_ip()
+    host_addr = dockerutil.get_host_ip(project=dockerutil.project_name())
     service = 'juicebox_custom' if custom else 'juicebox_selfserve'
-    content = {
-        "version": "3.3",
+    overlay = {
         "services": {
             f"{service}": {
                 "extra_hosts": [
@@ -370,15 +570,53 @@ def activate_ssh(environ, custom=False):
             }
         },
     }
-    with open(compose_fn, "w") as compose_file:
-        compose_file.write(yaml.safe_dump(content))
-    # We *could* just write the new connection strings into the YAML content above,
+    # We *could* just write the new connection strings into the overlay above,
     # but that would mean leaving secrets around on disk, so we'll just put them into
     # the environment instead:
-    return {
+    env = {
         envvar: new_conn_string
         for (envvar, (_, _, new_conn_string)) in redshifts.items()
     }
+    return env, overlay
+
+
+def _echo_tunnel_status(pid, checks):
+    if pid is None:
+        echo_warning("The SSH tunnel is not running.")
+    rows = []
+    for forward, latency in checks:
+        status = "ok" if latency is not None else "down"
+        rows.append([forward.local_port, forward.remote_host, status,
+                     round(latency * 1000) if latency is not None else "-"])
+    if rows:
+        click.echo(tabulate(rows, headers=["Port", "Redshift host", "Status", "Latency (ms)"]))
+
+
+@cli.group(name="tunnel")
+def tunnel_group():
+    """Manage the SSH tunnel to Redshift started by jb start --ssh"""
+    pass
+
+
+@tunnel_group.command()
+def status():
+    """Check the SSH tunnel and the latency of every forwarded port"""
+    manager = tunnel.TunnelManager(stash=stash)
+    pid, checks = manager.status()
+    if pid is not None:
+        echo_success(f"SSH tunnel to {manager.host} is running (pid {pid}).")
+    _echo_tunnel_status(pid, checks)
+    if pid is None or any(latency is None for _, latency in checks):
+        click.get_current_context().exit(1)
+
+
+@tunnel_group.command(name="stop")
+def stop_tunnel():
+    """Close the SSH tunnel"""
+    if tunnel.TunnelManager(stash=stash).stop():
+        echo_success("SSH tunnel closed.")
+    else:
+        echo_highlight("The SSH tunnel was not running.")
 
 
 @cli.command()
@@ -421,6 +659,10 @@ def activate_ssh(environ, custom=False):
 )
 @click.option("--custom", default=False, is_flag=True, help="Start up the custom image")
 @click.option("--emulate", default=False, is_flag=True, help="If you're unable to pull an ARM image, this flag will let you fall back and get a normal devlandia image to run in emulation.  This isn't foolproof, and there's no guarantee it will run, just for additional compatability.")
+@click.option("--ephemeral", "is_ephemeral", default=False, is_flag=True,
+              help="Keep postgres and redis in memory without durability, for throwaway sessions.")
+@click.option("--venv-cache/--no-venv-cache", default=True, show_default=True,
+              help="Keep the virtualenv of the core workflow in a volume keyed by the requirements.")
 @click.pass_context
 def start(
     ctx,
@@ -434,7 +676,9 @@ def start(
     dev_recipe,
     dev_snapshot,
     custom,
-    emulate
+    emulate,
+    is_ephemeral,
+    venv_cache,
 ):
     """Configure the environment and start Juicebox"""
     log = toplog.bind(function="start")
@@ -570,10 +814,48 @@ def start(
             print("Can't activate hstm on selfserve, add the --custom flag")
             sys.exit(1)
 
+    ephemeral.switch(is_ephemeral, stash=stash)
+    if _manifest(is_custom).use_image(tag):
+        echo_highlight(f"Now running {tag}, apps will be fully reloaded on their next load.")
+
     cleanup_ssh()
+    overlays = []
     if ssh:
-        environ.update(activate_ssh(environ, custom=is_custom))
-    dockerutil.up(env=environ, ganesha=ganesha, arch=arch, custom=is_custom, emulate=emulate)
+        ssh_env, ssh_overlay = activate_ssh(environ, custom=is_custom)
+        environ.update(ssh_env)
+        overlays.append(ssh_overlay)
+    if workflow == "core" and venv_cache:
+        overlays.append(_venv_cache_overlay(core_path, tag, arch, emulate, is_custom))
+    if is_ephemeral:
+        echo_highlight("Ephemeral mode: the databases live in memory and are gone after jb stop.")
+        overlays.append(ephemeral.overlay())
+    port = 8001 if is_custom else 8000
+    ephemeral.time_startup(f"http://localhost:{port}/", is_ephemeral, stash=stash,
+                           on_ready=lambda seconds: _echo_startup(seconds, is_ephemeral))
+    dockerutil.up(env=environ, ganesha=ganesha, arch=arch, custom=is_custom, emulate=emulate,
+                  overlays=overlays)
+
+
+def _venv_cache_overlay(core_path, tag, arch, emulate, custom):
+    venvs = pipcache.VenvCache(dockerutil.client, stash=stash)
+    image = dockerutil.parse_dc_file(tag, emulate=emulate, custom=custom)
+    volume, created = venvs.ensure(core_path, image)
+    if created:
+        echo_highlight(f"The requirements changed, installing them into {volume}.")
+    service = "juicebox_custom" if custom else "juicebox_selfserve"
+    # Only docker-compose.arm.custom.yml installs the arm requirements
+    arm = custom and arch in ["arm", "i386"]
+    requirements = "requirements-arm.txt" if arm else "requirements.txt"
+    return venvs.overlay(service, volume, requirements)
+
+
+def _echo_startup(seconds, is_ephemeral):
+    echo_success(f"Juicebox is up after {seconds:.1f}s.")
+    if is_ephemeral:
+        comparison = ephemeral.describe("Startup and migrations ran",
+                                        ephemeral.startup_speedup(stash=stash))
+        if comparison:
+            echo_success(comparison)
 
 
 @click.argument("days", nargs=1, required=False)
@@ -810,44 +1092,300 @@ def activate_snapshot():
 @click.option(
     "--ganesha", default=False, help="Select ganesha docker image to stop", is_flag=True
 )
+@click.option(
+    "--fast", default=False, is_flag=True,
+    help="Kill the containers that keep no data instead of waiting for them to shut down",
+)
 @click.pass_context
-def stop(ctx, clean, custom, ganesha):
+def stop(ctx, clean, custom, ganesha, fast):
     """Stop a running juicebox in this environment"""
     os.chdir(DEVLANDIA_DIR)
     dockerutil.ensure_home()
-    running_custom, running_selfserve = dockerutil.is_running()
     arch = platform.processor()
     if clean:
         dockerutil.destroy(custom=custom, arch=arch, ganesha=ganesha)
-    elif running_custom or running_selfserve:
-        # Stop both custom and selfserve if they are running
-        # because we're stopping common services
-        if running_selfserve:
-            dockerutil.halt(custom=False, arch=arch)
-        if running_custom:
-            dockerutil.halt(custom=True, arch=arch)
-        echo_highlight("Juicebox is no longer running.")
-    else:
+        # Both databases live in the shared postgres container, so every app
+        # that was loaded is gone.
+        _manifest(custom=True).forget()
+        _manifest(custom=False).forget()
+        return
+
+    # Custom and selfserve are stopped together since they share the
+    # common services
+    results = dockerutil.stop_project(fast=fast)
+    if not results:
         echo_highlight("Juicebox is not running")
+        return
+    rows = [[r.service, r.action, round(r.seconds, 1)] for r in results]
+    click.echo(tabulate(rows, headers=["Service", "Action", "Seconds"]))
+    failed = [r for r in results if r.error]
+    for result in failed:
+        echo_warning(f"Could not stop {result.name}: {result.error}")
+    if failed:
+        ctx.exit(1)
+    echo_highlight("Juicebox is no longer running.")
+
+
+@cli.command(name="compose-bench")
+@click.option("--rounds", default=3, show_default=True,
+              help="How many times to stop and start Juicebox with each backend.")
+@click.option("--backend", "backends", multiple=True, type=click.Choice(composebackend.BACKENDS),
+              help="Only time this backend, can be repeated.")
+@click.option("--yes", "-y", default=False, is_flag=True, help="Don't ask before restarting Juicebox.")
+def compose_bench(rounds, backends, yes):
+    """Time stopping and starting Juicebox with each compose backend"""
+    os.chdir(DEVLANDIA_DIR)
+    running_custom, running_selfserve = dockerutil.is_running()
+    if not (running_custom or running_selfserve):
+        echo_warning("Juicebox must be running to benchmark stopping and starting it.")
+        sys.exit(1)
+    custom = bool(running_custom) and not running_selfserve
+    backends = backends or composebackend.available_backends(client=dockerutil.client)
+    if not yes:
+        click.confirm(f"This stops and starts Juicebox {rounds * len(backends)} times, continue?",
+                      abort=True)
+
+    arch = platform.processor()
+    rows = []
+    for backend in backends:
+        stops, starts = [], []
+        for _ in range(rounds):
+            began = time.perf_counter()
+            dockerutil.halt(arch=arch, custom=custom, backend=backend)
+            stops.append(time.perf_counter() - began)
+            began = time.perf_counter()
+            dockerutil.resume(arch=arch, custom=custom, backend=backend)
+            starts.append(time.perf_counter() - began)
+        rows.append([backend, round(median(stops), 2), round(median(starts), 2)])
+        click.echo(f"{backend}: stop {rows[-1][1]}s, start {rows[-1][2]}s")
+    click.echo()
+    click.echo(tabulate(rows, headers=["Backend", "Stop (median s)", "Start (median s)"]))
+
+
+def _change(now, before):
+    if now is None or not before:
+        return None
+    return (now - before) / before * 100
+
+
+@cli.command(name="bench")
+@click.argument("app")
+@click.option("--custom", default=False, is_flag=True, help="Use the Juicebox Custom environment")
+@click.option("--concurrency", "-c", default=stackbench.DEFAULT_CONCURRENCY, show_default=True,
+              help="Requests in flight at a time.")
+@click.option("--requests", "-n", "count", default=stackbench.DEFAULT_REQUESTS, show_default=True,
+              help="Measured requests per stack.")
+@click.option("--warmup", default=stackbench.WARMUP, show_default=True,
+              help="Requests per stack before measuring.")
+@click.option("--url", "template", default=stackbench.STACK_URL, show_default=True,
+              help="The path of a stack, {app} and {stack} are filled in.")
+@click.option("--label", help="Save the run under this name [default: <image>@<branch>]")
+@click.option("--compare", "baseline", help="Compare with the latest run saved under this name.")
+@click.option("--save/--no-save", default=True, show_default=True, help="Save the results.")
+def bench_app(app, custom, concurrency, count, warmup, template, label, baseline, save):
+    """Measure how fast the stacks of an app render under load"""
+    os.chdir(DEVLANDIA_DIR)
+    try:
+        stacks = apps.discover_stacks(app)
+    except ValueError as e:
+        echo_warning(str(e))
+        click.get_current_context().exit(1)
+    if not stacks:
+        echo_warning(f"There are no stacks in apps/{app}.")
+        click.get_current_context().exit(1)
+    container = dockerutil.juicebox_container(custom)
+    if container is None:
+        echo_warning("bench only works when Juicebox is running")
+        click.get_current_context().exit(1)
+    before = None
+    if baseline:
+        before = stackbench.last_run(app, baseline)
+        if before is None:
+            echo_warning(f"There is no saved run of {app} named {baseline}.")
+            click.get_current_context().exit(1)
+    image = container.image.tags[0] if container.image.tags else container.image.short_id
+    branch = apps.current_branch(os.path.join("apps", app)) or "unknown"
+    label = label or f"{image}@{branch}"
+
+    echo_highlight(f"Requesting {len(stacks)} stacks of {app} {count} times each, "
+                   f"{concurrency} at a time...")
+    try:
+        results = stackbench.run_bench(
+            stackbench.stack_urls(app, stacks, custom=custom, template=template), custom=custom,
+            concurrency=concurrency, count=count, warmup=warmup)
+    except RuntimeError as e:
+        echo_warning(str(e))
+        click.get_current_context().exit(1)
+
+    headers = ["Stack", "Errors", "Req/s", "p50 ms", "p95 ms", "p99 ms"]
+    rows = []
+    for result in results:
+        rows.append([result.stack, result.errors, result.throughput]
+                    + [None if p is None else p * 1000 for p in (result.p50, result.p95, result.p99)])
+        if before is not None:
+            previous = before.get(result.stack)
+            rows[-1] += [_change(result.p50, previous and previous.p50),
+                         _change(result.p95, previous and previous.p95)]
+    if before is not None:
+        headers += [f"p50 vs {baseline} %", f"p95 vs {baseline} %"]
+    click.echo(tabulate(rows, headers=headers, floatfmt=".1f", missingval="-"))
+    if any(result.errors for result in results):
+        echo_warning("Some requests failed, check the URL with --url and jb logs.")
+    if save:
+        path = stackbench.save_run(app, label, results, image=image, branch=branch, custom=custom,
+                                   concurrency=concurrency, url=template)
+        echo_success(f"Saved as {label} in {path}, compare with jb bench {app} --compare {label}")
+
+
+@cli.command()
+@click.argument("services", nargs=-1)
+@click.option("--since", help="Only show lines newer than this, like 10m, 2h or 2024-05-02T10:00.")
+@click.option("--tail", type=int, help="Lines of history per container [default: 100, all with --since]")
+@click.option("--grep", "pattern", help="Only show lines matching this regular expression.")
+@click.option("--level", type=click.Choice(logstream.LEVELS, case_sensitive=False),
+              help="Only show lines of this level and above.")
+@click.option("--follow/--no-follow", default=True, show_default=True, help="Keep streaming new lines.")
+def logs(services, since, tail, pattern, level, follow):
+    """Show the logs of the devlandia services, merged by time"""
+    try:
+        since = logstream.parse_since(since) if since else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--since")
+    if pattern:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise click.BadParameter(f"Invalid regular expression: {e}", param_hint="--grep")
+    os.chdir(DEVLANDIA_DIR)
+    stream = logstream.LogStream(
+        dockerutil.client, dockerutil.project_name(), services=services, pattern=pattern,
+        level=level, since=since, tail=tail, follow=follow)
+    try:
+        containers = stream.containers()
+    except ValueError as e:
+        echo_warning(str(e))
+        click.get_current_context().exit(1)
+    if not containers:
+        echo_warning("There are no devlandia containers, start them with jb start.")
+        click.get_current_context().exit(1)
+    width = max(len(service) for service in containers)
+    colors = {}
+    try:
+        for batch in stream:
+            click.echo("\n".join(
+                click.style(f"{line.service:<{width}} |", fg=colors.setdefault(
+                    line.service, LOG_COLORS[len(colors) % len(LOG_COLORS)])) + f" {line.text}"
+                for line in batch
+            ))
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command(name="stats")
+@click.argument("services", nargs=-1)
+@click.option("--interval", default=containerstats.INTERVAL, show_default=True, help="Seconds between refreshes.")
+@click.option("--record", type=click.Path(dir_okay=False),
+              help="Also write every sample to this .csv or .jsonl file.")
+@click.option("--count", type=int, help="Stop after this many refreshes.")
+def container_stats(services, interval, record, count):
+    """Show the CPU, memory, disk and network use of the devlandia containers"""
+    record = os.path.abspath(record) if record else None
+    os.chdir(DEVLANDIA_DIR)
+    stream = containerstats.StatsStream(dockerutil.client, dockerutil.project_name(), services=services)
+    try:
+        containers = stream.containers()
+    except ValueError as e:
+        echo_warning(str(e))
+        click.get_current_context().exit(1)
+    if not containers:
+        echo_warning("There are no running devlandia containers, start them with jb start.")
+        click.get_current_context().exit(1)
+
+    latest = {}
+    refreshes = 0
+    with contextlib.ExitStack() as stack:
+        recorder = None
+        if record:
+            try:
+                recorder = stack.enter_context(containerstats.Recorder(record))
+            except ValueError as e:
+                raise click.BadParameter(str(e), param_hint="--record")
+        try:
+            for samples in stream.samples(interval):
+                latest.update((taken.service, taken) for taken in samples)
+                if recorder:
+                    recorder.write(samples)
+                click.clear()
+                click.echo(tabulate(
+                    [[taken.service, taken.cpu, taken.memory / 1024 ** 2,
+                      taken.memory / taken.memory_limit * 100 if taken.memory_limit else 0,
+                      taken.block_read / 1024 ** 2, taken.block_write / 1024 ** 2,
+                      taken.net_rx / 1024, taken.net_tx / 1024, taken.pids]
+                     for _, taken in sorted(latest.items())],
+                    headers=["Service", "CPU %", "Mem MB", "Mem %", "Read MB/s", "Write MB/s",
+                             "Net in KB/s", "Net out KB/s", "PIDs"],
+                    floatfmt=".1f",
+                ))
+                refreshes += 1
+                if count and refreshes >= count:
+                    break
+        except KeyboardInterrupt:
+            pass
+    if recorder:
+        echo_success(f"Recorded {recorder.count} samples in {record}.")
 
 
 @cli.command()
 @click.option("--custom", default=False, is_flag=True, help="Which environment to run the command in.")
-def kick(custom=False):
+@click.option("--timeout", default=appserver.TIMEOUT, show_default=True,
+              help="Seconds each step of the restart may take.")
+def kick(custom=False, timeout=appserver.TIMEOUT):
     """Restart the Juicebox process without restarting all of devlandia"""
-    running = dockerutil.is_running()
-    if not running[1] and not custom:
+    os.chdir(DEVLANDIA_DIR)
+    container = dockerutil.juicebox_container(custom)
+    if container is None:
         echo_warning("kick only works when Juicebox is running")
-        return
-    # This is a little heavy-handed but it's kinda hard to figure out exactly which
-    # process we need to HUP
-    container_name = "devlandia_juicebox_selfserve_1"
-    if custom:
-        container_name = "devlandia_juicebox_custom_1"
-    subprocess.check_call(
-        ["docker", "exec", "-it", container_name, "killall", "-HUP", "/venv/bin/python"]
-    )
-    echo_success("Juicebox has been restarted.")
+        click.get_current_context().exit(1)
+    port = 8001 if custom else 8000
+    kicker = appserver.Kicker(container, f"http://localhost:{port}/health_check", timeout=timeout)
+    click.echo("Restarting Juicebox...")
+    try:
+        kicked = kicker.kick()
+    except RuntimeError as e:
+        echo_warning(str(e))
+        click.get_current_context().exit(1)
+    echo_success(f"Juicebox has been restarted ({kicked.workers} {kicked.server} processes) "
+                 f"and answered after {kicked.seconds:.1f}s.")
+
+
+@cli.command()
+@click.option("--custom", default=False, is_flag=True, help="Which environment to run the command in.")
+@click.option("--duration", default=profiler.DURATION, show_default=True, help="Seconds to sample for.")
+@click.option("--rate", default=profiler.RATE, show_default=True, help="Samples per second.")
+@click.option("--output", type=click.Path(dir_okay=False),
+              help="Where to write the speedscope profile [default: profile-<time>.speedscope.json]")
+@click.option("--top", default=profiler.TOP, show_default=True, help="How many of the hottest frames to show.")
+def profile(custom, duration, rate, output, top):
+    """Sample the running Juicebox with py-spy and show where the time goes"""
+    output = os.path.abspath(output or time.strftime("profile-%Y%m%d-%H%M%S.speedscope.json"))
+    os.chdir(DEVLANDIA_DIR)
+    container = dockerutil.juicebox_container(custom)
+    if container is None:
+        echo_warning("profile only works when Juicebox is running")
+        click.get_current_context().exit(1)
+    sampler = profiler.Profiler(dockerutil.client, container, duration=duration, rate=rate)
+    try:
+        pid, what = sampler.target()
+        echo_highlight(f"Profiling {what} for {duration}s, use Juicebox now...")
+        frames = profiler.hot_frames(sampler.record(pid, output), top=top)
+    except RuntimeError as e:
+        echo_warning(str(e))
+        click.get_current_context().exit(1)
+    click.echo(tabulate(
+        [[frame.name, frame.location, frame.own * 100, frame.total * 100] for frame in frames],
+        headers=["Function", "Location", "Own %", "Total %"], floatfmt=".1f",
+    ))
+    echo_success(f"Wrote {output}, open it at https://www.speedscope.app for a flamegraph.")
 
 
 @cli.command()
@@ -890,6 +1428,189 @@ def clear_cache(custom):
         click.get_current_context().abort()
 
 
+@cli.group()
+def cache():
+    """Manage the local caches kept by jb"""
+    pass
+
+
+@cache.command()
+@click.option("--max-size", default="5G", show_default=True,
+              help="Disk space the app repository mirrors may use, like 500M or 2G.")
+@click.option("--dry-run", default=False, is_flag=True, help="Only list the mirrors that would be removed.")
+def prune(max_size, dry_run):
+    """Remove the least recently used app repository mirrors"""
+    try:
+        limit = gitcache.parse_size(max_size)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--max-size")
+    removed = gitcache.prune(limit, dry_run=dry_run)
+    if not removed:
+        echo_success(f"The app repository mirrors fit in {max_size}.")
+        return
+    rows = [
+        [app, size / 1024 ** 2, time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used))]
+        for app, _, size, last_used in removed
+    ]
+    click.echo(tabulate(rows, headers=["App", "MB", "Last used"], floatfmt=".1f"))
+    freed = sum(m[2] for m in removed) / 1024 ** 2
+    if dry_run:
+        echo_highlight(f"Would free {freed:.1f} MB.")
+    else:
+        echo_success(f"Freed {freed:.1f} MB.")
+
+
+@cache.command()
+@click.option("--keep", default=pipcache.KEEP, show_default=True,
+              help="How many of the most recently used virtualenvs to keep.")
+@click.option("--prune", "do_prune", default=False, is_flag=True, help="Remove the other virtualenvs.")
+def venvs(keep, do_prune):
+    """List the core workflow virtualenv volumes"""
+    venv_cache = pipcache.VenvCache(dockerutil.client, stash=stash)
+    if do_prune:
+        removed = venv_cache.prune(keep=keep)
+        for name in removed:
+            click.echo(f"Removed {name}")
+        echo_success(f"Removed {len(removed)} virtualenvs.")
+        return
+    rows = [
+        [name, time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used)) if last_used else "never"]
+        for name, last_used in venv_cache.list()
+    ]
+    if not rows:
+        echo_highlight("There are no virtualenv volumes yet.")
+        return
+    click.echo(tabulate(rows, headers=["Volume", "Last used"]))
+
+
+@contextlib.contextmanager
+def _redis():
+    redis = rediscache.Redis()
+    try:
+        with redis:
+            yield redis
+    except (OSError, rediscache.RedisError) as e:
+        host, port = redis.address
+        echo_warning(f"Could not use redis at {host}:{port}, is Juicebox running? ({e})")
+        click.get_current_context().exit(1)
+
+
+@cache.command(name="clear")
+@click.argument("pattern", required=False)
+@click.option("--app", help="Only remove the keys of this app.")
+@click.option("--all", "everything", default=False, is_flag=True, help="Remove every key.")
+@click.option("--dry-run", default=False, is_flag=True, help="Only count the keys that would be removed.")
+def cache_clear(pattern, app, everything, dry_run):
+    """Remove cached keys from redis without blocking it
+
+    PATTERN is a redis glob like ``:1:juicebox:*``.
+    """
+    if sum(1 for scope in (pattern, app, everything) if scope) != 1:
+        raise click.UsageError("Pass one of PATTERN, --app or --all.")
+    only = None
+    if app:
+        pattern, only = rediscache.app_pattern(app), rediscache.app_key_re(app)
+    elif everything:
+        pattern = "*"
+    with _redis() as redis:
+        cleared = rediscache.clear(redis, pattern, dry_run=dry_run, only=only)
+    verb = "Would remove" if dry_run else "Removed"
+    scope = f"of {app}" if app else f"matching {pattern}"
+    echo_success(f"{verb} {cleared.keys} keys {scope} in {cleared.seconds * 1000:.1f} ms.")
+
+
+@cache.command(name="stats")
+@click.option("--pattern", default="*", show_default=True, help="Only count the keys matching this redis glob.")
+@click.option("--depth", default=rediscache.PREFIX_DEPTH, show_default=True,
+              help="How many ':' separated key segments make up a prefix.")
+@click.option("--top", default=20, show_default=True, help="How many prefixes to show.")
+def cache_stats(pattern, depth, top):
+    """Show the number of keys and the memory they use by prefix"""
+    with _redis() as redis:
+        rows = rediscache.stats(redis, pattern=pattern, depth=depth)
+    if not rows:
+        echo_highlight(f"There are no keys matching {pattern}.")
+        return
+    click.echo(tabulate(
+        [[row.db, row.prefix, row.keys, row.size / 1024] for row in rows[:top]],
+        headers=["DB", "Prefix", "Keys", "KB"], floatfmt=".1f",
+    ))
+    if len(rows) > top:
+        click.echo(f"... and {len(rows) - top} more prefixes")
+    total = sum(row.size for row in rows) / 1024 ** 2
+    echo_highlight(f"{sum(row.keys for row in rows)} keys using {total:.1f} MB.")
+
+
+@cli.group()
+def db():
+    """Snapshot and restore the Juicebox databases"""
+    pass
+
+
+def _snapshots():
+    return dbsnapshot.Snapshots(dockerutil.client, dockerutil.project_name(), stash=stash)
+
+
+@db.command(name="snapshot")
+@click.argument("name")
+@click.option("--method", type=click.Choice(dbsnapshot.METHODS), default="volume", show_default=True,
+              help="Copy the postgres volume while postgres is paused, or pg_dump each database.")
+@click.option("--jobs", "-j", default=dbsnapshot.DEFAULT_JOBS, show_default=True,
+              help="How many tables pg_dump works on at once.")
+@click.option("--force", default=False, is_flag=True, help="Replace a snapshot with the same name.")
+def db_snapshot(name, method, jobs, force):
+    """Save the Juicebox databases as snapshot NAME"""
+    os.chdir(DEVLANDIA_DIR)
+    try:
+        snapshot = _snapshots().snapshot(name, method=method, jobs=jobs, force=force)
+    except RuntimeError as e:
+        echo_warning(str(e))
+        click.get_current_context().exit(1)
+    echo_success(f"Saved snapshot {name} ({snapshot.size / 1024 ** 2:.1f} MB) "
+                 f"in {snapshot.seconds:.1f}s.")
+
+
+@db.command(name="restore")
+@click.argument("name")
+@click.option("--jobs", "-j", default=dbsnapshot.DEFAULT_JOBS, show_default=True,
+              help="How many tables pg_restore works on at once.")
+def db_restore(name, jobs):
+    """Replace the Juicebox databases with snapshot NAME"""
+    os.chdir(DEVLANDIA_DIR)
+    try:
+        snapshot = _snapshots().restore(name, jobs=jobs)
+    except RuntimeError as e:
+        echo_warning(str(e))
+        click.get_current_context().exit(1)
+    echo_success(f"Restored snapshot {name} ({snapshot.size / 1024 ** 2:.1f} MB) "
+                 f"in {snapshot.seconds:.1f}s.")
+
+
+@db.command(name="ls")
+def db_ls():
+    """List the database snapshots"""
+    os.chdir(DEVLANDIA_DIR)
+    snapshots = _snapshots().list()
+    if not snapshots:
+        echo_highlight("There are no database snapshots.")
+        return
+    rows = [[s.name, s.method, s.size / 1024 ** 2, s.seconds, s.created] for s in snapshots]
+    click.echo(tabulate(rows, headers=["Name", "Method", "MB", "Seconds", "Created"], floatfmt=".1f"))
+
+
+@db.command(name="rm")
+@click.argument("name")
+def db_rm(name):
+    """Delete snapshot NAME"""
+    os.chdir(DEVLANDIA_DIR)
+    try:
+        _snapshots().remove(name)
+    except RuntimeError as e:
+        echo_warning(str(e))
+        click.get_current_context().exit(1)
+    echo_success(f"Deleted snapshot {name}.")
+
+
 @cli.command()
 @click.argument("tag", required=False)
 def pull(tag=None):
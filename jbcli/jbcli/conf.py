@@ -20,3 +20,25 @@ DEFAULT_MODE = os.environ.get('JB_DEFAULT_MODE', 'local')
 
 # vagrant or docker eventually
 BACKEND_DRIVER = os.environ.get('JB_BACKEND_DRIVER', 'vagrant')
+
+# Where jbcli keeps git objects shared between app checkouts
+GIT_CACHE_DIR = os.path.expanduser(
+    os.environ.get('JB_GIT_CACHE_DIR', '~/.cache/juicebox/git'))
+
+# The host the SSH tunnels to Redshift go through, and the ControlMaster
+# socket that lets jb reuse the connection
+TUNNEL_HOST = os.environ.get('JB_TUNNEL_HOST', 'vpn2.juiceboxdata.com')
+TUNNEL_CONTROL_PATH = os.path.expanduser(
+    os.environ.get('JB_TUNNEL_CONTROL_PATH', '~/.config/juicebox/tunnel.sock'))
+
+# Where jb keeps the merged docker-compose configurations it runs with
+COMPOSE_CACHE_DIR = os.path.expanduser(
+    os.environ.get('JB_COMPOSE_CACHE_DIR', '~/.cache/juicebox/compose'))
+
+# How jb runs docker compose: auto, v1 (docker-compose), v2 (docker compose)
+# or native (the Docker SDK for stop and start)
+COMPOSE_BACKEND = os.environ.get('JB_COMPOSE_BACKEND', 'auto')
+
+# The devlandia redis service, as exposed on the host
+REDIS_HOST = os.environ.get('JB_REDIS_HOST', '127.0.0.1')
+REDIS_PORT = int(os.environ.get('JB_REDIS_PORT', '6379'))
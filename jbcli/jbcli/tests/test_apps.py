@@ -1,7 +1,12 @@
 import io
+import os
 import shutil
+import subprocess
 from subprocess import CalledProcessError
 
+import pytest
+import yaml
+
 from mock import call, patch, ANY
 
 from ..utils import apps
@@ -144,13 +149,13 @@ class TestApps:
         assert url_mock.mock_calls == [call('sugar')]
         assert echo_mock.call_count == 1
 
-    @patch('jbcli.utils.apps.shutil')
+    @patch('jbcli.utils.apps.check_app_yaml')
+    @patch('jbcli.utils.apps.copy_app')
     @patch('jbcli.utils.apps.os')
     @patch('jbcli.utils.apps.replace_in_yaml')
     @patch('jbcli.utils.apps.perform_init_vcs')
-    def test_clone(self, vcs_mock, ry_mock, os_mock, sh_mock):
-        replacements = {'slug:': 'cookies', 'label:': 'cookies', 'id:': ANY}
-        os_mock.listdir.return_value = ['.file', 'flour', 'water']
+    def test_clone(self, vcs_mock, ry_mock, os_mock, copy_mock, check_mock):
+        replacements = {'slug': 'cookies', 'label': 'cookies', 'id': ANY}
         os_mock.path.join.return_value = 'apps/cookies/app.yaml'
         apps.clone('cookies', 'apps/sugar', 'apps/cookies')
         assert vcs_mock.mock_calls == [
@@ -162,17 +167,20 @@ class TestApps:
         assert os_mock.mock_calls == [
             call.path.join('apps/cookies', 'app.yaml')
         ]
-        assert sh_mock.mock_calls == [
-            call.copytree('apps/sugar', 'apps/cookies', ignore=ANY)
+        assert copy_mock.mock_calls == [
+            call('apps/sugar', 'apps/cookies', hardlink=False)
+        ]
+        assert check_mock.mock_calls == [
+            call('apps/cookies/app.yaml', replacements)
         ]
 
-    @patch('jbcli.utils.apps.shutil')
+    @patch('jbcli.utils.apps.check_app_yaml')
+    @patch('jbcli.utils.apps.copy_app')
     @patch('jbcli.utils.apps.os')
     @patch('jbcli.utils.apps.replace_in_yaml')
     @patch('jbcli.utils.apps.perform_init_vcs')
-    def test_clone_no_init(self, vcs_mock, ry_mock, os_mock, sh_mock):
-        replacements = {'slug:': 'cookies', 'label:': 'cookies', 'id:': ANY}
-        os_mock.listdir.return_value = ['.file', 'flour', 'water']
+    def test_clone_no_init(self, vcs_mock, ry_mock, os_mock, copy_mock, check_mock):
+        replacements = {'slug': 'cookies', 'label': 'cookies', 'id': ANY}
         os_mock.path.join.return_value = 'apps/cookies/app.yaml'
         apps.clone('cookies', 'apps/sugar', 'apps/cookies', False)
         assert vcs_mock.mock_calls == []
@@ -182,19 +190,19 @@ class TestApps:
         assert os_mock.mock_calls == [
             call.path.join('apps/cookies', 'app.yaml'),
         ]
-        assert sh_mock.mock_calls == [
-            call.copytree('apps/sugar', 'apps/cookies', ignore=ANY)
+        assert copy_mock.mock_calls == [
+            call('apps/sugar', 'apps/cookies', hardlink=False)
         ]
 
-    @patch('jbcli.utils.apps.shutil')
+    @patch('jbcli.utils.apps.check_app_yaml')
+    @patch('jbcli.utils.apps.copy_app')
     @patch('jbcli.utils.apps.os')
     @patch('jbcli.utils.apps.replace_in_yaml')
     @patch('jbcli.utils.apps.perform_init_vcs')
-    def test_clone_no_track(self, vcs_mock, ry_mock, os_mock, sh_mock):
-        replacements = {'slug:': 'cookies', 'label:': 'cookies', 'id:': ANY}
-        os_mock.listdir.return_value = ['.file', 'flour', 'water']
+    def test_clone_no_track(self, vcs_mock, ry_mock, os_mock, copy_mock, check_mock):
+        replacements = {'slug': 'cookies', 'label': 'cookies', 'id': ANY}
         os_mock.path.join.return_value = 'apps/cookies/app.yaml'
-        apps.clone('cookies', 'apps/sugar', 'apps/cookies', True, False)
+        apps.clone('cookies', 'apps/sugar', 'apps/cookies', True, False, hardlink=True)
         assert vcs_mock.mock_calls == [
             call('cookies', 'apps/cookies', False)
         ]
@@ -204,38 +212,238 @@ class TestApps:
         assert os_mock.mock_calls == [
             call.path.join('apps/cookies', 'app.yaml'),
         ]
-        assert sh_mock.mock_calls == [
-            call.copytree('apps/sugar', 'apps/cookies', ignore=ANY)
+        assert copy_mock.mock_calls == [
+            call('apps/sugar', 'apps/cookies', hardlink=True)
         ]
 
     @patch('jbcli.utils.apps.echo_warning')
-    @patch('jbcli.utils.apps.shutil.copytree')
-    def test_clone_copy_fail(self, sh_mock, echo_mock):
-        sh_mock.side_effect = shutil.ExecError()
+    @patch('jbcli.utils.apps.copy_app')
+    def test_clone_copy_fail(self, copy_mock, echo_mock):
+        copy_mock.side_effect = shutil.ExecError()
         apps.clone('cookies', 'apps/sugar', 'apps/cookies')
         assert echo_mock.mock_calls == [
             call('Cloning failed on the copy step'),
         ]
-        assert sh_mock.mock_calls == [
-            call.copytree('apps/sugar', 'apps/cookies', ignore=ANY)]
+        assert copy_mock.mock_calls == [
+            call('apps/sugar', 'apps/cookies', hardlink=False)]
 
-    @patch('jbcli.utils.apps.tempfile')
-    @patch('jbcli.utils.apps.shutil.move')
-    @patch('jbcli.utils.apps.os')
-    @patch('six.moves.builtins.open')
-    def test_replace_in_yaml(self, open_mock, os_mock, sh_mock, temp_mock):
-        replacements = {'slug:': 'cookies', 'label:': 'cookies',
-                        'id:': 'aedc2134'}
-        new_file = io.StringIO()
-        temp_mock.mkstemp.return_value = (1, 2)
-        open_mock.side_effect = [
-            new_file,
-            io.StringIO(u'slug: 1234\nugh: ugh\nlabel: cake\nid: batman')
-        ]
-        apps.replace_in_yaml('/tmp/cookies.yaml', replacements)
-        assert open_mock.mock_calls == [call(2, 'w'),
-                                        call('/tmp/cookies.yaml')]
-        assert os_mock.mock_calls == [call.close(1),
-                                      call.remove('/tmp/cookies.yaml')]
-        assert sh_mock.mock_calls == [call.move(2, '/tmp/cookies.yaml')]
-        assert temp_mock.mkstemp.call_count == 1
+    @patch('jbcli.utils.apps.perform_init_vcs')
+    def test_clone_files(self, vcs_mock, tmpdir):
+        """Ignored files are left behind and app.yaml survives a YAML round trip"""
+        source = tmpdir.mkdir('sugar')
+        source.join('app.yaml').write('slug: sugar\nlabel: Sugar\nid: abcd1234\n')
+        source.join('.gitignore').write('# Build output\nbuilds/\n*.log\n/local.yaml\n')
+        source.mkdir('stacks').join('overview.yaml').write('label: Overview\n')
+        source.join('stacks', 'local.yaml').write('kept: true\n')
+        source.join('local.yaml').write('ignored: true\n')
+        source.join('debug.log').write('ignored')
+        source.mkdir('builds').join('bundle.js').write('ignored')
+        source.mkdir('tmp').join('scratch').write('ignored')
+        source.join('stacks', 'overview.pyc').write('ignored')
+        assert apps.app_files(str(source)) == [
+            '.gitignore', 'app.yaml', 'stacks/local.yaml', 'stacks/overview.yaml'
+        ]
+
+        dest = tmpdir.join('cookies')
+        with patch('jbcli.utils.apps.uuid4', return_value='01234567-89ab'):
+            assert apps.clone('cookies', str(source), str(dest), hardlink=True)
+        assert sorted(p.relto(dest) for p in dest.visit() if p.isfile()) == [
+            '.gitignore', 'app.yaml', 'stacks/local.yaml', 'stacks/overview.yaml'
+        ]
+        # The id stays a string even though it looks like an octal number
+        assert yaml.safe_load(dest.join('app.yaml').read()) == {
+            'slug': 'cookies', 'label': 'cookies', 'id': '01234567'
+        }
+        # Hard links share content, but app.yaml was replaced, not edited
+        assert os.path.samefile(str(source.join('stacks', 'overview.yaml')),
+                                str(dest.join('stacks', 'overview.yaml')))
+        assert 'slug: sugar' in source.join('app.yaml').read()
+
+    def test_app_files_git(self, tmpdir):
+        source = tmpdir.mkdir('sugar')
+        subprocess.check_call(['git', '-C', str(source), 'init', '--quiet'])
+        source.join('.gitignore').write('builds/\n')
+        source.join('app.yaml').write('slug: sugar\n')
+        source.mkdir('builds').join('bundle.js').write('ignored')
+        assert apps.app_files(str(source)) == ['.gitignore', 'app.yaml']
+
+    def test_check_app_yaml(self, tmpdir):
+        app_yaml = tmpdir.join('app.yaml')
+        app_yaml.write('slug: cookies\nid: 01234567\n')
+        with pytest.raises(ValueError):
+            apps.check_app_yaml(str(app_yaml), {'slug': 'cookies', 'id': '01234567'})
+        app_yaml.write('slug: [cookies\n')
+        with pytest.raises(ValueError):
+            apps.check_app_yaml(str(app_yaml), {'slug': 'cookies'})
+
+    def test_replace_in_yaml(self, tmpdir):
+        app_yaml = tmpdir.join('cookies.yaml')
+        app_yaml.write(
+            '# Cookies app\n'
+            'slug: 1234  # the slug\n'
+            'ugh: ugh\n'
+            'label: "cake # not a comment"\n'
+            'stacks:\n'
+            '  - id: stack1\n'
+            '    label: Stack\n'
+            'id: batman\n'
+        )
+        apps.replace_in_yaml(str(app_yaml), {'slug:': 'cookies', 'label:': 'cookies',
+                                             'id:': 'aedc2134'})
+        assert app_yaml.read() == (
+            '# Cookies app\n'
+            'slug: cookies  # the slug\n'
+            'ugh: ugh\n'
+            'label: cookies\n'
+            'stacks:\n'
+            '  - id: stack1\n'
+            '    label: Stack\n'
+            'id: aedc2134\n'
+        )
+        assert tmpdir.listdir() == [app_yaml]
+
+    def test_replace_in_yaml_nested_keys(self, tmpdir):
+        app_yaml = tmpdir.join('app.yaml')
+        app_yaml.write(
+            'label: |\n'
+            '  A long\n'
+            '\n'
+            '  description\n'
+            '\n'
+            'config:\n'
+            '  id: nested\n'
+            '  slug: nested\n'
+            'tags:\n'
+            '- id\n'
+            "'id': old\n"
+        )
+        apps.replace_in_yaml(str(app_yaml), {'label': 'Cookies', 'id': '01234567',
+                                             'slug': 'cookies'})
+        assert yaml.safe_load(app_yaml.read()) == {
+            'label': 'Cookies',
+            'config': {'id': 'nested', 'slug': 'nested'},
+            'tags': ['id'],
+            'id': '01234567',
+            'slug': 'cookies',
+        }
+        # Blank lines between keys are kept, missing keys are appended
+        assert app_yaml.read().startswith('label: Cookies\n\nconfig:\n')
+        assert app_yaml.read().endswith("'id': '01234567'\nslug: cookies\n")
+
+    def test_replace_in_yaml_line_endings(self, tmpdir):
+        app_yaml = tmpdir.join('app.yaml')
+        app_yaml.write_binary(b'slug: sugar\r\nlabel: Sugar')
+        os.chmod(str(app_yaml), 0o640)
+        apps.replace_in_yaml(str(app_yaml), {'slug': 'cookies', 'id': 'abc'})
+        assert app_yaml.read_binary() == b'slug: cookies\r\nlabel: Sugar\r\nid: abc\r\n'
+        assert os.stat(str(app_yaml)).st_mode & 0o777 == 0o640
+
+    def test_replace_in_yaml_failure(self, tmpdir):
+        """The original file is untouched when the update fails"""
+        app_yaml = tmpdir.join('app.yaml')
+        app_yaml.write('slug: sugar\n')
+        with patch('jbcli.utils.apps.os.replace', side_effect=OSError('disk full')):
+            with pytest.raises(OSError):
+                apps.replace_in_yaml(str(app_yaml), {'slug': 'cookies'})
+        assert app_yaml.read() == 'slug: sugar\n'
+        assert tmpdir.listdir() == [app_yaml]
+
+    def test_discover_apps(self, tmpdir):
+        for name in ('cookies', 'cake', '.hidden'):
+            tmpdir.mkdir(name).join('app.yaml').write('slug: x\n')
+        tmpdir.mkdir('not_an_app')
+        tmpdir.join('README.md').write('hi')
+        assert apps.discover_apps(str(tmpdir)) == ['cake', 'cookies']
+        assert apps.discover_apps(str(tmpdir.join('missing'))) == []
+
+    def test_discover_stacks(self, tmpdir):
+        app = tmpdir.mkdir('cookies')
+        app.join('app.yaml').write('slug: cookies\nstacks:\n- overview\n- slug: details\n- overview\n')
+        stacks = app.mkdir('stacks')
+        for name in ('details', 'extra', '.hidden'):
+            stacks.mkdir(name)
+        stacks.join('README.md').write('hi')
+        assert apps.discover_stacks('cookies', str(tmpdir)) == ['overview', 'details', 'extra']
+
+        with pytest.raises(ValueError, match='has no app.yaml'):
+            apps.discover_stacks('cake', str(tmpdir))
+
+    def test_current_branch(self, tmpdir):
+        app = str(tmpdir)
+        assert apps.current_branch(app) is None
+        subprocess.check_call(['git', 'init', '-q', '-b', 'faster', app])
+        subprocess.check_call(['git', '-C', app, '-c', 'user.name=a', '-c', 'user.email=a@b',
+                               'commit', '-q', '--allow-empty', '-m', 'x'])
+        assert apps.current_branch(app) == 'faster'
+
+    def test_content_hash(self, tmpdir):
+        app = tmpdir.mkdir('cookies')
+        app.join('app.yaml').write('slug: cookies\n')
+        app.mkdir('stacks').join('overview.html').write('<p>hi</p>')
+        original = apps.content_hash(str(app))
+
+        # Ignored files don't change the hash
+        app.mkdir('.git').join('HEAD').write('ref')
+        app.join('stacks', 'views.pyc').write('x')
+        assert apps.content_hash(str(app)) == original
+
+        app.join('stacks', 'overview.html').write('<p>bye</p>')
+        assert apps.content_hash(str(app)) != original
+
+    @patch('jbcli.utils.apps.conf')
+    @patch('jbcli.utils.apps.check_output')
+    def test_update_reference_store(self, check_mock, conf_mock, tmpdir):
+        conf_mock.GIT_CACHE_DIR = str(tmpdir)
+        store = str(tmpdir.join('objects.git'))
+
+        assert apps.update_reference_store('sugar', 'git@sugar') == store
+        assert check_mock.mock_calls == [
+            call(['git', 'init', '--quiet', '--bare', store]),
+            call(['git', '-C', store, 'config', 'gc.auto', '0']),
+            call(['git', '-C', store, 'config', 'gc.pruneExpire', 'never']),
+            call(['git', '-C', store, 'fetch', '--quiet', '--no-tags', 'git@sugar',
+                  '+refs/heads/*:refs/remotes/sugar/*']),
+        ]
+
+    @patch('jbcli.utils.apps.conf')
+    @patch('jbcli.utils.apps.echo_warning')
+    @patch('jbcli.utils.apps.check_output')
+    def test_update_reference_store_fails(self, check_mock, echo_mock, conf_mock, tmpdir):
+        conf_mock.GIT_CACHE_DIR = str(tmpdir)
+        tmpdir.mkdir('objects.git')
+        check_mock.side_effect = CalledProcessError(128, 'git fetch')
+
+        assert apps.update_reference_store('sugar', 'git@sugar') is None
+        assert echo_mock.mock_calls == [
+            call('Could not update the shared git objects, doing a full clone.')
+        ]
+
+    def test_checkout_branch(self, tmpdir):
+        def git(path, *args):
+            return subprocess.check_output(
+                ['git', '-C', str(path), '-c', 'user.email=jb@example.com',
+                 '-c', 'user.name=jb'] + list(args),
+                stderr=subprocess.DEVNULL).decode().strip()
+
+        origin = tmpdir.mkdir('origin')
+        git(origin, 'init', '--quiet', '-b', 'main')
+        origin.join('app.yaml').write('slug: sugar\n')
+        git(origin, 'add', '.')
+        git(origin, 'commit', '--quiet', '-m', 'Initial commit')
+        app_dir = str(tmpdir.join('sugar'))
+        git(tmpdir, 'clone', '--quiet', str(origin), app_dir)
+        initial = git(app_dir, 'rev-parse', 'HEAD')
+
+        # New commits on an existing branch are fast-forwarded, new branches
+        # are created from origin
+        origin.join('app.yaml').write('slug: sugar\nlabel: Sugar\n')
+        git(origin, 'commit', '--quiet', '-am', 'Add label')
+        git(origin, 'branch', 'release')
+        release = git(origin, 'rev-parse', 'HEAD')
+        assert apps.checkout_branch(app_dir, 'main') == (initial, release)
+        assert apps.checkout_branch(app_dir, 'release') == (release, release)
+        assert git(app_dir, 'rev-parse', '--abbrev-ref', 'HEAD') == 'release'
+
+        with pytest.raises(CalledProcessError) as exc_info:
+            apps.checkout_branch(app_dir, 'missing')
+        assert b'missing' in exc_info.value.stderr
@@ -0,0 +1,84 @@
+import pytest
+from mock import patch
+
+from ..utils import appserver
+from ..utils.appserver import Kicker, Process, find_server
+
+
+class FakeGunicorn(object):
+    """A container running a gunicorn master that handles TTIN and TTOU."""
+
+    name = 'devlandia_juicebox_selfserve_1'
+
+    def __init__(self, workers=2):
+        self.next_pid = 100
+        self.workers = [self._pid() for _ in range(workers)]
+        self.signals = []
+
+    def _pid(self):
+        self.next_pid += 1
+        return self.next_pid
+
+    def exec_run(self, command):
+        if command[0] == 'sh':
+            lines = ['1\t1 (sh) S 0 1\tsh -c docker/entrypoint.py ',
+                     '7\t7 (gunicorn) S 1 7\t/venv/bin/python /venv/bin/gunicorn fruition.wsgi ']
+            lines += [f'{pid}\t{pid} (gunicorn: worker) S 7 7\tgunicorn: worker [fruition] '
+                      for pid in self.workers]
+            return 0, '\n'.join(lines).encode()
+        _, signal, pid = command
+        self.signals.append(signal[1:])
+        if signal == '-TTIN':
+            self.workers.append(self._pid())
+        elif signal == '-TTOU':
+            self.workers.pop(0)
+        elif signal == '-HUP':
+            self.workers = [self._pid() for _ in self.workers]
+        return 0, b''
+
+
+@pytest.fixture(autouse=True)
+def no_sleep():
+    with patch('jbcli.utils.appserver.POLL_INTERVAL', 0):
+        yield
+
+
+def test_find_server():
+    procs = [
+        Process(1, 0, 'sh -c docker/entrypoint.py'),
+        Process(8, 1, '/venv/bin/uwsgi --ini uwsgi.ini'),
+        Process(9, 8, '/venv/bin/uwsgi --ini uwsgi.ini'),
+        Process(10, 1, '/venv/bin/python manage.py rqworker'),
+    ]
+    name, master, workers = find_server(procs)
+    assert (name, master.pid, [w.pid for w in workers]) == ('uwsgi', 8, [9])
+    assert find_server(procs[:1] + procs[3:]) is None
+
+
+@patch('jbcli.utils.appserver.Kicker.healthy', return_value=True)
+def test_rolling_gunicorn(healthy_mock):
+    container = FakeGunicorn(workers=2)
+
+    kick = Kicker(container, 'http://localhost:8000/health_check').kick()
+
+    assert (kick.server, kick.workers) == ('gunicorn', 2)
+    # One worker is replaced at a time
+    assert container.signals == ['TTIN', 'TTOU', 'TTIN', 'TTOU']
+    assert container.workers == [103, 104]
+
+
+@patch('jbcli.utils.appserver.Kicker.healthy', return_value=False)
+def test_timeout(healthy_mock):
+    kicker = Kicker(FakeGunicorn(), 'http://localhost:8000/health_check', timeout=0)
+    with pytest.raises(RuntimeError, match='Timed out after 0s waiting for a new gunicorn worker'):
+        kicker.kick()
+
+
+def test_processes_unparsable():
+    class Container(object):
+        name = 'juicebox'
+
+        def exec_run(self, command):
+            return 0, b'12\t12 (python) S 1 12\t/venv/bin/python x \n13\tgone\t\n14\t14 (k) S 2 0\t\n'
+
+    assert appserver.processes(Container()) == [Process(12, 1, '/venv/bin/python x')]
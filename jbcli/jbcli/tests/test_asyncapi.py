@@ -0,0 +1,89 @@
+import requests
+import requests_mock
+from mock import patch
+
+from ..utils import asyncapi
+
+
+class TestAsyncAPI:
+    @patch("jbcli.utils.asyncapi.get_admin_token")
+    def test_load_apps(self, token_mock):
+        """Loads every app and fetches the token only once. """
+        token_mock.return_value = "foo"
+        logs = [{"level": "debug", "event": "Created Slice",
+                 "instance": "table for Basketball (Slice)"}]
+
+        with requests_mock.Mocker() as m:
+            m.post("http://localhost:8001/api/v1/app/load/cookies/",
+                   json={"details": {"logs": logs}})
+            m.post("http://localhost:8001/api/v1/app/load/cake/", status_code=204)
+            m.post("http://localhost:8001/api/v1/app/load/pie/", status_code=400,
+                   json={})
+            seen = []
+            results = asyncapi.load_apps(["cookies", "cake", "pie"], custom=True,
+                                         concurrency=2, on_result=seen.append)
+
+        assert [(r.app, r.ok, r.status) for r in results] == [
+            ("cookies", True, 200), ("cake", True, 204), ("pie", False, 400)
+        ]
+        assert results[0].report["objects"]["Slice"]["created"] == 1
+        assert results[2].error == "Loading app status code was 400"
+        assert sorted(r.app for r in seen) == ["cake", "cookies", "pie"]
+        assert token_mock.call_count == 1
+        assert all(h.headers["Authorization"] == "JWT foo" for h in m.request_history)
+
+    @patch("jbcli.utils.asyncapi.get_admin_token")
+    def test_expired_token_is_refreshed_once(self, token_mock):
+        tokens = iter(["old", "new"])
+        token_mock.side_effect = lambda refresh, custom: next(tokens)
+
+        def respond(request, context):
+            if request.headers["Authorization"] == "JWT old":
+                context.status_code = 401
+            return {}
+
+        with requests_mock.Mocker() as m:
+            m.post(requests_mock.ANY, json=respond)
+            results = asyncapi.load_apps(["a", "b", "c"], concurrency=3)
+
+        assert all(r.ok for r in results)
+        assert token_mock.call_count == 2
+        assert token_mock.call_args_list[1][0] == (True, False)
+
+    @patch("jbcli.utils.asyncapi.backoff_delay", return_value=0)
+    @patch("jbcli.utils.asyncapi.get_admin_token", return_value="foo")
+    def test_connection_errors_retry(self, token_mock, backoff_mock):
+        with requests_mock.Mocker() as m:
+            m.post("http://localhost:8000/api/v1/app/load/cookies/",
+                   [{"exc": requests.ConnectionError("nope")}, {"json": {}}])
+            m.post("http://localhost:8000/api/v1/app/load/cake/",
+                   exc=requests.ConnectionError("down"))
+            results = asyncapi.load_apps(["cookies", "cake"])
+
+        assert results[0].ok is True
+        assert results[1].ok is False
+        assert results[1].error == "down"
+        assert backoff_mock.call_count == 1 + asyncapi.MAX_ATTEMPTS - 1
+
+    @patch("jbcli.utils.asyncapi.get_admin_token", return_value=None)
+    def test_no_token(self, token_mock):
+        results = asyncapi.load_apps(["cookies"])
+        assert results[0].ok is False
+        assert results[0].error == "Could not get admin token."
+
+    def test_backoff_delay_is_capped(self):
+        for attempt in range(10):
+            assert 0 <= asyncapi.backoff_delay(attempt) <= asyncapi.BACKOFF_CAP
+
+    @patch("jbcli.utils.asyncapi.get_admin_token", return_value="foo")
+    def test_fail_fast(self, token_mock):
+        """Apps waiting for a slot are skipped once one app fails. """
+        with requests_mock.Mocker() as m:
+            m.post(requests_mock.ANY, json={})
+            m.post("http://localhost:8000/api/v1/app/load/a/", status_code=500, json={})
+            results = asyncapi.load_apps(["a", "b", "c"], concurrency=1, fail_fast=True)
+
+        assert [(r.app, r.ok, r.skipped) for r in results] == [
+            ("a", False, False), ("b", False, True), ("c", False, True)
+        ]
+        assert len(m.request_history) == 1
@@ -1,6 +1,8 @@
 from __future__ import print_function
 
 from collections import namedtuple
+from datetime import datetime, timezone
+import json
 import os
 from io import StringIO
 from os.path import expanduser
@@ -8,12 +10,25 @@ from subprocess import CalledProcessError
 
 from click.testing import CliRunner
 from docker.errors import APIError
-from mock import call, mock_open, patch, ANY
+from mock import call, mock_open, patch, ANY, Mock
 import six
 
 from ..cli.jb import DEVLANDIA_DIR, cli
+from ..utils.appserver import Kick
+from ..utils.asyncapi import LoadResult
+from ..utils.composebackend import StopResult
+from ..utils.containerstats import Sample
+from ..utils.dbsnapshot import Snapshot
+from ..utils.logstream import LogLine
+from ..utils.manifest import Manifest
+from ..utils import rediscache
+from ..utils.rediscache import Cleared, PrefixStats
+from ..utils.stackbench import StackResult
+from ..utils.storageutil import Stash
+from ..utils.tunnel import Forward
 
 Container = namedtuple("Container", ["name"])
+VENV_OVERLAY = {"volumes": {"jb-venv-0123456789abcdef": {"external": True}}}
 
 
 def invoke(*args, **kwargs):
@@ -22,6 +37,16 @@ def invoke(*args, **kwargs):
 
 
 @patch("jbcli.cli.jb.get_deployment_secrets", new=lambda: {"test_secret": "true"})
+@patch("jbcli.cli.jb.manifest", new=Mock(**{
+    "Manifest.return_value.is_current.return_value": False,
+    "Manifest.return_value.use_image.return_value": False,
+}))
+@patch("jbcli.cli.jb.gitcache.update_mirror", new=Mock(return_value=None))
+@patch("jbcli.cli.jb.ephemeral", new=Mock(**{"is_active.return_value": False}))
+@patch("jbcli.cli.jb.pipcache", new=Mock(**{
+    "VenvCache.return_value.ensure.return_value": ("jb-venv-0123456789abcdef", False),
+    "VenvCache.return_value.overlay.return_value": VENV_OVERLAY,
+}))
 class TestCli(object):
     def test_base(self):
         result = invoke()
@@ -111,7 +136,9 @@ class TestCli(object):
         assert "Adding cookies..." in result.output
         assert result.exit_code == 0
         assert dockerutil_mock.mock_calls == [call.is_running()]
-        assert apiutil_mock.mock_calls == [call.load_app(u"cookies", custom=True)]
+        assert apiutil_mock.mock_calls == [
+            call.load_app(u"cookies", custom=True, output="summary", report={})
+        ]
         assert apps_mock.mock_calls == [call.make_github_repo_url(u"cookies")]
         assert os_mock.mock_calls == [
             call.chdir(DEVLANDIA_DIR),
@@ -122,6 +149,457 @@ class TestCli(object):
         ]
         assert "Adding cookies" in result.output
 
+    @patch("jbcli.cli.jb.jbapiutil")
+    @patch("jbcli.cli.jb.dockerutil")
+    @patch("jbcli.cli.jb.apps")
+    @patch("jbcli.cli.jb.subprocess")
+    @patch("jbcli.cli.jb.os")
+    def test_add_partial_clone(
+            self, os_mock, proc_mock, apps_mock, dockerutil_mock, apiutil_mock
+    ):
+        """Clones can be shallow, blobless and share a reference store"""
+        os_mock.path.isdir.return_value = False
+        dockerutil_mock.is_running.return_value = [True, False]
+        apps_mock.make_github_repo_url.return_value = "git cookies"
+        apps_mock.update_reference_store.return_value = "/cache/objects.git"
+        apiutil_mock.load_app.return_value = True
+
+        result = invoke(["add", "cookies@develop", "--depth", "1", "--blobless", "--reference"])
+
+        assert result.exit_code == 0
+        assert apps_mock.update_reference_store.mock_calls == [call("cookies", "git cookies")]
+        assert proc_mock.mock_calls == [
+            call.check_call([
+                "git", "clone", "--depth", "1", "--no-single-branch", "--filter=blob:none",
+                "--reference-if-able", "/cache/objects.git",
+                "-b", "develop", "git cookies", "apps/cookies",
+            ])
+        ]
+
+    @patch("jbcli.cli.jb.jbapiutil")
+    @patch("jbcli.cli.jb.dockerutil")
+    @patch("jbcli.cli.jb.apps")
+    @patch("jbcli.cli.jb.subprocess")
+    @patch("jbcli.cli.jb.os")
+    def test_add_reference_store_unavailable(
+            self, os_mock, proc_mock, apps_mock, dockerutil_mock, apiutil_mock
+    ):
+        os_mock.path.isdir.return_value = False
+        dockerutil_mock.is_running.return_value = [True, False]
+        apps_mock.make_github_repo_url.return_value = "git cookies"
+        apps_mock.update_reference_store.return_value = None
+        apiutil_mock.load_app.return_value = True
+
+        result = invoke(["add", "cookies", "--reference"])
+
+        assert result.exit_code == 0
+        assert proc_mock.mock_calls == [
+            call.check_call(["git", "clone", "git cookies", "apps/cookies"])
+        ]
+
+    @patch("jbcli.cli.jb.jbapiutil")
+    @patch("jbcli.cli.jb.dockerutil")
+    @patch("jbcli.cli.jb.apps")
+    @patch("jbcli.cli.jb.subprocess")
+    @patch("jbcli.cli.jb.os")
+    def test_add_from_mirror(
+            self, os_mock, proc_mock, apps_mock, dockerutil_mock, apiutil_mock
+    ):
+        """Full clones come from the local mirror and then point at Github"""
+        os_mock.path.isdir.return_value = False
+        dockerutil_mock.is_running.return_value = [True, False]
+        apps_mock.make_github_repo_url.return_value = "git cookies"
+        apiutil_mock.load_app.return_value = True
+
+        # The class wide patch of update_mirror applies last, override it here
+        with patch("jbcli.cli.jb.gitcache.update_mirror") as mirror_mock:
+            mirror_mock.return_value = "/cache/mirrors/cookies.git"
+            result = invoke(["add", "cookies@develop"])
+
+        assert result.exit_code == 0
+        assert mirror_mock.mock_calls == [call("cookies", "git cookies")]
+        assert proc_mock.mock_calls == [
+            call.check_call(["git", "clone", "-b", "develop", "/cache/mirrors/cookies.git", "apps/cookies"]),
+            call.check_call(["git", "-C", "apps/cookies", "remote", "set-url", "origin", "git cookies"]),
+        ]
+
+        # Partial clones and opting out skip the mirror
+        with patch("jbcli.cli.jb.gitcache.update_mirror") as mirror_mock:
+            invoke(["add", "cookies", "--depth", "1"])
+            invoke(["add", "cookies", "--no-mirror"])
+        assert mirror_mock.mock_calls == []
+
+    @patch("jbcli.cli.jb.tunnel.TunnelManager")
+    def test_tunnel_status(self, manager_mock):
+        manager = manager_mock.return_value
+        manager.host = "bastion"
+        manager.status.return_value = (4321, [
+            (Forward(5439, "redshift.example.com"), 0.0234),
+            (Forward(5438, "hstm.example.com"), None),
+        ])
+
+        result = invoke(["tunnel", "status"])
+
+        assert result.exit_code == 1
+        assert "SSH tunnel to bastion is running (pid 4321)." in result.output
+        lines = result.output.splitlines()
+        assert any("5439" in line and "ok" in line and "23" in line for line in lines)
+        assert any("5438" in line and "down" in line for line in lines)
+
+        manager.status.return_value = (4321, [(Forward(5439, "redshift.example.com"), 0.01)])
+        assert invoke(["tunnel", "status"]).exit_code == 0
+
+        manager.status.return_value = (None, [])
+        result = invoke(["tunnel", "status"])
+        assert result.exit_code == 1
+        assert "The SSH tunnel is not running." in result.output
+
+    @patch("jbcli.cli.jb.gitcache")
+    def test_cache_prune(self, gitcache_mock):
+        gitcache_mock.parse_size.return_value = 1024
+        gitcache_mock.prune.return_value = [
+            ("cookies", "/cache/mirrors/cookies.git", 3 * 1024 ** 2, 0),
+        ]
+
+        result = invoke(["cache", "prune", "--max-size", "1K", "--dry-run"])
+
+        assert result.exit_code == 0
+        assert gitcache_mock.prune.mock_calls == [call(1024, dry_run=True)]
+        assert "cookies" in result.output
+        assert "Would free 3.0 MB." in result.output
+
+        gitcache_mock.parse_size.side_effect = ValueError("Invalid size: lots")
+        result = CliRunner().invoke(cli, ["cache", "prune", "--max-size", "lots"])
+        assert result.exit_code == 2
+        assert "Invalid size: lots" in result.output
+
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_cache_venvs(self, dockerutil_mock):
+        with patch("jbcli.cli.jb.pipcache.VenvCache") as venvs_mock:
+            venvs_mock.return_value.list.return_value = [("jb-venv-abc", 0)]
+            venvs_mock.return_value.prune.return_value = ["jb-venv-old"]
+            result = invoke(["cache", "venvs"])
+            assert result.exit_code == 0
+            assert "jb-venv-abc" in result.output
+
+            result = invoke(["cache", "venvs", "--prune", "--keep", "2"])
+        assert result.exit_code == 0
+        assert venvs_mock.return_value.prune.mock_calls == [call(keep=2)]
+        assert "Removed jb-venv-old" in result.output
+
+    @patch("jbcli.cli.jb.os")
+    @patch("jbcli.cli.jb.appserver.Kicker")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_kick(self, dockerutil_mock, kicker_mock, os_mock):
+        kicker_mock.return_value.kick.return_value = Kick("gunicorn", 4, 6.25)
+
+        result = invoke(["kick", "--custom"])
+
+        assert result.exit_code == 0
+        assert os_mock.mock_calls == [call.chdir(DEVLANDIA_DIR)]
+        assert dockerutil_mock.mock_calls == [call.juicebox_container(True)]
+        assert kicker_mock.mock_calls == [
+            call(dockerutil_mock.juicebox_container.return_value,
+                 "http://localhost:8001/health_check", timeout=120),
+            call().kick(),
+        ]
+        assert "restarted (4 gunicorn processes) and answered after 6.2s." in result.output
+
+        kicker_mock.return_value.kick.side_effect = RuntimeError(
+            "Timed out after 120s waiting for the health check.")
+        result = CliRunner().invoke(cli, ["kick"])
+        assert result.exit_code == 1
+        assert "Timed out after 120s" in result.output
+
+        dockerutil_mock.juicebox_container.return_value = None
+        result = CliRunner().invoke(cli, ["kick"])
+        assert result.exit_code == 1
+        assert "kick only works when Juicebox is running" in result.output
+
+    @patch("jbcli.cli.jb.os")
+    @patch("jbcli.cli.jb.logstream.LogStream")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_logs(self, dockerutil_mock, stream_mock, os_mock):
+        dockerutil_mock.project_name.return_value = "devlandia"
+        stream_mock.return_value.containers.return_value = {"juicebox_selfserve": None, "redis": None}
+        stream_mock.return_value.__iter__.return_value = iter([
+            [LogLine(None, "redis", "Ready to accept connections"),
+             LogLine(None, "juicebox_selfserve", "ERROR Traceback")],
+        ])
+
+        result = invoke(["logs", "--grep", "Ready|Trace", "--level", "info", "--no-follow"])
+
+        assert result.exit_code == 0
+        assert os_mock.mock_calls == [call.chdir(DEVLANDIA_DIR)]
+        assert stream_mock.mock_calls[0] == call(
+            dockerutil_mock.client, "devlandia", services=(), pattern="Ready|Trace",
+            level="INFO", since=None, tail=None, follow=False)
+        assert result.output == (
+            "redis              | Ready to accept connections\n"
+            "juicebox_selfserve | ERROR Traceback\n"
+        )
+
+        result = CliRunner().invoke(cli, ["logs", "--grep", "(unclosed"])
+        assert result.exit_code == 2
+        assert "Invalid regular expression" in result.output
+
+        result = CliRunner().invoke(cli, ["logs", "--since", "yesterday"])
+        assert result.exit_code == 2
+        assert "Invalid time: yesterday" in result.output
+
+        stream_mock.return_value.containers.side_effect = ValueError("No containers for nginx")
+        result = CliRunner().invoke(cli, ["logs", "nginx"])
+        assert result.exit_code == 1
+        assert "No containers for nginx" in result.output
+
+    @patch("jbcli.cli.jb.os.chdir")
+    @patch("jbcli.cli.jb.containerstats.StatsStream")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_stats(self, dockerutil_mock, stream_mock, chdir_mock, tmp_path):
+        dockerutil_mock.project_name.return_value = "devlandia"
+        stream_mock.return_value.containers.return_value = {"postgres": None, "redis": None}
+        now = datetime(2024, 5, 2, 10, tzinfo=timezone.utc)
+        postgres = Sample(now, "postgres", 12.5, 200 * 1024 ** 2, 1024 ** 3, 1024 ** 2, 0, 2048, 1024, 9)
+        redis = Sample(now, "redis", 0.25, 8 * 1024 ** 2, 0, 0, 0, 0, 0, 4)
+        stream_mock.return_value.samples.return_value = iter([[redis], [postgres, redis]])
+        record = tmp_path / "stats.jsonl"
+
+        result = invoke(["stats", "--interval", "1", "--count", "2", "--record", str(record)])
+
+        assert result.exit_code == 0
+        assert chdir_mock.mock_calls == [call(DEVLANDIA_DIR)]
+        assert stream_mock.mock_calls[:3] == [
+            call(dockerutil_mock.client, "devlandia", services=()),
+            call().containers(),
+            call().samples(1),
+        ]
+        table = result.output.splitlines()
+        assert table[-3].split() == ["postgres", "12.5", "200.0", "19.5", "1.0", "0.0", "2.0", "1.0", "9"]
+        assert table[-2].split() == ["redis", "0.2", "8.0", "0.0", "0.0", "0.0", "0.0", "0.0", "4"]
+        assert f"Recorded 3 samples in {record}." in table[-1]
+        assert len(record.read_text().splitlines()) == 3
+
+        result = CliRunner().invoke(cli, ["stats", "--record", "stats.txt"])
+        assert result.exit_code == 2
+        assert f"Can't record to {os.path.abspath('stats.txt')}" in result.output
+
+        stream_mock.return_value.containers.return_value = {}
+        result = CliRunner().invoke(cli, ["stats"])
+        assert result.exit_code == 1
+        assert "no running devlandia containers" in result.output
+
+    @patch("jbcli.cli.jb.os.chdir")
+    @patch("jbcli.cli.jb.profiler.Profiler")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_profile(self, dockerutil_mock, profiler_mock, chdir_mock):
+        profiler_mock.return_value.target.return_value = (7, "the gunicorn master and its 4 workers")
+        profiler_mock.return_value.record.return_value = {
+            "shared": {"frames": [{"name": "render", "file": "views.py", "line": 88}]},
+            "profiles": [{"samples": [[0], [0], []], "weights": [1, 1, 2]}],
+        }
+
+        result = invoke(["profile", "--custom", "--duration", "5", "--output", "slow.json"])
+
+        assert result.exit_code == 0
+        assert profiler_mock.mock_calls == [
+            call(dockerutil_mock.client, dockerutil_mock.juicebox_container.return_value, duration=5, rate=100),
+            call().target(),
+            call().record(7, os.path.abspath("slow.json")),
+        ]
+        assert chdir_mock.mock_calls == [call(DEVLANDIA_DIR)]
+        assert dockerutil_mock.juicebox_container.mock_calls == [call(True)]
+        assert "Profiling the gunicorn master and its 4 workers for 5s" in result.output
+        assert result.output.splitlines()[3].split() == ["render", "views.py:88", "50.0", "50.0"]
+        assert f"Wrote {os.path.abspath('slow.json')}" in result.output
+
+        profiler_mock.return_value.record.side_effect = RuntimeError("py-spy failed: Permission Denied")
+        result = CliRunner().invoke(cli, ["profile"])
+        assert result.exit_code == 1
+        assert "py-spy failed: Permission Denied" in result.output
+
+        dockerutil_mock.juicebox_container.return_value = None
+        result = CliRunner().invoke(cli, ["profile"])
+        assert result.exit_code == 1
+        assert "profile only works when Juicebox is running" in result.output
+
+    @patch("jbcli.cli.jb.os.chdir")
+    @patch("jbcli.cli.jb.stackbench")
+    @patch("jbcli.cli.jb.apps")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_bench(self, dockerutil_mock, apps_mock, bench_mock, chdir_mock):
+        apps_mock.discover_stacks.return_value = ["overview", "details"]
+        apps_mock.current_branch.return_value = "faster"
+        dockerutil_mock.juicebox_container.return_value.image.tags = ["juicebox:develop-py3"]
+        bench_mock.run_bench.return_value = [
+            StackResult("overview", 50, 0, 2.5, 20.0, 0.1, 0.2, 0.25),
+            StackResult("details", 50, 2, 5.0, 9.6, 0.4, None, None),
+        ]
+        bench_mock.last_run.return_value = {"overview": StackResult("overview", 50, 0, 5.0, 10.0, 0.2, 0.25, 0.3)}
+        bench_mock.save_run.return_value = "/home/me/.config/juicebox/bench.jsonl"
+
+        result = invoke(["bench", "cookies", "-c", "4", "-n", "50", "--compare", "juicebox:develop-py3@main"])
+
+        assert result.exit_code == 0
+        assert chdir_mock.mock_calls == [call(DEVLANDIA_DIR)]
+        assert bench_mock.last_run.mock_calls == [call("cookies", "juicebox:develop-py3@main")]
+        assert bench_mock.stack_urls.mock_calls == [
+            call("cookies", ["overview", "details"], custom=False, template="/stacks/{app}/{stack}/")]
+        assert bench_mock.run_bench.mock_calls == [
+            call(bench_mock.stack_urls.return_value, custom=False, concurrency=4, count=50,
+                 warmup=1)]
+        lines = result.output.splitlines()
+        assert lines[3].split() == ["overview", "0", "20.0", "100.0", "200.0", "250.0", "-50.0", "-20.0"]
+        assert lines[4].split() == ["details", "2", "9.6", "400.0", "-", "-", "-", "-"]
+        assert "Some requests failed" in result.output
+        assert bench_mock.save_run.mock_calls == [call(
+            "cookies", "juicebox:develop-py3@faster", bench_mock.run_bench.return_value,
+            image="juicebox:develop-py3", branch="faster", custom=False, concurrency=4,
+            url="/stacks/{app}/{stack}/")]
+        assert "Saved as juicebox:develop-py3@faster" in result.output
+
+        bench_mock.last_run.return_value = None
+        result = CliRunner().invoke(cli, ["bench", "cookies", "--compare", "nope"])
+        assert result.exit_code == 1
+        assert "There is no saved run of cookies named nope." in result.output
+
+        dockerutil_mock.juicebox_container.return_value = None
+        result = CliRunner().invoke(cli, ["bench", "cookies"])
+        assert result.exit_code == 1
+        assert "bench only works when Juicebox is running" in result.output
+
+        apps_mock.discover_stacks.side_effect = ValueError("apps/cake has no app.yaml.")
+        result = CliRunner().invoke(cli, ["bench", "cake"])
+        assert result.exit_code == 1
+        assert "apps/cake has no app.yaml." in result.output
+
+    @patch("jbcli.cli.jb.rediscache.Redis")
+    @patch("jbcli.cli.jb.rediscache.clear")
+    def test_cache_clear(self, clear_mock, redis_mock):
+        clear_mock.return_value = Cleared(12, 0.0042)
+
+        result = invoke(["cache", "clear", "--app", "cookies"])
+
+        assert result.exit_code == 0
+        assert clear_mock.mock_calls == [
+            call(ANY, "*cookies*", dry_run=False, only=rediscache.app_key_re("cookies"))]
+        assert "Removed 12 keys of cookies in 4.2 ms." in result.output
+
+        result = CliRunner().invoke(cli, ["cache", "clear", ":1:*", "--all"])
+        assert result.exit_code == 2
+        assert "Pass one of PATTERN, --app or --all." in result.output
+
+        redis_mock.return_value.address = ("127.0.0.1", 6379)
+        clear_mock.side_effect = ConnectionRefusedError("Connection refused")
+        result = CliRunner().invoke(cli, ["cache", "clear", "--all"])
+        assert result.exit_code == 1
+        assert "Could not use redis at 127.0.0.1:6379" in result.output
+
+    @patch("jbcli.cli.jb.rediscache.Redis")
+    @patch("jbcli.cli.jb.rediscache.stats")
+    def test_cache_stats(self, stats_mock, redis_mock):
+        stats_mock.return_value = [PrefixStats(0, ":1:cookies:*", 2, 3072), PrefixStats(0, "session", 1, 1024)]
+
+        result = invoke(["cache", "stats", "--top", "1"])
+
+        assert result.exit_code == 0
+        assert stats_mock.mock_calls == [call(ANY, pattern="*", depth=3)]
+        assert ":1:cookies:*" in result.output
+        assert "... and 1 more prefixes" in result.output
+        assert "3 keys using 0.0 MB." in result.output
+
+    @patch("jbcli.cli.jb.dbsnapshot.Snapshots")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_db_snapshot_restore(self, dockerutil_mock, snapshots_mock, monkeypatch):
+        monkeypatch.chdir(DEVLANDIA_DIR)
+        dockerutil_mock.project_name.return_value = "devlandia"
+        snapshots = snapshots_mock.return_value
+        snapshots.snapshot.return_value = Snapshot("clean", "dump", 3 * 1024 ** 2, 4.25, "2024-05-02T10:11:12")
+        snapshots.restore.return_value = Snapshot("clean", "dump", 3 * 1024 ** 2, 6.5, "2024-05-02T10:11:12")
+
+        result = invoke(["db", "snapshot", "clean", "--method", "dump", "-j", "8"])
+        assert result.exit_code == 0
+        assert snapshots.snapshot.mock_calls == [call("clean", method="dump", jobs=8, force=False)]
+        assert "Saved snapshot clean (3.0 MB) in 4.2s." in result.output
+
+        result = invoke(["db", "restore", "clean"])
+        assert result.exit_code == 0
+        assert snapshots.restore.mock_calls == [call("clean", jobs=4)]
+        assert "Restored snapshot clean (3.0 MB) in 6.5s." in result.output
+
+        snapshots.restore.side_effect = RuntimeError("There is no snapshot named nope.")
+        result = invoke(["db", "restore", "nope"])
+        assert result.exit_code == 1
+        assert "There is no snapshot named nope." in result.output
+
+    @patch("jbcli.cli.jb.os.chdir")
+    @patch("jbcli.cli.jb.dbsnapshot.Snapshots")
+    def test_db_ls_rm(self, snapshots_mock, chdir_mock):
+        snapshots = snapshots_mock.return_value
+        snapshots.list.return_value = [Snapshot("clean", "dump", 3 * 1024 ** 2, 4.25, "2024-05-02T10:11:12")]
+
+        result = invoke(["db", "ls"])
+        assert result.exit_code == 0
+        assert result.output.splitlines()[2].split()[:4] == ["clean", "dump", "3.0", "4.2"]
+
+        result = invoke(["db", "rm", "clean"])
+        assert result.exit_code == 0
+        assert snapshots.remove.mock_calls == [call("clean")]
+        assert "Deleted snapshot clean." in result.output
+        # Both find the project from the devlandia directory
+        assert chdir_mock.mock_calls == [call(DEVLANDIA_DIR), call(DEVLANDIA_DIR)]
+
+    @patch("jbcli.cli.jb._manifest")
+    @patch("jbcli.cli.jb.jbapiutil")
+    @patch("jbcli.cli.jb.dockerutil")
+    @patch("jbcli.cli.jb.os")
+    def test_add_unchanged(self, os_mock, dockerutil_mock, apiutil_mock, manifest_mock):
+        """Apps that haven't changed since their last load are skipped"""
+        os_mock.path.isdir.return_value = True
+        dockerutil_mock.is_running.return_value = [True, False]
+        manifest_mock.return_value.is_current.side_effect = lambda app, app_hash: app == "cookies"
+        apiutil_mock.load_app.return_value = True
+
+        result = invoke(["add", "cookies", "cake"])
+
+        assert result.exit_code == 0
+        assert "cookies hasn't changed since it was last loaded" in result.output
+        assert apiutil_mock.load_app.mock_calls == [
+            call("cake", custom=True, output="summary", report={})
+        ]
+        assert manifest_mock.return_value.record.mock_calls == [call("cake", ANY, ANY)]
+
+        apiutil_mock.reset_mock()
+        invoke(["add", "cookies", "--force"])
+        assert apiutil_mock.load_app.mock_calls == [
+            call("cookies", custom=True, output="summary", report={})
+        ]
+
+    @patch("jbcli.cli.jb.jbapiutil")
+    @patch("jbcli.cli.jb.dockerutil")
+    @patch("jbcli.cli.jb.apps")
+    @patch("jbcli.cli.jb.subprocess")
+    @patch("jbcli.cli.jb.os")
+    def test_add_json(
+            self, os_mock, proc_mock, apps_mock, dockerutil_mock, apiutil_mock
+    ):
+        """The --json flag prints the load reports as JSON"""
+        os_mock.path.isdir.return_value = False
+        dockerutil_mock.is_running.return_value = [True, False]
+
+        def load_app(app, custom, output, report):
+            assert output == "none"
+            report.update(app=app, status=200, objects={"Slice": {"created": 1}})
+            return True
+
+        apiutil_mock.load_app.side_effect = load_app
+
+        result = invoke(["add", "cookies", "--json"])
+
+        assert result.exit_code == 0
+        assert json.loads(result.output[result.output.index("["):]) == [
+            {"app": "cookies", "status": 200, "objects": {"Slice": {"created": 1}}}
+        ]
+
     @patch("jbcli.cli.jb.jbapiutil")
     @patch("jbcli.cli.jb.dockerutil")
     @patch("jbcli.cli.jb.apps")
@@ -290,6 +768,7 @@ class TestCli(object):
         dockerutil_mock.is_running.return_value = [True, False]
         apiutil_mock.load_app.return_value = False
         apiutil_mock.get_admin_token.return_value = None
+        apps_mock.checkout_branch.return_value = ("abc", "def")
 
         result = invoke(["add", "cookies@main"])
 
@@ -300,17 +779,13 @@ class TestCli(object):
             call.is_running(),
             call.run("/venv/bin/python manage.py loadjuiceboxapp cookies", env='custom'),
         ]
-        assert apps_mock.mock_calls == []
+        assert apps_mock.mock_calls == [call.checkout_branch("apps/cookies", "main")]
+        # The working directory is never changed
         assert os_mock.mock_calls == [
             call.chdir(DEVLANDIA_DIR),
             call.path.isdir("apps/cookies"),
-            call.chdir('apps/cookies'),
-            call.chdir('../..')
-        ]
-        assert proc_mock.mock_calls == [
-            call.check_call(['git', 'fetch']),
-            call.check_call(['git', 'checkout', 'main'])
         ]
+        assert proc_mock.mock_calls == []
 
     @patch("jbcli.cli.jb.jbapiutil")
     @patch("jbcli.cli.jb.dockerutil")
@@ -410,6 +885,155 @@ class TestCli(object):
             call.check_call(["git", "clone", "git cookies", "apps/cookies"])
         ]
 
+    @patch("jbcli.cli.jb._manifest")
+    @patch("jbcli.cli.jb.asyncapi")
+    @patch("jbcli.cli.jb.apps")
+    @patch("jbcli.cli.jb.dockerutil")
+    @patch("jbcli.cli.jb.os")
+    def test_checkout(self, os_mock, dockerutil_mock, apps_mock, asyncapi_mock, manifest_mock, tmpdir):
+        """Every app is checked out, then the ones that worked are reloaded once"""
+        manifest_mock.return_value = Manifest("custom", stash=Stash(str(tmpdir.join("stash.toml"))))
+        dockerutil_mock.is_running.return_value = [True, False]
+        os_mock.path.isdir.side_effect = lambda path: path != "apps/gone"
+        apps_mock.discover_apps.return_value = ["cookies", "cake", "pie", "gone"]
+
+        def checkout_branch(app_dir, branch):
+            if app_dir == "apps/pie":
+                raise CalledProcessError(
+                    1, "git checkout", stderr=b"error: pathspec 'release' did not match\n")
+            if app_dir == "apps/cake":
+                return "1" * 40, "1" * 40
+            return "1" * 40, "2" * 40
+
+        apps_mock.checkout_branch.side_effect = checkout_branch
+        asyncapi_mock.load_apps.return_value = [
+            LoadResult("cookies", True, status=200, duration=1.0),
+            LoadResult("cake", True, status=200, duration=1.0),
+        ]
+
+        result = invoke(["checkout", "release", "--custom"])
+
+        assert result.exit_code == 1
+        assert sorted(apps_mock.checkout_branch.call_args_list) == [
+            call("apps/cake", "release"), call("apps/cookies", "release"), call("apps/pie", "release"),
+        ]
+        assert "11111111 -> 22222222" in result.output
+        assert "error: pathspec 'release' did not match" in result.output
+        assert "not in apps/" in result.output
+        assert "Failed to check out release in: pie, gone." in result.output
+        assert asyncapi_mock.load_apps.call_count == 1
+        assert sorted(asyncapi_mock.load_apps.call_args[0][0]) == ["cake", "cookies"]
+        assert asyncapi_mock.load_apps.call_args[1]["custom"] is True
+
+    @patch("jbcli.cli.jb.asyncapi")
+    @patch("jbcli.cli.jb.apps")
+    @patch("jbcli.cli.jb.dockerutil")
+    @patch("jbcli.cli.jb.os")
+    def test_checkout_no_reload(self, os_mock, dockerutil_mock, apps_mock, asyncapi_mock):
+        os_mock.path.isdir.return_value = True
+        apps_mock.checkout_branch.return_value = ("1" * 40, "2" * 40)
+
+        result = invoke(["checkout", "release", "cookies", "--no-reload"])
+
+        assert result.exit_code == 0
+        assert apps_mock.discover_apps.mock_calls == []
+        assert apps_mock.checkout_branch.mock_calls == [call("apps/cookies", "release")]
+        assert dockerutil_mock.mock_calls == []
+        assert asyncapi_mock.mock_calls == []
+
+    @patch("jbcli.cli.jb._manifest")
+    @patch("jbcli.cli.jb.asyncapi")
+    @patch("jbcli.cli.jb.apps")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_reload_all(self, dockerutil_mock, apps_mock, asyncapi_mock, manifest_mock, tmpdir):
+        dockerutil_mock.is_running.return_value = [True, False]
+        apps_mock.discover_apps.return_value = ["cake", "cookies", "pie"]
+        loaded = Manifest("custom", stash=Stash(str(tmpdir.join("stash.toml"))))
+        loaded.record("pie", "apps/pie-hash", 1)
+        loaded.record("cake", "old", 1)
+        loaded.record("cookies", "old", 30)
+        manifest_mock.return_value = loaded
+
+        def load_apps(app_names, custom, concurrency, on_result, fail_fast):
+            results = [
+                LoadResult("cookies", True, 204, {}, 0.5),
+                LoadResult("cake", True, 200, {"objects": {"Slice": {"created": 2}}}, 1.5),
+            ]
+            for result in results:
+                on_result(result)
+            return results
+
+        asyncapi_mock.load_apps.side_effect = load_apps
+
+        with patch("jbcli.cli.jb.manifest.tree_hash", side_effect=lambda path: path + "-hash"):
+            result = invoke(["reload-all", "--custom", "-j", "3"])
+
+        assert result.exit_code == 0
+        # Slowest app from the last load goes first
+        assert asyncapi_mock.load_apps.mock_calls == [
+            call(["cookies", "cake"], custom=True, concurrency=3, on_result=ANY,
+                 fail_fast=False)
+        ]
+        assert "Skipping 1 unchanged apps" in result.output
+        assert "Reloading 2 apps, 3 at a time..." in result.output
+        assert loaded.get("cake")["hash"] == "apps/cake-hash"
+        assert loaded.get("cake")["duration"] == 1.5
+        assert loaded.get("cookies")["hash"] == "apps/cookies-hash"
+
+    @patch("jbcli.cli.jb._manifest")
+    @patch("jbcli.cli.jb.asyncapi")
+    @patch("jbcli.cli.jb.apps")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_reload_all_up_to_date(self, dockerutil_mock, apps_mock, asyncapi_mock, manifest_mock):
+        dockerutil_mock.is_running.return_value = [False, True]
+        apps_mock.discover_apps.return_value = ["cake"]
+        manifest_mock.return_value.is_current.return_value = True
+        manifest_mock.return_value.duration.return_value = 0
+
+        result = invoke(["reload-all"])
+        assert result.exit_code == 0
+        assert "All apps are up to date." in result.output
+        assert asyncapi_mock.load_apps.mock_calls == []
+        assert manifest_mock.mock_calls[0] == call(False)
+
+        invoke(["reload-all", "--force"])
+        assert asyncapi_mock.load_apps.call_args_list == [
+            call(["cake"], custom=False, concurrency=4, on_result=ANY, fail_fast=False)
+        ]
+
+    @patch("jbcli.cli.jb._manifest")
+    @patch("jbcli.cli.jb.asyncapi")
+    @patch("jbcli.cli.jb.apps")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_reload_all_failed(self, dockerutil_mock, apps_mock, asyncapi_mock, manifest_mock):
+        dockerutil_mock.is_running.return_value = [False, True]
+        apps_mock.discover_apps.return_value = ["cake", "pie"]
+        manifest_mock.return_value.is_current.return_value = False
+        manifest_mock.return_value.duration.return_value = 0
+        asyncapi_mock.load_apps.return_value = [
+            LoadResult("cake", False, 400, error="Loading app status code was 400"),
+            LoadResult("pie", False, skipped=True),
+        ]
+
+        result = invoke(["reload-all", "--fail-fast"])
+
+        assert result.exit_code == 1
+        assert asyncapi_mock.load_apps.call_args[1]["fail_fast"] is True
+        assert "Failed to load: cake." in result.output
+        assert "Not attempted: pie." in result.output
+        assert manifest_mock.return_value.record.mock_calls == []
+
+    @patch("jbcli.cli.jb.asyncapi")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_reload_all_not_running(self, dockerutil_mock, asyncapi_mock):
+        dockerutil_mock.is_running.return_value = [False, True]
+
+        result = invoke(["reload-all", "--custom"])
+
+        assert result.exit_code == 1
+        assert "Juicebox Custom is not running." in result.output
+        assert asyncapi_mock.mock_calls == []
+
     @patch("jbcli.cli.jb.dockerutil")
     @patch("jbcli.cli.jb.shutil")
     @patch("jbcli.cli.jb.os")
@@ -507,164 +1131,142 @@ class TestCli(object):
             call.path.isdir("apps/cake"),
         ]
 
-    @patch("jbcli.cli.jb.Process")
-    @patch("jbcli.cli.jb.time")
     @patch("jbcli.cli.jb.dockerutil")
-    def test_watch_custom(self, dockerutil_mock, time_mock, process_mock):
-        dockerutil_mock.is_running.return_value = [True, True]
-        dockerutil_mock.ensure_home.return_value = True
-        time_mock.sleep.side_effect = KeyboardInterrupt
+    def test_watch_custom(self, dockerutil_mock):
         result = invoke(["watch", "--custom"])
 
-        assert process_mock.mock_calls == [
-            call(
-                target=dockerutil_mock.jb_watch,
-                kwargs={"app": "", "should_reload": False, "custom": True},
-            ),
-            call().start(),
-            call().join(),
+        assert dockerutil_mock.mock_calls == [
+            call.jb_watch(app="", should_reload=False, custom=True, includejs=False),
         ]
-
         assert result.exit_code == 0
 
-    @patch("jbcli.cli.jb.Process")
-    @patch("jbcli.cli.jb.time")
     @patch("jbcli.cli.jb.dockerutil")
-    def test_watch_selfserve(self, dockerutil_mock, time_mock, process_mock):
-        dockerutil_mock.is_running.return_value = [True, True]
-        dockerutil_mock.ensure_home.return_value = True
-        time_mock.sleep.side_effect = KeyboardInterrupt
+    def test_watch_selfserve(self, dockerutil_mock):
         result = invoke(["watch"])
 
-        assert process_mock.mock_calls == [
-            call(
-                target=dockerutil_mock.jb_watch,
-                kwargs={"app": "", "should_reload": False, "custom": False},
-            ),
-            call().start(),
-            call().join(),
+        assert dockerutil_mock.mock_calls == [
+            call.jb_watch(app="", should_reload=False, custom=False, includejs=False),
         ]
-
         assert result.exit_code == 0
 
-    @patch("jbcli.cli.jb.Process")
-    @patch("jbcli.cli.jb.time")
     @patch("jbcli.cli.jb.dockerutil")
-    def test_watch_for_specific_app(self, dockerutil_mock, time_mock, process_mock):
-        dockerutil_mock.is_running.return_value = [True, False]
-        dockerutil_mock.ensure_home.return_value = True
-        time_mock.sleep.side_effect = KeyboardInterrupt
+    def test_watch_for_specific_app(self, dockerutil_mock):
         result = invoke(["watch", "--app", "test", "--custom"])
 
-        assert process_mock.mock_calls == [
-            call(
-                target=dockerutil_mock.jb_watch,
-                kwargs={"app": "test", "should_reload": False, "custom": True},
-            ),
-            call().start(),
-            call().join(),
+        assert dockerutil_mock.mock_calls == [
+            call.jb_watch(app="test", should_reload=False, custom=True, includejs=False),
         ]
-
         assert result.exit_code == 0
 
-    @patch("jbcli.cli.jb.Process")
-    @patch("jbcli.cli.jb.time")
     @patch("jbcli.cli.jb.dockerutil")
     @patch("jbcli.cli.jb.create_browser_instance")
-    def test_watch_with_reload(
-            self, browser_mock, dockerutil_mock, time_mock, process_mock
-    ):
-        dockerutil_mock.is_running.return_value = [True, True]
-        dockerutil_mock.ensure_home.return_value = True
-        time_mock.sleep.side_effect = KeyboardInterrupt
+    def test_watch_with_reload(self, browser_mock, dockerutil_mock):
         result = invoke(["watch", "--reload"])
-        assert process_mock.mock_calls == [
-            call(
-                target=dockerutil_mock.jb_watch,
-                kwargs={"app": "", "should_reload": True, "custom": False},
-            ),
-            call().start(),
-            call().join(),
+
+        assert dockerutil_mock.mock_calls == [
+            call.jb_watch(app="", should_reload=True, custom=False, includejs=False),
         ]
-        assert browser_mock.called is True
+        assert browser_mock.mock_calls == [call(custom=False)]
         assert result.exit_code == 0
 
-    @patch("jbcli.cli.jb.Process")
-    @patch("jbcli.cli.jb.time")
     @patch("jbcli.cli.jb.dockerutil")
     @patch("jbcli.cli.jb.create_browser_instance")
-    def test_watch_with_specific_app_and_reload(
-            self, browser_mock, dockerutil_mock, time_mock, process_mock
-    ):
-        dockerutil_mock.is_running.return_value = [True, False]
-        dockerutil_mock.ensure_home.return_value = True
-        time_mock.sleep.side_effect = KeyboardInterrupt
+    def test_watch_with_specific_app_and_reload(self, browser_mock, dockerutil_mock):
         result = invoke(["watch", "--app", "test", "--reload", "--custom"])
-        assert process_mock.mock_calls == [
-            call(
-                target=dockerutil_mock.jb_watch,
-                kwargs={"app": "test", "should_reload": True, "custom": True},
-            ),
-            call().start(),
-            call().join(),
+
+        assert dockerutil_mock.mock_calls == [
+            call.jb_watch(app="test", should_reload=True, custom=True, includejs=False),
         ]
-        assert browser_mock.called is True
+        assert browser_mock.mock_calls == [call(custom=True)]
         assert result.exit_code == 0
 
-    @patch("jbcli.cli.jb.Process")
-    @patch("jbcli.cli.jb.time")
     @patch("jbcli.cli.jb.dockerutil")
-    def test_watch_full(self, dockerutil_mock, time_mock, process_mock):
-        dockerutil_mock.is_running.return_value = [True, True]
-        dockerutil_mock.ensure_home.return_value = True
-        time_mock.sleep.side_effect = KeyboardInterrupt
+    def test_watch_full(self, dockerutil_mock):
         result = invoke(["watch", "--includejs", "--custom"])
 
-        assert process_mock.mock_calls == [
-            call(
-                target=dockerutil_mock.jb_watch,
-                kwargs={"app": "", "should_reload": False, "custom": True},
-            ),
-            call().start(),
-            call(target=dockerutil_mock.js_watch),
-            call().start(),
-            call().join(),
-            call().join(),
+        # The JS watcher runs in the same process as the app watcher
+        assert dockerutil_mock.mock_calls == [
+            call.jb_watch(app="", should_reload=False, custom=True, includejs=True),
         ]
+        assert result.exit_code == 0
+
+    @patch("jbcli.cli.jb.dockerutil")
+    @patch("jbcli.cli.jb.reloadstats")
+    def test_watch_stats(self, reloadstats_mock, dockerutil_mock):
+        result = invoke(["watch", "--stats"])
 
+        assert reloadstats_mock.mock_calls == [call.print_summary()]
+        assert dockerutil_mock.mock_calls == []
         assert result.exit_code == 0
 
     @patch("jbcli.cli.jb.platform")
     @patch("jbcli.cli.jb.dockerutil")
-    def test_stop_custom(self, dockerutil_mock, platform_mock, monkeypatch):
+    def test_stop(self, dockerutil_mock, platform_mock, monkeypatch):
         monkeypatch.chdir(DEVLANDIA_DIR)
-        dockerutil_mock.is_running.return_value = [True, False]
-        dockerutil_mock.ensure_home.return_value = True
-        dockerutil_mock.halt.return_value = None
+        dockerutil_mock.stop_project.return_value = [
+            StopResult('devlandia_juicebox_custom_1', 'juicebox_custom', 'stopped', 1.23, None),
+            StopResult('devlandia_postgres_1', 'postgres', 'stopped', 0.5, None),
+        ]
         platform_mock.processor.return_value = 'x86_64'
-        result = invoke(["stop", "--custom"])
+        result = invoke(["stop"])
         assert result.exit_code == 0
         assert dockerutil_mock.mock_calls == [
             call.ensure_home(),
-            call.is_running(),
-            call.halt(arch='x86_64', custom=True),
+            call.stop_project(fast=False),
         ]
+        assert "juicebox_custom  stopped" in result.output
+        assert "Juicebox is no longer running." in result.output
 
     @patch("jbcli.cli.jb.platform")
     @patch("jbcli.cli.jb.dockerutil")
-    def test_stop_selfserve(self, dockerutil_mock, platform_mock, monkeypatch):
+    def test_stop_fast(self, dockerutil_mock, platform_mock, monkeypatch):
         monkeypatch.chdir(DEVLANDIA_DIR)
-        dockerutil_mock.is_running.return_value = [False, True]
-        dockerutil_mock.ensure_home.return_value = True
-        dockerutil_mock.halt.return_value = None
+        dockerutil_mock.stop_project.return_value = [
+            StopResult('devlandia_juicebox_selfserve_1', 'juicebox_selfserve', 'killed', 0.1, None),
+            StopResult('devlandia_postgres_1', 'postgres', 'failed', 30.0, 'timed out'),
+        ]
+        platform_mock.processor.return_value = 'x86_64'
+        result = invoke(["stop", "--fast"])
+        assert result.exit_code == 1
+        assert dockerutil_mock.stop_project.mock_calls == [call(fast=True)]
+        assert "Could not stop devlandia_postgres_1: timed out" in result.output
+
+    @patch("jbcli.cli.jb.platform")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_stop_not_running(self, dockerutil_mock, platform_mock, monkeypatch):
+        monkeypatch.chdir(DEVLANDIA_DIR)
+        dockerutil_mock.stop_project.return_value = []
         platform_mock.processor.return_value = 'x86_64'
         result = invoke(["stop"])
         assert result.exit_code == 0
-        assert dockerutil_mock.mock_calls == [
-            call.ensure_home(),
-            call.is_running(),
-            call.halt(arch='x86_64', custom=False),
-        ]
+        assert "Juicebox is not running" in result.output
+
+    @patch("jbcli.cli.jb.composebackend.available_backends", return_value=["v1", "native"])
+    @patch("jbcli.cli.jb.platform")
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_compose_bench(self, dockerutil_mock, platform_mock, backends_mock, monkeypatch):
+        monkeypatch.chdir(DEVLANDIA_DIR)
+        dockerutil_mock.is_running.return_value = [False, True]
+        platform_mock.processor.return_value = 'x86_64'
+        result = invoke(["compose-bench", "--rounds", "2"], input="y\n")
+        assert result.exit_code == 0
+        assert "stops and starts Juicebox 4 times" in result.output
+        assert dockerutil_mock.mock_calls == [call.is_running()] + [
+            call.halt(arch='x86_64', custom=False, backend='v1'),
+            call.resume(arch='x86_64', custom=False, backend='v1'),
+        ] * 2 + [
+            call.halt(arch='x86_64', custom=False, backend='native'),
+            call.resume(arch='x86_64', custom=False, backend='native'),
+        ] * 2
+        assert "Stop (median s)" in result.output
+
+    @patch("jbcli.cli.jb.dockerutil")
+    def test_compose_bench_not_running(self, dockerutil_mock, monkeypatch):
+        monkeypatch.chdir(DEVLANDIA_DIR)
+        dockerutil_mock.is_running.return_value = [False, False]
+        result = invoke(["compose-bench", "--yes"])
+        assert result.exit_code == 1
+        assert dockerutil_mock.halt.mock_calls == []
 
     @patch("jbcli.cli.jb.platform")
     @patch("jbcli.cli.jb.dockerutil")
@@ -676,7 +1278,7 @@ class TestCli(object):
         platform_mock.processor.return_value = 'x86_64'
         result = invoke(["stop", "--clean", "--custom"])
         assert result.exit_code == 0
-        assert dockerutil_mock.mock_calls == [call.ensure_home(), call.is_running(), call.destroy(arch='x86_64', custom=True, ganesha=False)]
+        assert dockerutil_mock.mock_calls == [call.ensure_home(), call.destroy(arch='x86_64', custom=True, ganesha=False)]
 
     @patch("jbcli.cli.jb.platform")
     @patch("jbcli.cli.jb.dockerutil")
@@ -688,7 +1290,7 @@ class TestCli(object):
         platform_mock.processor.return_value = 'x86_64'
         result = invoke(["stop", "--clean", "--custom", "--ganesha"])
         assert result.exit_code == 0
-        assert dockerutil_mock.mock_calls == [call.ensure_home(), call.is_running(),
+        assert dockerutil_mock.mock_calls == [call.ensure_home(),
                                               call.destroy(arch='x86_64', custom=True, ganesha=True)]
 
     @patch("jbcli.cli.jb.platform")
@@ -701,7 +1303,7 @@ class TestCli(object):
         platform_mock.processor.return_value = 'x86_64'
         result = invoke(["stop", "--clean"])
         assert result.exit_code == 0
-        assert dockerutil_mock.mock_calls == [call.ensure_home(), call.is_running(), call.destroy(arch='x86_64', custom=False, ganesha=False)]
+        assert dockerutil_mock.mock_calls == [call.ensure_home(), call.destroy(arch='x86_64', custom=False, ganesha=False)]
 
     @patch("jbcli.cli.jb.dockerutil")
     @patch("jbcli.cli.jb.os")
@@ -722,7 +1324,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(env=ANY, ganesha=False, custom=False, arch='x86_64', emulate=False),
+            call.up(env=ANY, ganesha=False, custom=False, arch='x86_64', emulate=False, overlays=[]),
         ]
         assert m.mock_calls == [
             call(expanduser('~/.config/juicebox/devlandia.toml')),
@@ -766,7 +1368,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(arch='x86_64', env=ANY, ganesha=False, custom=False, emulate=False),
+            call.up(arch='x86_64', env=ANY, ganesha=False, custom=False, emulate=False, overlays=[]),
         ]
         assert m.mock_calls == [
             call(expanduser('~/.config/juicebox/devlandia.toml')),
@@ -805,7 +1407,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(arch='arm', env=ANY, ganesha=False, custom=False, emulate=False),
+            call.up(arch='arm', env=ANY, ganesha=False, custom=False, emulate=False, overlays=[]),
         ]
 
     @patch("jbcli.cli.jb.dockerutil")
@@ -822,7 +1424,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=True, tag="master-py3"),
-            call.up(arch='arm', env=ANY, ganesha=False, custom=False, emulate=True),
+            call.up(arch='arm', env=ANY, ganesha=False, custom=False, emulate=True, overlays=[]),
         ]
 
     @patch("jbcli.cli.jb.determine_arch")
@@ -844,7 +1446,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(env=ANY, ganesha=False, custom=True, arch='x86_64', emulate=False),
+            call.up(env=ANY, ganesha=False, custom=True, arch='x86_64', emulate=False, overlays=[]),
         ]
         assert m.mock_calls == [
             call(expanduser('~/.config/juicebox/devlandia.toml')),
@@ -886,7 +1488,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="potato"),
-            call.up(arch='arm', env=ANY, ganesha=False, custom=False, emulate=False),
+            call.up(arch='arm', env=ANY, ganesha=False, custom=False, emulate=False, overlays=[]),
         ]
         assert m.mock_calls == [
             call(expanduser('~/.config/juicebox/devlandia.toml')),
@@ -927,7 +1529,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="master-py3"),
-            call.up(arch='arm', env=ANY, ganesha=False, custom=False, emulate=False),
+            call.up(arch='arm', env=ANY, ganesha=False, custom=False, emulate=False, overlays=[]),
         ]
         assert m.mock_calls == [
             call(expanduser('~/.config/juicebox/devlandia.toml')),
@@ -968,7 +1570,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="master-py3"),
-            call.up(arch='x86_64', env=ANY, ganesha=False, custom=False, emulate=False),
+            call.up(arch='x86_64', env=ANY, ganesha=False, custom=False, emulate=False, overlays=[]),
         ]
         assert m.mock_calls == [
             call(expanduser('~/.config/juicebox/devlandia.toml')),
@@ -1101,6 +1703,25 @@ class TestCli(object):
             call().__exit__(None, None, None)
         ]
 
+    @patch("jbcli.cli.jb.os")
+    @patch("jbcli.cli.jb.dockerutil")
+    @patch("jbcli.cli.jb.auth")
+    @patch('jbcli.cli.jb.prompt')
+    @patch('jbcli.cli.jb.determine_arch')
+    def test_start_core_without_venv_cache(self, arch_mock, prompt_mock, auth_mock, dockerutil_mock, os_mock):
+        dockerutil_mock.is_running.return_value = [False, False]
+        os_mock.path.exists.return_value = True
+        arch_mock.return_value = 'x86_64'
+        auth_mock.deduped_mfas = ["arn:aws:iam::423681189101:mfa/TestMFA"]
+        with patch("builtins.open", mock_open()):
+            result = invoke(["start", "core", "--noupgrade", "--no-venv-cache"])
+        assert result.exit_code == 0
+        assert dockerutil_mock.mock_calls == [
+            call.is_running(),
+            call.pull(emulate=False, tag="develop-py3"),
+            call.up(arch="x86_64", env=ANY, ganesha=False, custom=False, emulate=False, overlays=[]),
+        ]
+
     @patch("jbcli.cli.jb.os")
     @patch("jbcli.cli.jb.dockerutil")
     @patch("jbcli.cli.jb.auth")
@@ -1147,7 +1768,8 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(arch="x86_64", env=ANY, ganesha=False, custom=False, emulate=False),
+            call.parse_dc_file("develop-py3", emulate=False, custom=False),
+            call.up(arch="x86_64", env=ANY, ganesha=False, custom=False, emulate=False, overlays=[VENV_OVERLAY]),
         ]
 
     @patch("jbcli.cli.jb.os")
@@ -1199,7 +1821,8 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(arch="x86_64", env=ANY, ganesha=False, custom=False, emulate=False),
+            call.parse_dc_file("develop-py3", emulate=False, custom=False),
+            call.up(arch="x86_64", env=ANY, ganesha=False, custom=False, emulate=False, overlays=[VENV_OVERLAY]),
         ]
 
     @patch("jbcli.cli.jb.os")
@@ -1248,7 +1871,8 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(env=ANY, ganesha=False, custom=True, arch='x86_64', emulate=False),
+            call.parse_dc_file("develop-py3", emulate=False, custom=True),
+            call.up(env=ANY, ganesha=False, custom=True, arch='x86_64', emulate=False, overlays=[VENV_OVERLAY]),
         ]
 
     @patch("jbcli.cli.jb.os")
@@ -1300,7 +1924,8 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(arch="arm", env=ANY, ganesha=False, custom=False, emulate=False),
+            call.parse_dc_file("develop-py3", emulate=False, custom=False),
+            call.up(arch="arm", env=ANY, ganesha=False, custom=False, emulate=False, overlays=[VENV_OVERLAY]),
         ]
 
     @patch("jbcli.cli.jb.dockerutil")
@@ -1319,7 +1944,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate= False, tag="develop-py3"),
-            call.up(arch="x86_64", env=ANY, ganesha=False, custom=False, emulate=False),
+            call.up(arch="x86_64", env=ANY, ganesha=False, custom=False, emulate=False, overlays=[]),
         ]
 
     @patch("jbcli.cli.jb.os")
@@ -1451,7 +2076,8 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(env=ANY, ganesha=False, custom=True, arch='x86_64', emulate=False),
+            call.parse_dc_file("develop-py3", emulate=False, custom=True),
+            call.up(env=ANY, ganesha=False, custom=True, arch='x86_64', emulate=False, overlays=[VENV_OVERLAY]),
         ]
         assert m.mock_calls == [
             call(expanduser('~/.config/juicebox/devlandia.toml')),
@@ -1492,7 +2118,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(arch="arm", env=ANY, ganesha=False, custom=False, emulate=False),
+            call.up(arch="arm", env=ANY, ganesha=False, custom=False, emulate=False, overlays=[]),
         ]
         assert m.mock_calls == [
             call(expanduser('~/.config/juicebox/devlandia.toml')),
@@ -1533,7 +2159,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(env=ANY, ganesha=False, custom=False, arch='x86_64', emulate=False),
+            call.up(env=ANY, ganesha=False, custom=False, arch='x86_64', emulate=False, overlays=[]),
         ]
         assert m.mock_calls == [
             call(expanduser('~/.config/juicebox/devlandia.toml')),
@@ -1573,7 +2199,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(arch="arm", env=ANY, ganesha=False, custom=False, emulate=False),
+            call.up(arch="arm", env=ANY, ganesha=False, custom=False, emulate=False, overlays=[]),
         ]
         assert m.mock_calls == [
             call(expanduser('~/.config/juicebox/devlandia.toml')),
@@ -1613,7 +2239,7 @@ class TestCli(object):
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
             call.pull(emulate=False, tag="develop-py3"),
-            call.up(env=ANY, ganesha=False, custom=True, arch="x86_64", emulate=False),
+            call.up(env=ANY, ganesha=False, custom=True, arch="x86_64", emulate=False, overlays=[]),
         ]
         assert m.mock_calls == [
             call(expanduser('~/.config/juicebox/devlandia.toml')),
@@ -1670,7 +2296,7 @@ class TestCli(object):
             result = invoke(["start", "develop-py3", "--noupdate", "--noupgrade"])
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
-            call.up(arch="arm", env=ANY, ganesha=False, custom=False, emulate=False),
+            call.up(arch="arm", env=ANY, ganesha=False, custom=False, emulate=False, overlays=[]),
         ]
 
     @patch("jbcli.cli.jb.dockerutil")
@@ -1689,10 +2315,34 @@ class TestCli(object):
             result = invoke(["start", "develop-py3", "--noupdate", "--noupgrade"])
         assert dockerutil_mock.mock_calls == [
             call.is_running(),
-            call.up(arch="x86_64", env=ANY, ganesha=False, custom=False, emulate=False),
+            call.up(arch="x86_64", env=ANY, ganesha=False, custom=False, emulate=False, overlays=[]),
         ]
         assert result.exit_code == 0
 
+    @patch("jbcli.cli.jb.dockerutil")
+    @patch("jbcli.cli.jb.auth")
+    @patch("jbcli.cli.jb.check_outdated_image")
+    @patch('jbcli.cli.jb.determine_arch')
+    @patch('jbcli.cli.jb.prompt')
+    def test_start_ephemeral(self, prompt_mock, arch_mock, image_mock, auth_mock, dockerutil_mock, monkeypatch):
+        dockerutil_mock.is_running.return_value = [False, False]
+        image_mock.answer = "no"
+        arch_mock.return_value = 'x86_64'
+        auth_mock.deduped_mfas = ["arn:aws:iam::423681189101:mfa/TestMFA"]
+        with patch("jbcli.cli.jb.ephemeral") as ephemeral_mock, patch("builtins.open", mock_open()):
+            ephemeral_mock.overlay.return_value = {"services": {"redis": {}}}
+            result = invoke(["start", "develop-py3", "--noupdate", "--noupgrade", "--ephemeral"])
+        assert result.exit_code == 0
+        assert ephemeral_mock.switch.mock_calls == [call(True, stash=ANY)]
+        assert ephemeral_mock.time_startup.mock_calls == [
+            call("http://localhost:8000/", True, stash=ANY, on_ready=ANY)]
+        assert dockerutil_mock.mock_calls == [
+            call.is_running(),
+            call.up(arch="x86_64", env=ANY, ganesha=False, custom=False, emulate=False,
+                    overlays=[{"services": {"redis": {}}}]),
+        ]
+        assert "Ephemeral mode" in result.output
+
     @patch("jbcli.cli.jb.dockerutil")
     @patch("jbcli.cli.jb.auth")
     @patch("jbcli.cli.jb.check_outdated_image")
@@ -1750,6 +2400,7 @@ class TestCli(object):
                 init_vcs=True,
                 track_vcs=True,
                 custom=True,
+                hardlink=False,
             )
         ]
         assert os_mock.mock_calls == [
@@ -1881,6 +2532,7 @@ class TestCli(object):
                 init_vcs=True,
                 track_vcs=True,
                 custom=True,
+                hardlink=False,
             )
         ]
         assert os_mock.mock_calls == [
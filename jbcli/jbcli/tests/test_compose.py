@@ -0,0 +1,91 @@
+import os
+import stat
+
+import yaml
+
+from ..utils import compose
+
+
+def _write(tmpdir, name, config):
+    path = tmpdir.join(name)
+    path.write(yaml.safe_dump(config))
+    return str(path)
+
+
+class TestMerge:
+    def test_services(self):
+        merged = compose.merge([
+            {'version': '3.3', 'services': {
+                'juicebox': {
+                    'image': 'juicebox:${TAG}',
+                    'command': ['serve', '--reload'],
+                    'environment': {'DEBUG': 'true', 'JB_REDSHIFT_CONNECTION': None},
+                    'volumes': ['./apps:/code/apps', 'jb-data:/data'],
+                    'ports': ['8000:8000'],
+                },
+                'redis': {'image': 'redis'},
+            }},
+            {'version': '3.10', 'services': {
+                'juicebox': {
+                    'command': 'serve',
+                    'environment': ['DEBUG=false', 'JB_HSTM_REDSHIFT_CONNECTION'],
+                    'volumes': ['../my-apps:/code/apps'],
+                    'ports': ['8000:8000', '8888:8888'],
+                    'extra_hosts': ['redshift.example.com:172.17.0.1'],
+                },
+            }},
+        ])
+
+        assert merged['version'] == '3.10'
+        assert merged['services']['redis'] == {'image': 'redis'}
+        assert merged['services']['juicebox'] == {
+            'image': 'juicebox:${TAG}',
+            'command': 'serve',
+            'environment': {'DEBUG': 'false', 'JB_REDSHIFT_CONNECTION': None,
+                            'JB_HSTM_REDSHIFT_CONNECTION': None},
+            'volumes': ['../my-apps:/code/apps', 'jb-data:/data'],
+            'ports': ['8000:8000', '8888:8888'],
+            'extra_hosts': ['redshift.example.com:172.17.0.1'],
+        }
+
+    def test_empty_sections(self):
+        merged = compose.merge([
+            {'services': {'juicebox': {'image': 'juicebox'}}, 'volumes': {'jb-data': None}},
+            {'services': {'juicebox': None}, 'volumes': {'pg-data': None}},
+        ])
+        assert merged == {
+            'services': {'juicebox': {'image': 'juicebox'}},
+            'volumes': {'jb-data': None, 'pg-data': None},
+        }
+
+
+class TestMergedConfigFile:
+    def test_cached(self, tmpdir):
+        cache_dir = str(tmpdir.join('cache'))
+        base = _write(tmpdir, 'common-services.yml',
+                      {'services': {'juicebox': {'image': 'juicebox:${TAG}'}}})
+        overlay = {'services': {'juicebox': {'environment': ['JB_REDSHIFT_CONNECTION']}}}
+
+        path = compose.merged_config_file([base], [overlay], cache_dir=cache_dir)
+        with open(path) as f:
+            assert yaml.safe_load(f) == {'services': {'juicebox': {
+                'image': 'juicebox:${TAG}', 'environment': ['JB_REDSHIFT_CONNECTION']}}}
+        assert stat.S_IMODE(os.stat(cache_dir).st_mode) == 0o700
+
+        assert compose.merged_config_file([base], [overlay], cache_dir=cache_dir) == path
+        assert compose.merged_config_file([base], cache_dir=cache_dir) != path
+
+        # Changing a compose file gives a new merged file
+        _write(tmpdir, 'common-services.yml', {'services': {'juicebox': {'image': 'juicebox'}}})
+        changed = compose.merged_config_file([base], [overlay], cache_dir=cache_dir)
+        assert changed != path
+        assert len(os.listdir(cache_dir)) == 3
+
+    def test_prune(self, tmpdir):
+        cache_dir = str(tmpdir.join('cache'))
+        base = _write(tmpdir, 'common-services.yml', {'services': {'juicebox': {}}})
+        for port in range(compose.CACHE_SIZE + 5):
+            compose.merged_config_file(
+                [base], [{'services': {'juicebox': {'ports': [str(port)]}}}],
+                cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == compose.CACHE_SIZE
@@ -0,0 +1,118 @@
+import threading
+
+import docker.errors
+import pytest
+import yaml
+from mock import Mock, patch
+
+from ..utils import composebackend
+from ..utils.composebackend import ComposeV1, ComposeV2, NativeBackend
+
+
+def _container(service, status='running', project='devlandia'):
+    container = Mock(labels={composebackend.PROJECT_LABEL: project,
+                             composebackend.SERVICE_LABEL: service},
+                     status=status)
+    container.name = f'{project}_{service}_1'
+    return container
+
+
+@pytest.fixture
+def config_file(tmpdir):
+    path = tmpdir.join('merged.yml')
+    path.write(yaml.safe_dump({'services': {'juicebox_selfserve': {}, 'redis': {}}}))
+    return str(path)
+
+
+class TestSelect:
+    @patch('jbcli.utils.composebackend.shutil.which', return_value='/usr/bin/docker-compose')
+    @patch('jbcli.utils.composebackend._has_compose_plugin', return_value=True)
+    def test_auto(self, plugin_mock, which_mock):
+        client = Mock()
+        backend = composebackend.select('stop', name='auto', client=client)
+        assert isinstance(backend, NativeBackend)
+        assert isinstance(backend.fallback, ComposeV1)
+        assert isinstance(composebackend.select('up', name='auto', client=client), ComposeV1)
+
+        which_mock.return_value = None
+        assert isinstance(composebackend.select('up', name='auto', client=client), ComposeV2)
+
+    def test_forced(self):
+        assert isinstance(composebackend.select('stop', name='v1', client=Mock()), ComposeV1)
+        assert isinstance(composebackend.select('stop', name='v2', client=Mock()), ComposeV2)
+        with pytest.raises(ValueError):
+            composebackend.select('stop', name='v3')
+
+    def test_command_line(self):
+        assert ComposeV2().command_line(['stop'], 'merged.yml', 'devlandia') == [
+            'docker', 'compose', '--project-directory', '.', '--project-name', 'devlandia',
+            '-f', 'merged.yml', 'stop']
+
+
+class TestNativeBackend:
+    def test_stop(self, config_file):
+        juicebox, redis, other = (_container('juicebox_selfserve'), _container('redis', 'exited'),
+                                  _container('juicebox_custom'))
+        client = Mock()
+        client.containers.list.return_value = [juicebox, redis, other]
+
+        assert NativeBackend(client, ComposeV1()).run(['stop'], config_file, 'devlandia') is True
+
+        client.containers.list.assert_called_once_with(
+            all=True, filters={'label': 'com.docker.compose.project=devlandia'})
+        juicebox.stop.assert_called_once_with(timeout=composebackend.STOP_TIMEOUT)
+        assert not redis.stop.called
+        assert not other.stop.called
+
+    def test_start(self, config_file):
+        juicebox, redis = _container('juicebox_selfserve', 'exited'), _container('redis')
+        client = Mock()
+        client.containers.list.return_value = [juicebox, redis]
+
+        assert NativeBackend(client, ComposeV1()).run(['start'], config_file, 'devlandia') is True
+        juicebox.start.assert_called_once_with()
+        assert not redis.start.called
+
+    def test_fallback(self, config_file):
+        client = Mock()
+        client.containers.list.return_value = [_container('redis', 'exited')]
+        backend = NativeBackend(client, ComposeV1())
+
+        # juicebox_selfserve was never created, compose has to do that
+        assert backend.run(['start'], config_file, 'devlandia') is False
+        assert backend.run(['up'], config_file, 'devlandia') is False
+        assert backend.run(['stop', '-t', '1'], config_file, 'devlandia') is False
+
+    def test_stop_concurrently(self):
+        juicebox, postgres = _container('juicebox_selfserve'), _container('postgres')
+        barrier = threading.Barrier(2, timeout=5)
+        # Both stops have to be in flight at once to get past the barrier
+        juicebox.stop.side_effect = postgres.stop.side_effect = lambda timeout: barrier.wait()
+
+        results = NativeBackend(Mock(), None).stop([juicebox, postgres])
+
+        assert [(r.service, r.action, r.error) for r in results] == [
+            ('juicebox_selfserve', 'stopped', None), ('postgres', 'stopped', None)]
+        juicebox.stop.assert_called_once_with(timeout=composebackend.STOP_TIMEOUT)
+        postgres.stop.assert_called_once_with(timeout=composebackend.STOP_TIMEOUTS['postgres'])
+
+    def test_stop_fast(self):
+        juicebox, postgres = _container('juicebox_selfserve'), _container('postgres')
+        postgres.stop.side_effect = docker.errors.APIError('boom', explanation='timed out')
+
+        results = NativeBackend(Mock(), None).stop([juicebox, postgres], fast=True)
+
+        assert [(r.name, r.action, r.error) for r in results] == [
+            ('devlandia_juicebox_selfserve_1', 'killed', None),
+            ('devlandia_postgres_1', 'failed', 'timed out'),
+        ]
+        juicebox.kill.assert_called_once_with()
+        assert not juicebox.stop.called
+        # Postgres is never killed
+        assert not postgres.kill.called
+
+    def test_running(self):
+        client = Mock()
+        NativeBackend(client, None).running('devlandia')
+        client.containers.list.assert_called_once_with(
+            filters={'label': 'com.docker.compose.project=devlandia'})
@@ -0,0 +1,93 @@
+import csv
+import json
+from datetime import datetime, timezone
+
+import pytest
+from mock import Mock
+
+from ..utils.containerstats import Recorder, Sample, StatsStream, sample
+
+READ = datetime(2024, 5, 2, 10, 0, 2, tzinfo=timezone.utc)
+
+
+def stats(read, total_usage, system_usage, read_bytes, rx_bytes):
+    return {
+        'read': read,
+        'cpu_stats': {'cpu_usage': {'total_usage': total_usage}, 'system_cpu_usage': system_usage,
+                      'online_cpus': 4},
+        'precpu_stats': {'cpu_usage': {'total_usage': total_usage - 500},
+                         'system_cpu_usage': system_usage - 2000},
+        'memory_stats': {'usage': 300 * 1024 ** 2, 'limit': 1024 ** 3,
+                         'stats': {'inactive_file': 100 * 1024 ** 2}},
+        'blkio_stats': {'io_service_bytes_recursive': [
+            {'major': 8, 'minor': 0, 'op': 'read', 'value': read_bytes},
+            {'major': 8, 'minor': 0, 'op': 'write', 'value': 4096},
+        ]},
+        'networks': {'eth0': {'rx_bytes': rx_bytes, 'tx_bytes': 10},
+                     'eth1': {'rx_bytes': rx_bytes, 'tx_bytes': 10}},
+        'pids_stats': {'current': 7},
+    }
+
+
+FIRST = stats('2024-05-02T10:00:00.000000000Z', 1000, 10000, 0, 1000)
+SECOND = stats('2024-05-02T10:00:02.000000000Z', 1500, 12000, 4 * 1024 ** 2, 3000)
+
+
+class FakeContainer(object):
+    def __init__(self, service, *documents):
+        self.labels = {'com.docker.compose.service': service}
+        self.name = f'devlandia_{service}_1'
+        self.documents = documents
+
+    def stats(self, stream, decode):
+        return iter(self.documents)
+
+
+def test_sample():
+    taken = sample('postgres', SECOND, FIRST)
+    assert taken == Sample(READ, 'postgres', 100.0, 200 * 1024 ** 2, 1024 ** 3,
+                           2 * 1024 ** 2, 0.0, 2000.0, 0.0, 7)
+
+
+def test_sample_restarted():
+    # The counters of a restarted container start over
+    assert sample('redis', FIRST, dict(SECOND, read='2024-05-02T09:59:58Z')).block_read == 0
+
+
+def test_stream():
+    stopped = dict(FIRST, read='0001-01-01T00:00:00Z')
+    client = Mock(**{'containers.list.return_value': [
+        FakeContainer('postgres', FIRST, SECOND, stopped, SECOND),
+        FakeContainer('redis', FIRST),
+    ]})
+    stream = StatsStream(client, 'devlandia')
+
+    batches = list(stream.samples(interval=0.5))
+
+    assert [[taken.service for taken in batch] for batch in batches] == [['postgres']]
+    assert client.containers.list.call_args[1]['all'] is False
+
+    with pytest.raises(ValueError, match='No containers for snapshot'):
+        StatsStream(client, 'devlandia', services=['snapshot']).containers()
+
+
+@pytest.mark.parametrize('name', ['stats.csv', 'stats.jsonl'])
+def test_recorder(tmp_path, name):
+    path = str(tmp_path / name)
+    with Recorder(path) as recorder:
+        recorder.write([sample('postgres', SECOND, FIRST)])
+    assert recorder.count == 1
+
+    with open(path) as f:
+        if name.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f]
+    assert rows[0]['time'] == '2024-05-02T10:00:02+00:00'
+    assert rows[0]['service'] == 'postgres'
+    assert float(rows[0]['cpu']) == 100.0
+
+
+def test_recorder_format():
+    with pytest.raises(ValueError, match=r"Can't record to stats.txt, use a .csv or .jsonl or .ndjson file."):
+        Recorder('stats.txt')
@@ -0,0 +1,154 @@
+import docker.errors
+import pytest
+from mock import ANY, Mock, call
+
+from ..utils import dbsnapshot, ephemeral
+from ..utils.dbsnapshot import Snapshots
+from ..utils.manifest import MANIFEST_KEY
+from ..utils.storageutil import Stash
+
+
+@pytest.fixture
+def stash(tmpdir):
+    return Stash(str(tmpdir.join('stash.toml')))
+
+
+def _client(postgres=True):
+    client = Mock()
+    container = Mock(attrs={'Mounts': [
+        {'Destination': dbsnapshot.DATA_DIR, 'Name': 'pgdata'},
+    ]})
+    container.name = 'devlandia_postgres_1'
+    container.image.id = 'sha256:postgres'
+    container.exec_run.return_value = (0, b'accepting connections')
+    client.containers.list.return_value = [container] if postgres else []
+    client.containers.run.return_value = b'2048\n'
+    return client, container
+
+
+class TestSnapshot:
+    def test_volume(self, stash):
+        client, postgres = _client()
+        stash.put(MANIFEST_KEY, {'selfserve': {'cookies': {'hash': 'git:abc'}}})
+
+        snapshot = Snapshots(client, 'devlandia', stash=stash).snapshot('before-upgrade')
+
+        assert (snapshot.name, snapshot.method, snapshot.size) == (
+            'before-upgrade', 'volume', 2048 * 1024)
+        client.containers.list.assert_called_once_with(filters={'label': [
+            'com.docker.compose.project=devlandia', 'com.docker.compose.service=postgres']})
+        # The copy is made while postgres is paused
+        assert [c[0] for c in postgres.mock_calls if c[0] in ('pause', 'unpause')] == [
+            'pause', 'unpause']
+        client.containers.run.assert_called_once_with(
+            'sha256:postgres', ['sh', '-c', ANY], remove=True, environment=ANY, volumes={
+                'pgdata': {'bind': '/data', 'mode': 'ro'},
+                'jb-db-snapshots': {'bind': '/snapshots', 'mode': 'rw'},
+            })
+        assert 'cp -a /data /snapshots/before-upgrade/data' in client.containers.run.call_args[0][1][2]
+        assert stash.get(dbsnapshot.SNAPSHOTS_KEY)['before-upgrade']['manifest'] == {
+            'selfserve': {'cookies': {'hash': 'git:abc'}}}
+
+    def test_dump(self, stash):
+        client, postgres = _client()
+
+        Snapshots(client, 'Devlandia', stash=stash).snapshot('nightly', method='dump', jobs=8)
+
+        assert not postgres.pause.called
+        command = client.containers.run.call_args[0][1][2]
+        assert 'pg_dump -h postgres -U juicebox -Fd -j 8 -f /snapshots/nightly/juicebox juicebox' in command
+        assert '-f /snapshots/nightly/juicebox_custom juicebox_custom' in command
+        assert client.containers.run.call_args[1]['network'] == 'devlandia_juice_net'
+
+    def test_errors(self, stash):
+        client, postgres = _client()
+        snapshots = Snapshots(client, 'devlandia', stash=stash)
+        snapshots.snapshot('nightly')
+
+        with pytest.raises(RuntimeError, match='already exists'):
+            snapshots.snapshot('nightly')
+        with pytest.raises(RuntimeError, match='Invalid snapshot name'):
+            snapshots.snapshot('../etc')
+
+        client.containers.run.side_effect = docker.errors.ContainerError(
+            postgres, 1, 'sh', 'sha256:postgres', b'cp: write error: No space left on device\n')
+        with pytest.raises(RuntimeError, match='No space left on device'):
+            snapshots.snapshot('nightly', force=True)
+        # Postgres is never left paused
+        assert postgres.unpause.call_count == 2
+
+        with pytest.raises(RuntimeError, match='Postgres is not running'):
+            Snapshots(_client(postgres=False)[0], 'devlandia', stash=stash).snapshot('other')
+
+    def test_ephemeral(self, stash):
+        client, postgres = _client()
+        stash.put(ephemeral.STASH_KEY, {'active': True})
+        snapshots = Snapshots(client, 'devlandia', stash=stash)
+
+        with pytest.raises(RuntimeError, match='--method dump'):
+            snapshots.snapshot('nightly')
+        assert not postgres.pause.called
+
+        snapshots.snapshot('nightly', method='dump')
+        assert 'nightly' in snapshots._all()
+
+
+class TestRestore:
+    def test_volume(self, stash):
+        client, postgres = _client()
+        snapshots = Snapshots(client, 'devlandia', stash=stash)
+        stash.put(MANIFEST_KEY, {'selfserve': {'cookies': {'hash': 'git:abc'}}})
+        snapshots.snapshot('clean')
+        stash.put(MANIFEST_KEY, {'selfserve': {'cookies': {'hash': 'git:def'}}})
+        client.containers.run.reset_mock()
+
+        snapshot = snapshots.restore('clean')
+
+        assert snapshot.size == 2048 * 1024
+        assert [c for c in postgres.mock_calls if c[0] in ('stop', 'start')] == [
+            call.stop(timeout=30), call.start()]
+        assert client.containers.run.call_args[1]['volumes']['pgdata'] == {
+            'bind': '/data', 'mode': 'rw'}
+        # The manifest matches the restored databases again
+        assert stash.get(MANIFEST_KEY) == {'selfserve': {'cookies': {'hash': 'git:abc'}}}
+
+    def test_dump(self, stash):
+        client, postgres = _client()
+        snapshots = Snapshots(client, 'devlandia', stash=stash)
+        snapshots.snapshot('nightly', method='dump')
+        client.containers.run.reset_mock()
+
+        snapshots.restore('nightly', jobs=2)
+
+        assert not postgres.stop.called
+        commands = sorted(c[0][1][2] for c in client.containers.run.call_args_list)
+        assert len(commands) == 2
+        assert commands[0].startswith('dropdb -h postgres -U juicebox --if-exists --force juicebox')
+        assert commands[0].endswith('pg_restore -h postgres -U juicebox -j 2 -d juicebox '
+                                    '/snapshots/nightly/juicebox')
+
+    def test_ephemeral(self, stash):
+        client, postgres = _client()
+        snapshots = Snapshots(client, 'devlandia', stash=stash)
+        snapshots.snapshot('clean')
+        stash.put(ephemeral.STASH_KEY, {'active': True})
+
+        with pytest.raises(RuntimeError, match='--method dump'):
+            snapshots.restore('clean')
+        assert not postgres.stop.called
+
+    def test_missing(self, stash):
+        with pytest.raises(RuntimeError, match='There is no snapshot named nope'):
+            Snapshots(_client()[0], 'devlandia', stash=stash).restore('nope')
+
+
+def test_list_and_remove(stash):
+    client, _ = _client()
+    snapshots = Snapshots(client, 'devlandia', stash=stash)
+    snapshots.snapshot('one')
+    snapshots.snapshot('two', method='dump')
+
+    assert [(s.name, s.method) for s in snapshots.list()] == [('one', 'volume'), ('two', 'dump')]
+    snapshots.remove('one')
+    assert [s.name for s in snapshots.list()] == ['two']
+    assert client.containers.run.call_args[0][1][2] == 'rm -rf /snapshots/one'
@@ -4,82 +4,109 @@ import time
 from collections import namedtuple
 from datetime import datetime, timedelta
 
+import docker.errors
 from mock import call, patch, ANY
 
 from ..cli.jb import DEVLANDIA_DIR
 from ..utils import dockerutil
 
 
+@patch('jbcli.utils.composebackend.conf.COMPOSE_BACKEND', new='v1')
 class TestDocker:
+    @patch('jbcli.utils.dockerutil.compose.merged_config_file', return_value='merged.yml')
     @patch('jbcli.utils.dockerutil.check_call')
     @patch('jbcli.cli.jb.determine_arch')
-    def test_up_x86(self, arch_mock, check_mock):
+    def test_up_x86(self, arch_mock, check_mock, merged_mock):
         arch_mock.return_value = 'x86_64'
         dockerutil.up(arch='x86_64')
+        merged_mock.assert_called_once_with([
+            'common-services.yml',
+            'docker-compose.selfserve.yml',
+        ], overlays=None)
         assert check_mock.mock_calls == [
             call(['docker-compose',
-                  '--project-directory', '.', '--project-name', "devlandia",
-                  '-f', 'common-services.yml', '-f', 'docker-compose.selfserve.yml','up'], env=None)
+                  '--project-directory', '.', '--project-name', "devlandia", '-f', 'merged.yml', 'up'], env=None)
         ]
 
+    @patch('jbcli.utils.dockerutil.compose.merged_config_file', return_value='merged.yml')
     @patch('jbcli.utils.dockerutil.check_call')
     @patch('jbcli.cli.jb.determine_arch')
-    def test_up_arm(self, arch_mock, check_mock):
+    def test_up_arm(self, arch_mock, check_mock, merged_mock):
         arch_mock.return_value = 'arm'
         dockerutil.up(arch="arm", custom=False)
+        merged_mock.assert_called_once_with([
+            'common-services.arm.yml',
+            'docker-compose.arm.yml',
+        ], overlays=None)
         assert check_mock.mock_calls == [
             call(['docker-compose',
-                  '--project-directory', '.', '--project-name', "devlandia",
-                  '-f', 'common-services.arm.yml', '-f', 'docker-compose.arm.yml', 'up'], env=None)
+                  '--project-directory', '.', '--project-name', "devlandia", '-f', 'merged.yml', 'up'], env=None)
         ]
 
+    @patch('jbcli.utils.dockerutil.compose.merged_config_file', return_value='merged.yml')
     @patch('jbcli.utils.dockerutil.check_call')
     @patch('jbcli.cli.jb.determine_arch')
-    def test_destroy_x86(self, arch_mock, check_mock):
+    def test_destroy_x86(self, arch_mock, check_mock, merged_mock):
         arch_mock.return_value = 'x86_64'
         dockerutil.destroy(arch=arch_mock.return_value)
+        merged_mock.assert_called_once_with([
+            'common-services.yml',
+            'docker-compose.selfserve.yml',
+        ], overlays=None)
         assert check_mock.mock_calls == [
             call(['docker-compose',
-                  '--project-directory', '.', '--project-name', 'devlandia',
-                  '-f', 'common-services.yml', '-f', 'docker-compose.selfserve.yml', 'down'], env=None)
+                  '--project-directory', '.', '--project-name', 'devlandia', '-f', 'merged.yml', 'down'], env=None)
         ]
 
+    @patch('jbcli.utils.dockerutil.compose.merged_config_file', return_value='merged.yml')
     @patch('jbcli.utils.dockerutil.check_call')
     @patch('jbcli.cli.jb.determine_arch')
-    def test_destroy_arm(self, arch_mock, check_mock):
+    def test_destroy_arm(self, arch_mock, check_mock, merged_mock):
         arch_mock.return_value = 'arm'
         dockerutil.destroy(arch='arm', custom=False)
+        merged_mock.assert_called_once_with([
+            'common-services.arm.yml',
+            'docker-compose.arm.yml',
+        ], overlays=None)
         assert check_mock.mock_calls == [
             call(['docker-compose',
-                  '--project-directory', '.', '--project-name', 'devlandia',
-                  '-f', 'common-services.arm.yml', '-f', 'docker-compose.arm.yml', 'down'], env=None)
+                  '--project-directory', '.', '--project-name', 'devlandia', '-f', 'merged.yml', 'down'], env=None)
         ]
 
+    @patch('jbcli.utils.dockerutil.compose.merged_config_file', return_value='merged.yml')
     @patch('jbcli.utils.dockerutil.check_call')
     @patch('jbcli.cli.jb.determine_arch')
-    def test_halt_x86(self, arch_mock, check_mock):
+    def test_halt_x86(self, arch_mock, check_mock, merged_mock):
         arch_mock.return_value = 'x86_64'
         dockerutil.halt(arch=arch_mock.return_value)
+        merged_mock.assert_called_once_with([
+            'common-services.yml',
+            'docker-compose.selfserve.yml',
+        ], overlays=None)
         assert check_mock.mock_calls == [
             call(['docker-compose',
-                  '--project-directory', '.', '--project-name', 'devlandia',
-                  '-f', 'common-services.yml', '-f', 'docker-compose.selfserve.yml', 'stop'], env=None)
+                  '--project-directory', '.', '--project-name', 'devlandia', '-f', 'merged.yml', 'stop'], env=None)
         ]
 
+    @patch('jbcli.utils.dockerutil.compose.merged_config_file', return_value='merged.yml')
     @patch('jbcli.utils.dockerutil.check_call')
     @patch('jbcli.cli.jb.determine_arch')
-    def test_halt_arm(self, arch_mock, check_mock):
+    def test_halt_arm(self, arch_mock, check_mock, merged_mock):
         arch_mock.return_value = 'arm'
         dockerutil.halt(arch='arm')
+        merged_mock.assert_called_once_with([
+            'common-services.arm.yml',
+            'docker-compose.arm.yml',
+        ], overlays=None)
         assert check_mock.mock_calls == [
             call(['docker-compose',
-                  '--project-directory', '.', '--project-name', 'devlandia',
-                  '-f', 'common-services.arm.yml', '-f', 'docker-compose.arm.yml', 'stop'], env=None)
+                  '--project-directory', '.', '--project-name', 'devlandia', '-f', 'merged.yml', 'stop'], env=None)
         ]
 
+    @patch('jbcli.utils.dockerutil.compose.merged_config_file', return_value='merged.yml')
     @patch('jbcli.utils.dockerutil.check_call')
     @patch('jbcli.utils.dockerutil.glob')
-    def test_multiple_docker_compose_files_x86(self, glob_mock, check_mock):
+    def test_multiple_docker_compose_files_x86(self, glob_mock, check_mock, merged_mock):
         """When additional `docker-compose-*.yml` files are available, they
         are passed to `docker-compose`.
         """
@@ -87,87 +114,199 @@ class TestDocker:
             'docker-compose-coolio.yml', 'docker-compose-2pac.yml']
 
         dockerutil.up(arch='x86_64', env=ANY, ganesha=False, custom=False)
+        merged_mock.assert_called_once_with([
+            'common-services.yml',
+            'docker-compose.selfserve.yml',
+            'docker-compose-coolio.yml',
+            'docker-compose-2pac.yml',
+        ], overlays=None)
         assert check_mock.mock_calls == [
             call([
                 'docker-compose',
                 '--project-directory', '.',
                 '--project-name', 'devlandia',
-                '-f', 'common-services.yml',
-                '-f', 'docker-compose.selfserve.yml',
-                '-f', 'docker-compose-coolio.yml',
-                '-f', 'docker-compose-2pac.yml',
+                '-f', 'merged.yml',
                 'up',
             ], env=None)
         ]
 
+    @patch('jbcli.utils.dockerutil.compose.merged_config_file', return_value='merged.yml')
     @patch('jbcli.utils.dockerutil.check_call')
     @patch('jbcli.utils.dockerutil.glob')
-    def test_docker_compose_with_ganesha_selfserve(self, glob_mock, check_mock):
+    def test_docker_compose_with_ganesha_selfserve(self, glob_mock, check_mock, merged_mock):
         """When additional `docker-compose-*.yml` files are available, they
         are passed to `docker-compose`.
         """
         glob_mock.return_value = [
             'docker-compose-coolio.yml', 'docker-compose-2pac.yml']
         dockerutil.up(arch='x86_64', ganesha=True, custom=False, env=None)
+        merged_mock.assert_called_once_with([
+            'common-services.yml',
+            'docker-compose.selfserve.yml',
+            'docker-compose-coolio.yml',
+            'docker-compose-2pac.yml',
+            'docker-compose.ganesha.yml',
+        ], overlays=None)
         assert check_mock.mock_calls == [
             call([
                 'docker-compose',
                 '--project-directory', '.',
                 '--project-name', 'devlandia',
-                '-f', 'common-services.yml',
-                '-f', 'docker-compose.selfserve.yml',
-                '-f', 'docker-compose-coolio.yml',
-                '-f', 'docker-compose-2pac.yml',
-                '-f', 'docker-compose.ganesha.yml',
+                '-f', 'merged.yml',
                 'up',
             ], env=None)
         ]
 
+    @patch('jbcli.utils.dockerutil.compose.merged_config_file', return_value='merged.yml')
     @patch('jbcli.utils.dockerutil.check_call')
     @patch('jbcli.utils.dockerutil.glob')
-    def test_docker_compose_with_ganesha_custom(self, glob_mock, check_mock):
+    def test_docker_compose_with_ganesha_custom(self, glob_mock, check_mock, merged_mock):
         """When additional `docker-compose-*.yml` files are available, they
         are passed to `docker-compose`.
         """
         glob_mock.return_value = [
             'docker-compose-coolio.yml', 'docker-compose-2pac.yml']
         dockerutil.up(arch='x86_64', env=None, custom=True, ganesha=True)
+        merged_mock.assert_called_once_with([
+            'common-services.yml',
+            'docker-compose.custom.yml',
+            'docker-compose-coolio.yml',
+            'docker-compose-2pac.yml',
+            'docker-compose.ganesha.yml',
+        ], overlays=None)
         assert check_mock.mock_calls == [
             call([
                 'docker-compose',
                 '--project-directory', '.',
                 '--project-name', 'devlandia',
-                '-f', 'common-services.yml',
-                '-f', 'docker-compose.custom.yml',
-                '-f', 'docker-compose-coolio.yml',
-                '-f', 'docker-compose-2pac.yml',
-                '-f', 'docker-compose.ganesha.yml',
+                '-f', 'merged.yml',
                 'up',
             ], env=None),
         ]
 
+    @patch('jbcli.utils.dockerutil.compose.merged_config_file', return_value='merged.yml')
     @patch('jbcli.utils.dockerutil.check_call')
     @patch('jbcli.utils.dockerutil.glob')
-    def test_multiple_docker_compose_files_arm(self, glob_mock, check_mock):
+    def test_multiple_docker_compose_files_arm(self, glob_mock, check_mock, merged_mock):
         """When additional `docker-compose-*.yml` files are available, they
         are passed to `docker-compose`.
         """
         glob_mock.return_value = [
             'docker-compose-coolio.yml', 'docker-compose-2pac.yml']
         dockerutil.up(arch='arm', custom=False, ganesha=False, env=None)
+        merged_mock.assert_called_once_with([
+            'common-services.arm.yml',
+            'docker-compose.arm.yml',
+            'docker-compose-coolio.yml',
+            'docker-compose-2pac.yml',
+        ], overlays=None)
         assert check_mock.mock_calls == [
             call([
                 'docker-compose',
                 '--project-directory', '.',
                 '--project-name', 'devlandia',
-                '-f', 'common-services.arm.yml',
-                '-f', 'docker-compose.arm.yml',
-                '-f', 'docker-compose-coolio.yml',
-                '-f', 'docker-compose-2pac.yml',
+                '-f', 'merged.yml',
                 'up',
             ], env=None),
         ]
 
+    @patch('jbcli.utils.dockerutil.compose.merged_config_file', return_value='merged.yml')
+    @patch('jbcli.utils.dockerutil.check_call')
+    @patch('jbcli.utils.dockerutil.glob')
+    def test_docker_compose_overlays(self, glob_mock, check_mock, merged_mock):
+        """Overlays are merged in, the SSH file of older versions is skipped."""
+        glob_mock.return_value = ['docker-compose-ssh.yml', 'docker-compose-coolio.yml']
+        overlay = {'services': {'juicebox_selfserve': {'environment': ['JB_REDSHIFT_CONNECTION']}}}
+        dockerutil.up(arch='x86_64', overlays=[overlay])
+        merged_mock.assert_called_once_with([
+            'common-services.yml',
+            'docker-compose.selfserve.yml',
+            'docker-compose-coolio.yml',
+        ], overlays=[overlay])
+
+    @patch('jbcli.utils.dockerutil.docker_context', return_value='default')
+    @patch('jbcli.utils.dockerutil.stash')
+    @patch('jbcli.utils.dockerutil.client')
+    def test_get_host_ip_gateway(self, client_mock, stash_mock, context_mock):
+        stash_mock.get.return_value = {}
+        client_mock.info.return_value = {'OperatingSystem': 'Ubuntu 22.04', 'SecurityOptions': []}
+        client_mock.networks.get.return_value.attrs = {
+            'IPAM': {'Config': [{'Subnet': 'fd00::/64', 'Gateway': 'fd00::1'},
+                                {'Subnet': '172.18.0.0/16', 'Gateway': '172.18.0.1'}]}
+        }
+
+        assert dockerutil.get_host_ip(project='Devlandia') == '172.18.0.1'
+
+        assert client_mock.networks.get.mock_calls == [call('devlandia_juice_net')]
+        assert client_mock.containers.run.mock_calls == []
+        assert stash_mock.put.mock_calls == [
+            call('host_ip', {'default': {'ip': '172.18.0.1', 'checked_at': ANY}})
+        ]
+
+    @patch('jbcli.utils.dockerutil.docker_context', return_value='default')
+    @patch('jbcli.utils.dockerutil.stash')
+    @patch('jbcli.utils.dockerutil.client')
+    def test_get_host_ip_before_up(self, client_mock, stash_mock, context_mock):
+        """Without the project's network yet, the bridge gateway is used."""
+        stash_mock.get.return_value = {}
+        client_mock.info.return_value = {'OperatingSystem': 'Ubuntu 22.04', 'SecurityOptions': []}
+        bridge = client_mock.networks.get.return_value
+        bridge.attrs = {'IPAM': {'Config': [{'Subnet': '172.17.0.0/16', 'Gateway': '172.17.0.1'}]}}
+        client_mock.networks.get.side_effect = [docker.errors.NotFound('juice_net'), bridge]
+
+        assert dockerutil.get_host_ip(project='devlandia') == '172.17.0.1'
+
+        assert client_mock.networks.get.mock_calls == [call('devlandia_juice_net'), call('bridge')]
+        assert client_mock.containers.run.mock_calls == []
+
+    @patch('jbcli.utils.dockerutil.docker_context', return_value='desktop-linux')
+    @patch('jbcli.utils.dockerutil.stash')
+    @patch('jbcli.utils.dockerutil.client')
+    def test_get_host_ip_docker_desktop(self, client_mock, stash_mock, context_mock):
+        stash_mock.get.return_value = {}
+        client_mock.info.return_value = {'OperatingSystem': 'Docker Desktop'}
+        client_mock.containers.run.return_value = (
+            b'127.0.0.1\tlocalhost\n192.168.65.254\thost.docker.internal\n')
+
+        assert dockerutil.get_host_ip(project='devlandia') == '192.168.65.254'
+
+        assert client_mock.networks.get.mock_calls == []
+        assert client_mock.containers.run.mock_calls == [
+            call('busybox:stable', 'cat /etc/hosts', remove=True,
+                 extra_hosts={'host.docker.internal': 'host-gateway'})
+        ]
+
+    @patch('jbcli.utils.dockerutil.docker_context', return_value='default')
+    @patch('jbcli.utils.dockerutil.stash')
+    @patch('jbcli.utils.dockerutil.client')
+    def test_get_host_ip_cached(self, client_mock, stash_mock, context_mock):
+        stash_mock.get.return_value = {
+            'default': {'ip': '172.17.0.1', 'checked_at': time.time()},
+            'other': {'ip': '10.0.0.1', 'checked_at': time.time()},
+        }
+        assert dockerutil.get_host_ip() == '172.17.0.1'
+        assert client_mock.mock_calls == []
+
+        # Stale entries are looked up again
+        stash_mock.get.return_value['default']['checked_at'] = 0
+        client_mock.info.return_value = {}
+        client_mock.networks.get.return_value.attrs = {
+            'IPAM': {'Config': [{'Gateway': '172.17.0.1'}]}}
+        assert dockerutil.get_host_ip() == '172.17.0.1'
+        assert client_mock.networks.get.mock_calls == [call('bridge')]
+
+    def test_docker_context(self, monkeypatch, tmpdir):
+        monkeypatch.delenv('DOCKER_HOST', raising=False)
+        monkeypatch.delenv('DOCKER_CONTEXT', raising=False)
+        monkeypatch.setenv('DOCKER_CONFIG', str(tmpdir))
+        assert dockerutil.docker_context() == 'default'
+        tmpdir.join('config.json').write(json.dumps({'currentContext': 'colima'}))
+        assert dockerutil.docker_context() == 'colima'
+        monkeypatch.setenv('DOCKER_CONTEXT', 'desktop-linux')
+        assert dockerutil.docker_context() == 'desktop-linux'
+        monkeypatch.setenv('DOCKER_HOST', 'tcp://10.0.0.2:2376')
+        assert dockerutil.docker_context() == 'tcp://10.0.0.2:2376'
+
     @patch('jbcli.utils.dockerutil.client')
     def test_get_state_running(self, dockerutil_mock):
         Container = namedtuple('Container', ['status'])
@@ -294,6 +433,25 @@ class TestDocker:
         result = dockerutil_mock.is_running().return_value = [False, False]
         assert result == [False, False]
 
+    @patch('jbcli.utils.dockerutil.handle_event')
+    @patch('jbcli.utils.dockerutil.jswatch.JSWatcher')
+    @patch('jbcli.utils.dockerutil.ensure_home', return_value=True)
+    @patch('jbcli.utils.dockerutil.client')
+    def test_jb_watch_includejs(self, client_mock, home_mock, watcher_mock, handle_mock, monkeypatch):
+        monkeypatch.chdir(DEVLANDIA_DIR)
+        Container = namedtuple('Container', ['name'])
+        juicebox = Container(name='devlandia_juicebox_custom_1')
+        client_mock.containers.list.side_effect = [[juicebox], [juicebox]]
+
+        dockerutil.jb_watch(app='cookies', custom=True, includejs=True)
+
+        # One running check for both watchers, the JS watcher is a thread
+        assert client_mock.containers.list.mock_calls[1] == call(filters={'label': [
+            f'com.docker.compose.project={dockerutil.project_name()}',
+            'com.docker.compose.service=juicebox_custom']})
+        assert watcher_mock.mock_calls == [call(juicebox, custom=True), call().start()]
+        handle_mock.assert_called_once_with(False, True, 'cookies')
+
     @patch('jbcli.utils.dockerutil.check_call')
     @patch('jbcli.utils.dockerutil.check_output')
     @patch('platform.processor')
@@ -0,0 +1,90 @@
+import pytest
+import requests
+from mock import Mock, patch
+
+from ..utils import compose, ephemeral
+from ..utils.manifest import MANIFEST_KEY
+from ..utils.storageutil import Stash
+
+
+@pytest.fixture
+def stash(tmpdir):
+    return Stash(str(tmpdir.join('stash.toml')))
+
+
+def test_overlay():
+    merged = compose.merge([{'services': {
+        'postgres': {'environment': ['POSTGRES_PASSWORD=juicebox'], 'build': {'context': '.'}},
+        'redis': {'image': 'redis:5.0.6'},
+    }}, ephemeral.overlay()])
+
+    postgres = merged['services']['postgres']
+    assert postgres['environment'] == {'POSTGRES_PASSWORD': 'juicebox',
+                                       'PGDATA': '/var/lib/postgresql/ephemeral/data'}
+    assert postgres['tmpfs'] == ['/var/lib/postgresql/ephemeral']
+    assert 'fsync=off' in postgres['command']
+    assert merged['services']['redis']['command'] == [
+        'redis-server', '--save', '', '--appendonly', 'no']
+
+
+def test_switch(stash):
+    durable = {'selfserve': {'_image': {'tag': 'develop-py3'}, 'cookies': {'hash': 'git:abc'}}}
+    stash.put(MANIFEST_KEY, durable)
+
+    ephemeral.switch(True, stash=stash)
+    assert ephemeral.is_active(stash=stash)
+    assert stash.get(MANIFEST_KEY) == {'selfserve': {'_image': {'tag': 'develop-py3'}}}
+
+    # Apps loaded in one ephemeral session are gone in the next one
+    stash.put(MANIFEST_KEY, {'selfserve': {'cupcakes': {'hash': 'git:def'}}})
+    ephemeral.switch(True, stash=stash)
+    assert stash.get(MANIFEST_KEY) == {'selfserve': {}}
+
+    ephemeral.switch(False, stash=stash)
+    assert not ephemeral.is_active(stash=stash)
+    assert stash.get(MANIFEST_KEY) == durable
+
+
+def test_speedups(stash):
+    assert ephemeral.load_speedup(stash=stash) is None
+    ephemeral.record_load('cookies', 6.0, stash=stash)
+    ephemeral.record_load('cupcakes', 2.0, stash=stash)
+    ephemeral.switch(True, stash=stash)
+    ephemeral.record_load('cookies', 2.0, stash=stash)
+    assert ephemeral.load_speedup(stash=stash) == (6.0, 2.0)
+
+    for seconds in [90, 100, 200]:
+        ephemeral.record_startup(seconds, False, stash=stash)
+    ephemeral.record_startup(40, True, stash=stash)
+    assert ephemeral.startup_speedup(stash=stash) == (100, 40)
+    assert ephemeral.describe('Apps loaded', (6.0, 2.0)) == (
+        'Apps loaded 3.0x faster in ephemeral mode (2.0s instead of 6.0s).')
+    assert ephemeral.describe('Apps loaded', None) is None
+
+
+@patch('jbcli.utils.ephemeral.time.sleep')
+@patch('jbcli.utils.ephemeral.requests.get')
+def test_time_startup(get_mock, sleep_mock, stash):
+    get_mock.side_effect = [requests.ConnectionError(), requests.ConnectionError(),
+                            requests.ConnectionError(), Mock()]
+    on_ready = Mock()
+
+    ephemeral.time_startup('http://localhost:8000/', True, on_ready=on_ready,
+                           stash=stash).join(5)
+
+    assert get_mock.call_count == 4
+    assert on_ready.call_count == 1
+    assert len(stash.get(ephemeral.STASH_KEY)['startup']['ephemeral']) == 1
+
+
+@patch('jbcli.utils.ephemeral.requests.get')
+def test_time_startup_already_running(get_mock, stash):
+    on_ready = Mock()
+
+    # The previous Juicebox still answers, a start can't be timed
+    assert ephemeral.time_startup('http://localhost:8000/', True, on_ready=on_ready,
+                                  stash=stash) is None
+
+    assert get_mock.call_count == 1
+    assert not on_ready.called
+    assert ephemeral.startup_speedup(stash=stash) is None
@@ -0,0 +1,83 @@
+import os
+import subprocess
+
+import pytest
+from mock import patch
+
+from ..utils import gitcache
+
+
+def _git(path, *args):
+    return subprocess.check_output(
+        ['git', '-C', str(path), '-c', 'user.email=jb@example.com',
+         '-c', 'user.name=jb'] + list(args),
+        stderr=subprocess.DEVNULL).decode().strip()
+
+
+@pytest.fixture
+def origin(tmpdir):
+    """A repository standing in for the app on Github."""
+    repo = tmpdir.mkdir('origin')
+    _git(repo, 'init', '--quiet', '-b', 'main')
+    repo.join('app.yaml').write('slug: cookies\n')
+    _git(repo, 'add', '.')
+    _git(repo, 'commit', '--quiet', '-m', 'Initial commit')
+    _git(repo, 'update-ref', 'refs/pull/1/head', 'HEAD')
+    return repo
+
+
+@patch('jbcli.utils.gitcache.conf')
+class TestMirrors:
+    def test_create_and_update(self, conf_mock, origin, tmpdir):
+        conf_mock.GIT_CACHE_DIR = str(tmpdir.join('cache'))
+
+        mirror = gitcache.update_mirror('cookies', str(origin))
+        assert mirror == gitcache.mirror_path('cookies')
+        assert _git(mirror, 'symbolic-ref', 'HEAD') == 'refs/heads/main'
+        # Only branches and tags are mirrored
+        assert _git(mirror, 'for-each-ref', '--format=%(refname)') == 'refs/heads/main'
+
+        origin.join('app.yaml').write('slug: cookies\nlabel: Cookies\n')
+        _git(origin, 'commit', '--quiet', '-am', 'Add label')
+        assert gitcache.update_mirror('cookies', str(origin)) == mirror
+        assert _git(mirror, 'rev-parse', 'main') == _git(origin, 'rev-parse', 'main')
+
+        checkout = str(tmpdir.join('cookies'))
+        _git(tmpdir, 'clone', '--quiet', mirror, checkout)
+        assert 'label: Cookies' in open(os.path.join(checkout, 'app.yaml')).read()
+
+    @patch('jbcli.utils.gitcache.echo_warning')
+    def test_unreachable(self, echo_mock, conf_mock, tmpdir):
+        conf_mock.GIT_CACHE_DIR = str(tmpdir.join('cache'))
+
+        assert gitcache.update_mirror('cookies', str(tmpdir.join('missing'))) is None
+        assert not os.path.exists(gitcache.mirror_path('cookies'))
+        echo_mock.assert_called_once_with(
+            'Could not update the local mirror of cookies, cloning from Github.')
+
+    def test_prune_least_recently_used(self, conf_mock, tmpdir):
+        conf_mock.GIT_CACHE_DIR = str(tmpdir)
+        mirrors = tmpdir.mkdir('mirrors')
+        for age, app in enumerate(['new', 'old', 'oldest']):
+            mirror = mirrors.mkdir(f'{app}.git')
+            mirror.join('pack').write('x' * 1000)
+            marker = mirror.join(gitcache.LAST_USED_FILE)
+            marker.write('')
+            os.utime(str(marker), (1000 - age, 1000 - age))
+
+        assert [m[0] for m in gitcache.list_mirrors()] == ['new', 'old', 'oldest']
+        assert [m[0] for m in gitcache.prune(2000, dry_run=True)] == ['oldest']
+        assert mirrors.join('oldest.git').check()
+
+        assert [m[0] for m in gitcache.prune(1500)] == ['oldest', 'old']
+        assert [m[0] for m in gitcache.list_mirrors()] == ['new']
+        assert gitcache.prune(1500) == []
+
+
+def test_parse_size():
+    assert gitcache.parse_size('500') == 500
+    assert gitcache.parse_size('2k') == 2048
+    assert gitcache.parse_size('1.5G') == int(1.5 * 1024 ** 3)
+    assert gitcache.parse_size('10MB') == 10 * 1024 ** 2
+    with pytest.raises(ValueError):
+        gitcache.parse_size('lots')
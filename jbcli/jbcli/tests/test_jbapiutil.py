@@ -2,6 +2,7 @@ import requests_mock
 from mock import patch
 
 from ..utils import jbapiutil
+from ..utils.reloadstats import Stopwatch
 
 
 class TestAPIUtil:
@@ -100,3 +101,72 @@ class TestAPIUtil:
 
             val = jbapiutil.load_app("meow", custom=True)
             assert val is False
+
+    @patch("jbcli.utils.jbapiutil.get_admin_token")
+    def test_load_app_stopwatch(self, mock_admin_token):
+        """Test that timings and object counts are collected. """
+        mock_admin_token.return_value = "foo"
+        stopwatch = Stopwatch()
+        logs = [
+            {"level": "debug", "event": "Slice was unchanged",
+             "instance": "free-form for Basketball (Slice)"},
+            {"level": "debug", "event": "Created Slice",
+             "instance": "table for Basketball (Slice)"},
+            {"level": "debug", "event": "Stack was unchanged",
+             "instance": "Basketball (Stack)"},
+            {"level": "info", "event": "Done"},
+        ]
+
+        with requests_mock.Mocker() as m:
+            url = "http://localhost:8001/api/v1/app/load/{APP}/".format(APP="meow")
+            m.post(url, status_code=200, json={"details": {"logs": logs}})
+
+            val = jbapiutil.load_app("meow", custom=True, stopwatch=stopwatch)
+            assert val is True
+
+        assert stopwatch.get("slices") == 2
+        assert stopwatch.get("stacks") == 1
+        assert "token" in stopwatch.timings
+        assert "load" in stopwatch.timings
+
+    def test_parse_result(self):
+        """Test that load logs are aggregated per object type. """
+        logs = [
+            {"level": "debug", "event": "Slice was unchanged",
+             "instance": "free-form for Basketball (Slice)"},
+            {"level": "debug", "event": "Created Slice",
+             "instance": "table for Basketball (Slice)", "duration_ms": 1500},
+            {"level": "debug", "event": "Slice was changed",
+             "instance": "chart for Basketball (Slice)", "duration": 0.5},
+            {"level": "warning", "event": "Found existing Theme",
+             "instance": "Theme for jbodemo_birdo (Theme)"},
+            {"level": "info", "event": "Done"},
+        ]
+        report = jbapiutil.parse_result({"details": {"logs": logs}})
+
+        assert report["objects"] == {
+            "Slice": {"created": 1, "changed": 1, "unchanged": 1, "other": 0},
+            "Theme": {"created": 0, "changed": 0, "unchanged": 0, "other": 1},
+            "Other": {"created": 0, "changed": 0, "unchanged": 0, "other": 1},
+        }
+        assert [t["duration"] for t in report["timings"]] == [1.5, 0.5]
+        assert report["timings"][0]["instance"] == "table for Basketball (Slice)"
+        assert [p["event"] for p in report["problems"]] == ["Found existing Theme"]
+        assert report["total"] == 5
+
+    @patch("jbcli.utils.jbapiutil.get_admin_token")
+    def test_load_app_report(self, mock_admin_token):
+        """Test that the report is handed back to the caller. """
+        mock_admin_token.return_value = "foo"
+        report = {}
+
+        with requests_mock.Mocker() as m:
+            url = "http://localhost:8001/api/v1/app/load/{APP}/".format(APP="meow")
+            m.post(url, status_code=400, json={"details": {"logs": []}})
+
+            val = jbapiutil.load_app("meow", custom=True, output="none", report=report)
+            assert val is False
+
+        assert report["app"] == "meow"
+        assert report["status"] == 400
+        assert report["objects"] == {}
@@ -0,0 +1,46 @@
+from mock import Mock, call, patch
+
+from ..utils import jswatch
+from ..utils.jswatch import JSWatcher, build_seconds, webpack_command
+
+
+def test_webpack_command():
+    assert webpack_command(4) == [
+        './node_modules/.bin/webpack', '--mode=development', '--watch', '--colors']
+    assert webpack_command(5)[3:] == [
+        '--color', '--cache-type', 'filesystem', '--cache-cache-directory', '/webpack-cache']
+
+
+def test_build_seconds():
+    assert build_seconds('Time: 2345ms') == 2.345
+    assert build_seconds('Time: \x1b[1m812\x1b[22mms') == 0.812
+    assert build_seconds('webpack 5.88.2 compiled successfully in 1520 ms') == 1.52
+    assert build_seconds('webpack 5.88.2 compiled with 2 warnings in 3.5 s') == 3.5
+    assert build_seconds('[built] ./src/index.js 1.2 KiB') is None
+
+
+@patch('jbcli.utils.jswatch.record_reload')
+def test_watcher(record_mock):
+    container = Mock()
+    container.exec_run.side_effect = [
+        (0, b'5.88.2\n'),
+        (None, iter([b'webpack 5.88.2 compiled successfully in 41',
+                     b'000 ms\nwebpack 5.88.2 compiled successfully in 900 ms\n'])),
+    ]
+    watcher = JSWatcher(container, custom=True)
+
+    watcher.run()
+
+    assert container.exec_run.mock_calls[1] == call(
+        webpack_command(5), stream=True, environment={'CACHE_DIR': jswatch.CACHE_DIR})
+    assert watcher.builds == [41.0, 0.9]
+    assert record_mock.mock_calls == [
+        call('webpack', {'total': 41.0, 'build': 1, 'custom': True}),
+        call('webpack', {'total': 0.9, 'build': 2, 'custom': True}),
+    ]
+
+
+def test_watcher_webpack4():
+    container = Mock()
+    container.exec_run.return_value = (127, b'sh: webpack: not found')
+    assert JSWatcher(container).webpack_version() == 4
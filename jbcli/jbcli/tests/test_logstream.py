@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+
+import pytest
+from mock import Mock
+
+from ..utils import logstream
+from ..utils.logstream import LogFilter, LogStream, level_of, parse_since
+
+NOW = datetime(2024, 5, 2, 10, 0, tzinfo=timezone.utc)
+
+
+class FakeContainer(object):
+    def __init__(self, service, *chunks):
+        self.name = f'devlandia_{service}_1'
+        self.labels = {'com.docker.compose.service': service}
+        self.chunks = chunks
+        self.logs_kwargs = None
+
+    def logs(self, **kwargs):
+        self.logs_kwargs = kwargs
+        return iter(chunks.encode() for chunks in self.chunks)
+
+
+def fake_client(*containers):
+    return Mock(**{'containers.list.return_value': list(containers)})
+
+
+def test_parse_since():
+    assert parse_since('10m', now=NOW) == datetime(2024, 5, 2, 9, 50, tzinfo=timezone.utc)
+    assert parse_since('2d', now=NOW) == datetime(2024, 4, 30, 10, 0, tzinfo=timezone.utc)
+    assert parse_since('2024-05-02T08:00:00Z') == datetime(2024, 5, 2, 8, 0, tzinfo=timezone.utc)
+    with pytest.raises(ValueError, match='Invalid time: soon'):
+        parse_since('soon')
+
+
+def test_level_filter():
+    keep = LogFilter(level='warning')
+    lines = [
+        'INFO Started',
+        'ERROR Internal Server Error: /api/v1/',
+        'Traceback (most recent call last):',
+        'WARN slow query',
+        'DEBUG nothing',
+        '  continued',
+    ]
+    assert [line for line in lines if keep(line)] == lines[1:4]
+    assert level_of('[CRITICAL] boom') == 4
+    assert level_of('no level') is None
+
+
+def test_pattern_filter():
+    keep = LogFilter(pattern=r'GET /api/v\d')
+    assert keep('"GET /api/v1/apps/" 200')
+    assert not keep('"POST /api/v1/apps/" 200')
+
+
+def test_merged_by_time(monkeypatch):
+    monkeypatch.setattr(logstream, 'MERGE_WINDOW', 0.02)
+    juicebox = FakeContainer(
+        'juicebox_selfserve',
+        '2024-05-02T10:00:01.000000000Z first\n2024-05-02T10:00:0',
+        '3.500000000Z third\n',
+    )
+    redis = FakeContainer('redis', '2024-05-02T10:00:02.123456789Z second\nunstamped')
+    stream = LogStream(fake_client(juicebox, redis), 'devlandia', since=NOW, follow=False)
+
+    lines = [line for batch in stream for line in batch]
+
+    assert [(line.service, line.text) for line in lines[:3]] == [
+        ('juicebox_selfserve', 'first'),
+        ('redis', 'second'),
+        ('juicebox_selfserve', 'third'),
+    ]
+    assert lines[1].time == datetime(2024, 5, 2, 10, 0, 2, 123456, tzinfo=timezone.utc)
+    assert lines[3].text == 'unstamped '
+    assert redis.logs_kwargs == {'stream': True, 'follow': False, 'timestamps': True,
+                                 'tail': 'all', 'since': int(NOW.timestamp())}
+
+
+def test_services():
+    client = fake_client(FakeContainer('juicebox_selfserve'), FakeContainer('redis'))
+    stream = LogStream(client, 'devlandia', services=['redis'])
+    assert list(stream.containers()) == ['redis']
+    assert client.containers.list.call_args[1]['filters'] == {
+        'label': 'com.docker.compose.project=devlandia'}
+    assert stream.tail == logstream.DEFAULT_TAIL
+
+    with pytest.raises(ValueError, match='No containers for nginx, the services are juicebox_selfserve, redis'):
+        LogStream(client, 'devlandia', services=['nginx']).containers()
@@ -0,0 +1,82 @@
+import subprocess
+
+from ..utils import manifest
+from ..utils.manifest import Manifest
+from ..utils.storageutil import Stash
+
+
+def _git(path, *args):
+    subprocess.check_call(
+        ['git', '-C', str(path), '-c', 'user.email=jb@example.com',
+         '-c', 'user.name=jb'] + list(args),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class TestTreeHash:
+    def test_files_hash_outside_git(self, tmpdir):
+        app = tmpdir.mkdir('cookies')
+        app.join('app.yaml').write('slug: cookies\n')
+        assert manifest.tree_hash(str(app)).startswith('files:')
+
+    def test_git_tree_hash(self, tmpdir):
+        app = tmpdir.mkdir('cookies')
+        app.join('app.yaml').write('slug: cookies\n')
+        app.join('.gitignore').write('tmp/\n')
+        _git(app, 'init')
+        _git(app, 'add', '.')
+        _git(app, 'commit', '-m', 'Initial commit')
+        committed = subprocess.check_output(
+            ['git', '-C', str(app), 'rev-parse', 'HEAD^{tree}']).decode().strip()
+
+        assert manifest.tree_hash(str(app)) == f'git:{committed}'
+
+        # Ignored files don't count, uncommitted changes do
+        app.mkdir('tmp').join('junk').write('junk')
+        assert manifest.tree_hash(str(app)) == f'git:{committed}'
+        app.join('app.yaml').write('slug: cookies\nlabel: Cookies\n')
+        changed = manifest.tree_hash(str(app))
+        assert changed.startswith('git:') and changed != f'git:{committed}'
+
+        # The real index is left alone
+        status = subprocess.check_output(
+            ['git', '-C', str(app), 'status', '--porcelain']).decode()
+        assert status.strip() == 'M app.yaml'
+
+    def test_nested_directory_is_not_a_checkout(self, tmpdir):
+        _git(tmpdir, 'init')
+        app = tmpdir.mkdir('cookies')
+        app.join('app.yaml').write('slug: cookies\n')
+        assert manifest.tree_hash(str(app)).startswith('files:')
+
+
+class TestManifest:
+    def test_record_and_forget(self, tmpdir):
+        stash = Stash(str(tmpdir.join('stash.toml')))
+        custom = Manifest('custom', stash=stash)
+        selfserve = Manifest('selfserve', stash=stash)
+
+        custom.record('cookies', 'git:abc', 2.5)
+        selfserve.record('cookies', 'git:def')
+
+        assert custom.is_current('cookies', 'git:abc')
+        assert not custom.is_current('cookies', 'git:def')
+        assert not custom.is_current('cake', 'git:abc')
+        assert custom.duration('cookies') == 2.5
+        assert custom.duration('cake', 0) == 0
+        assert 'loaded_at' in custom.get('cookies')
+
+        custom.forget('cookies')
+        assert custom.get('cookies') is None
+        assert selfserve.is_current('cookies', 'git:def')
+
+    def test_use_image(self, tmpdir):
+        stash = Stash(str(tmpdir.join('stash.toml')))
+        custom = Manifest('custom', stash=stash)
+
+        assert custom.use_image('develop-py3') is False
+        custom.record('cookies', 'git:abc')
+        assert custom.use_image('develop-py3') is False
+        assert custom.is_current('cookies', 'git:abc')
+
+        assert custom.use_image('master-py3') is True
+        assert custom.entries == {}
@@ -0,0 +1,132 @@
+import subprocess
+
+import docker.errors
+import pytest
+from mock import Mock
+
+from ..utils import pipcache
+from ..utils.pipcache import VenvCache, requirements_hash
+from ..utils.storageutil import Stash
+
+
+@pytest.fixture
+def stash(tmpdir):
+    return Stash(str(tmpdir.join('stash.toml')))
+
+
+@pytest.fixture
+def fruition(tmpdir):
+    code = tmpdir.mkdir('fruition')
+    code.join('requirements.txt').write('Django==3.2\n')
+    code.join('requirements_dev.txt').write('pytest\n')
+    return code
+
+
+def _volume(name):
+    volume = Mock()
+    volume.name = name
+    return volume
+
+
+def _client(existing=()):
+    client = Mock()
+    client.images.get.return_value.id = 'sha256:image'
+    volumes = {name: _volume(name) for name in existing}
+
+    def _get(name):
+        if name not in volumes:
+            raise docker.errors.NotFound(name)
+        return volumes[name]
+
+    def _create(name, labels):
+        volumes[name] = _volume(name)
+        return volumes[name]
+
+    client.volumes.get.side_effect = _get
+    client.volumes.create.side_effect = _create
+    client.volumes.list.side_effect = lambda filters: [
+        v for name, v in volumes.items() if name.startswith(pipcache.VENV_PREFIX)]
+    return client
+
+
+def test_requirements_hash(fruition):
+    key = requirements_hash(str(fruition), 'sha256:image')
+    assert key == requirements_hash(str(fruition), 'sha256:image')
+    assert key != requirements_hash(str(fruition), 'sha256:other')
+
+    fruition.join('requirements_dev.txt').write('pytest\nmock\n')
+    assert key != requirements_hash(str(fruition), 'sha256:image')
+
+
+class TestVenvCache:
+    def test_ensure(self, fruition, stash):
+        client = _client()
+        venvs = VenvCache(client, stash=stash)
+
+        name, created = venvs.ensure(str(fruition), 'juicebox-devlandia:develop-py3')
+
+        key = requirements_hash(str(fruition), 'sha256:image')
+        assert (name, created) == (f'jb-venv-{key}', True)
+        client.images.get.assert_called_once_with('juicebox-devlandia:develop-py3')
+        client.volumes.create.assert_any_call(name='jb-pip-wheels', labels={})
+        client.volumes.create.assert_any_call(name=name, labels={pipcache.VENV_LABEL: key})
+        assert name in stash.get(pipcache.VENVS_KEY)
+
+        # The same requirements use the same virtualenv again
+        assert venvs.ensure(str(fruition), 'juicebox-devlandia:develop-py3') == (name, False)
+        assert client.volumes.create.call_count == 2
+
+    def test_image_not_pulled(self, fruition, stash):
+        client = _client()
+        client.images.get.side_effect = docker.errors.ImageNotFound('nope')
+        name, _ = VenvCache(client, stash=stash).ensure(str(fruition), 'develop-py3')
+        assert name == f"jb-venv-{requirements_hash(str(fruition), 'develop-py3')}"
+
+    def test_overlay(self):
+        assert VenvCache.overlay('juicebox_custom', 'jb-venv-abc') == {
+            'services': {'juicebox_custom': {
+                'command': VenvCache.command('jb-venv-abc'),
+                'volumes': ['jb-pip-wheels:/pip-cache', 'jb-venv-abc:/venv'],
+                'environment': ['PIP_CACHE_DIR=/pip-cache'],
+            }},
+            'volumes': {
+                'jb-pip-wheels': {'external': True},
+                'jb-venv-abc': {'external': True},
+            },
+        }
+
+    def test_command(self, tmpdir):
+        """pip only runs until the volume is stamped."""
+        bin_dir = tmpdir.mkdir('venv').mkdir('bin')
+        for name in ('pip', 'python'):
+            script = bin_dir.join(name)
+            script.write(f'#!/bin/sh\necho {name} "$@" >> {tmpdir}/calls\n')
+            script.chmod(0o755)
+
+        def run():
+            script = VenvCache.command('jb-venv-abc', 'requirements-arm.txt')[2]
+            script = script.replace('/venv', str(tmpdir.join('venv')))
+            script = script.replace('${RECIPE}', 'unused')
+            subprocess.check_call(['bash', '-c', script], cwd=str(tmpdir),
+                                  stdout=subprocess.DEVNULL)
+            return tmpdir.join('calls').read().splitlines()
+
+        assert run() == [
+            'pip install -q -U -r requirements-arm.txt',
+            'pip install -q -U -r requirements_dev.txt',
+            'python docker/entrypoint.py',
+        ]
+        assert tmpdir.join('venv', '.jb-requirements').read() == 'jb-venv-abc\n'
+        tmpdir.join('calls').remove()
+        assert run() == ['python docker/entrypoint.py']
+
+    def test_prune(self, stash):
+        client = _client(['jb-venv-old', 'jb-venv-new', 'jb-venv-busy'])
+        stash.put(pipcache.VENVS_KEY, {'jb-venv-old': 1, 'jb-venv-new': 3, 'jb-venv-busy': 2})
+        client.volumes.get('jb-venv-busy').remove.side_effect = docker.errors.APIError('in use')
+        venvs = VenvCache(client, stash=stash)
+
+        assert [name for name, _ in venvs.list()] == ['jb-venv-new', 'jb-venv-busy', 'jb-venv-old']
+        assert venvs.prune(keep=1) == ['jb-venv-old']
+        client.volumes.get('jb-venv-old').remove.assert_called_once_with()
+        assert stash.get(pipcache.VENVS_KEY) == {'jb-venv-new': 3, 'jb-venv-busy': 2}
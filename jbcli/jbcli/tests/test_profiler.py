@@ -0,0 +1,102 @@
+import io
+import json
+import tarfile
+
+import pytest
+import requests
+from mock import Mock
+
+from ..utils.profiler import Frame, Profiler, hot_frames
+
+PROFILE = {
+    'shared': {'frames': [
+        {'name': 'handle', 'file': '/venv/lib/gunicorn/workers/sync.py', 'line': 135},
+        {'name': 'render', 'file': '/code/fruition/api/views.py', 'line': 88},
+        {'name': 'execute', 'file': '/venv/lib/django/db/backends/utils.py', 'line': 84},
+    ]},
+    'profiles': [
+        {'type': 'sampled', 'samples': [[0, 1, 2], [0, 1, 2], [0, 1], []], 'weights': [1, 1, 1, 1]},
+        {'type': 'sampled', 'samples': [[0, 1, 2, 1]], 'weights': [1]},
+    ],
+}
+
+
+def archive(data):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        info = tarfile.TarInfo('profile.speedscope.json')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class Container(object):
+    id = 'abc123'
+    name = 'devlandia_juicebox_selfserve_1'
+    image = Mock(id='sha256:0123')
+
+    def __init__(self, *lines):
+        self.lines = lines
+
+    def exec_run(self, command):
+        return 0, '\n'.join(self.lines).encode()
+
+
+def test_hot_frames():
+    assert hot_frames(PROFILE, top=2) == [
+        Frame('render', '/code/fruition/api/views.py:88', 0.4, 0.8),
+        Frame('execute', '/venv/lib/django/db/backends/utils.py:84', 0.4, 0.6),
+    ]
+    assert hot_frames({'shared': {'frames': []}, 'profiles': []}) == []
+
+
+def test_target():
+    gunicorn = Container(
+        '1\t1 (sh) S 0 1\tsh -c docker/entrypoint.py ',
+        '7\t7 (gunicorn) S 1 7\t/venv/bin/python /venv/bin/gunicorn fruition.wsgi ',
+        '8\t8 (gunicorn) S 7 7\tgunicorn: worker [fruition] ',
+    )
+    assert Profiler(Mock(), gunicorn).target() == (7, 'the gunicorn master and its 1 workers')
+
+    runserver = Container(
+        '5\t5 (python) S 1 5\t/venv/bin/python manage.py runserver ',
+        '9\t9 (python) S 5 5\t/venv/bin/python manage.py runserver ',
+    )
+    assert Profiler(Mock(), runserver).target() == (5, '/venv/bin/python manage.py runserver and its children')
+
+    with pytest.raises(RuntimeError, match='There are no Python processes'):
+        Profiler(Mock(), Container('1\t1 (sh) S 0 1\tsh ')).target()
+
+
+def test_record(tmp_path):
+    client = Mock()
+    sidecar = client.containers.run.return_value
+    sidecar.wait.return_value = {'StatusCode': 0}
+    sidecar.get_archive.return_value = (iter([archive(json.dumps(PROFILE).encode())]), {})
+    path = tmp_path / 'profile.json'
+
+    profile = Profiler(client, Container(), duration=5, rate=50).record(7, str(path))
+
+    assert profile == PROFILE
+    assert json.loads(path.read_text()) == PROFILE
+    args, kwargs = client.containers.run.call_args
+    assert args[0] == 'sha256:0123'
+    assert '--pid 7 --subprocesses --duration 5 --rate 50' in args[1][1]
+    assert kwargs['pid_mode'] == 'container:abc123'
+    assert kwargs['cap_add'] == ['SYS_PTRACE']
+    sidecar.remove.assert_called_once_with(force=True)
+
+
+def test_record_failed(tmp_path):
+    client = Mock()
+    sidecar = client.containers.run.return_value
+    sidecar.wait.return_value = {'StatusCode': 1}
+    sidecar.logs.return_value = b'Permission Denied: Try running again with elevated permissions\n'
+
+    with pytest.raises(RuntimeError, match='py-spy failed: Permission Denied'):
+        Profiler(client, Container()).record(7, str(tmp_path / 'profile.json'))
+
+    sidecar.wait.side_effect = requests.exceptions.ReadTimeout()
+    with pytest.raises(RuntimeError, match='py-spy did not finish within 210s'):
+        Profiler(client, Container()).record(7, str(tmp_path / 'profile.json'))
+    assert sidecar.remove.call_count == 2
@@ -0,0 +1,115 @@
+import io
+
+import pytest
+
+from ..utils import rediscache
+from ..utils.rediscache import Redis, RedisError
+
+
+class FakeSocket(object):
+    """Answers with canned RESP replies and records what was sent."""
+
+    def __init__(self, replies):
+        self.replies = io.BytesIO(b''.join(replies))
+        self.sent = b''
+
+    def makefile(self, mode):
+        return self.replies
+
+    def sendall(self, data):
+        self.sent += data
+
+    def close(self):
+        pass
+
+
+def _bulk(value):
+    return f'${len(value)}\r\n'.encode() + value + b'\r\n'
+
+
+def _array(*items):
+    return f'*{len(items)}\r\n'.encode() + b''.join(items)
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    def _connect(*replies):
+        sock = FakeSocket(replies)
+        monkeypatch.setattr(rediscache.socket, 'create_connection', lambda *args, **kwargs: sock)
+        return Redis(), sock
+
+    return _connect
+
+
+def test_protocol(fake):
+    redis, sock = fake(b'+OK\r\n', b':3\r\n', b'$-1\r\n', b'-ERR unknown command\r\n',
+                       _array(_bulk(b'a'), b':1\r\n'))
+
+    assert redis.execute('SELECT', 1) == 'OK'
+    assert sock.sent == b'*2\r\n$6\r\nSELECT\r\n$1\r\n1\r\n'
+    assert redis.pipeline([('DBSIZE',), ('GET', 'nope')]) == [3, None]
+    with pytest.raises(RedisError, match='unknown command'):
+        redis.execute('NOPE')
+    assert redis.execute('X') == [b'a', 1]
+
+
+def test_clear(fake):
+    keyspace = _bulk(b'# Keyspace\r\ndb0:keys=3,expires=0,avg_ttl=0\r\ndb1:keys=1,expires=0\r\n')
+    redis, sock = fake(
+        keyspace,
+        b'+OK\r\n',
+        _array(_bulk(b'7'), _array(_bulk(b':1:cookies:a'), _bulk(b':1:cookies:b'))),
+        b':2\r\n',
+        _array(_bulk(b'0'), _array()),
+        b'+OK\r\n',
+        _array(_bulk(b'0'), _array(_bulk(b':1:cookies:c'))),
+        b':1\r\n',
+    )
+
+    cleared = rediscache.clear(redis, '*cookies*', batch=2)
+
+    assert cleared.keys == 3
+    assert b'$4\r\nSCAN\r\n$1\r\n0\r\n$5\r\nMATCH\r\n$9\r\n*cookies*\r\n$5\r\nCOUNT\r\n$1\r\n2\r\n' in sock.sent
+    assert b'$6\r\nUNLINK\r\n$12\r\n:1:cookies:a\r\n$12\r\n:1:cookies:b\r\n' in sock.sent
+    # The scan continues from the cursor redis returned
+    assert b'$4\r\nSCAN\r\n$1\r\n7\r\n' in sock.sent
+
+
+def test_clear_app(fake):
+    redis, sock = fake(
+        _bulk(b'db0:keys=5,expires=0,avg_ttl=0\r\n'),
+        b'+OK\r\n',
+        _array(_bulk(b'0'), _array(_bulk(b':1:sales:a'), _bulk(b':1:salesforce:a'),
+                                   _bulk(b':1:presales:b'), _bulk(b'sales'), _bulk(b'x:sales_q'))),
+        b':2\r\n',
+    )
+
+    cleared = rediscache.clear(redis, rediscache.app_pattern('sales'),
+                               only=rediscache.app_key_re('sales'))
+
+    assert cleared.keys == 2
+    assert sock.sent.endswith(b'*3\r\n$6\r\nUNLINK\r\n$10\r\n:1:sales:a\r\n$5\r\nsales\r\n')
+    # The keys of salesforce and presales survive
+    assert b'salesforce' not in sock.sent
+    assert b'presales' not in sock.sent
+
+
+def test_stats(fake):
+    redis, _ = fake(
+        _bulk(b'db0:keys=3,expires=0,avg_ttl=0\r\n'),
+        b'+OK\r\n',
+        _array(_bulk(b'0'), _array(_bulk(b':1:cookies:a'), _bulk(b':1:cookies:b'), _bulk(b'session'))),
+        b':100\r\n', b':50\r\n', b'$-1\r\n',
+    )
+
+    assert rediscache.stats(redis) == [
+        rediscache.PrefixStats(0, ':1:cookies:*', 2, 150),
+        rediscache.PrefixStats(0, 'session', 1, 0),
+    ]
+
+
+def test_patterns():
+    assert rediscache.app_pattern('cookies') == '*cookies*'
+    assert rediscache.app_pattern('a*b[1]') == r'*a\*b\[1\]*'
+    assert rediscache.key_prefix(b':1:juicebox:cookies:query:abc') == ':1:juicebox:*'
+    assert rediscache.key_prefix('short:key', depth=3) == 'short:key'
@@ -0,0 +1,64 @@
+import json
+
+from mock import patch
+
+from ..utils import reloadstats
+
+
+class TestReloadStats:
+    def test_stopwatch_sums_repeated_blocks(self):
+        stopwatch = reloadstats.Stopwatch()
+        with patch('jbcli.utils.reloadstats.time.perf_counter',
+                   side_effect=[1.0, 1.5, 2.0, 2.25]):
+            with stopwatch.time('load'):
+                pass
+            with stopwatch.time('load'):
+                pass
+        stopwatch.set('slices', 3)
+        assert stopwatch.timings == {'load': 0.75, 'slices': 3}
+
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3, None]
+        assert reloadstats.percentile(values, 50) == 3
+        assert reloadstats.percentile(values, 95) == 5
+        assert reloadstats.percentile([], 50) is None
+
+    def test_record_and_read(self, tmpdir):
+        filename = str(tmpdir.join('stats.jsonl'))
+        reloadstats.record_reload('cookies', {'total': 1.5}, event_time=0,
+                                  filename=filename)
+        reloadstats.record_reload('cake', {'total': 0.5}, filename=filename)
+        with open(filename, 'a') as f:
+            f.write('not json\n')
+
+        records = reloadstats.read_records(filename)
+        assert [r['app'] for r in records] == ['cookies', 'cake']
+        assert records[0]['total'] == 1.5
+        assert json.loads(open(filename).readline())['app'] == 'cookies'
+
+    def test_read_missing_file(self, tmpdir):
+        assert reloadstats.read_records(str(tmpdir.join('nope'))) == []
+
+    def test_summarize_slowest_first(self):
+        records = [
+            {'app': 'fast', 'total': 1, 'load': 0.5, 'slices': 2},
+            {'app': 'slow', 'total': 10, 'load': 8, 'slices': 40},
+            {'app': 'slow', 'total': 20, 'load': 18, 'refresh': 1},
+        ]
+        rows = reloadstats.summarize(records)
+        assert rows == [
+            ['slow', 2, 10, 20, 8, 18, 1, 1, 40],
+            ['fast', 1, 1, 1, 0.5, 0.5, None, None, 2],
+        ]
+
+    @patch('jbcli.utils.reloadstats.click.echo')
+    @patch('jbcli.utils.reloadstats.echo_highlight')
+    def test_print_summary(self, highlight_mock, echo_mock, tmpdir):
+        filename = str(tmpdir.join('stats.jsonl'))
+        assert reloadstats.print_summary(filename) == []
+        highlight_mock.assert_called_once_with('No reloads have been recorded yet.')
+
+        reloadstats.record_reload('cookies', {'total': 2.0, 'load': 1.5}, filename=filename)
+        rows = reloadstats.print_summary(filename)
+        assert rows[0][:2] == ['cookies', 1]
+        assert 'cookies' in echo_mock.call_args[0][0]
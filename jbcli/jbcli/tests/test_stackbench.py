@@ -0,0 +1,71 @@
+import pytest
+import requests
+import requests_mock
+from mock import patch
+
+from ..utils import stackbench
+from ..utils.stackbench import StackResult
+
+
+class TestStackBench:
+    @patch("jbcli.utils.asyncapi.get_admin_token", return_value="foo")
+    def test_run_bench(self, token_mock):
+        urls = stackbench.stack_urls("cookies", ["overview", "broken"], custom=True)
+        assert urls["overview"] == "http://localhost:8001/stacks/cookies/overview/"
+
+        with requests_mock.Mocker() as m:
+            m.get(urls["overview"], text="<html>")
+            m.get(urls["broken"], [{"status_code": 500}, {"exc": requests.ConnectionError("down")},
+                                   {"text": "<html>"}])
+            seen = []
+            results = stackbench.run_bench(urls, custom=True, concurrency=3, count=10, warmup=2,
+                                           on_result=seen.append)
+
+        assert [(r.stack, r.requests, r.errors) for r in results] == [("overview", 10, 0), ("broken", 10, 0)]
+        # The warmup requests take the failures
+        assert m.call_count == 24
+        assert seen == results
+        assert results[0].p50 <= results[0].p95 <= results[0].p99
+        assert results[0].throughput > 0
+        assert token_mock.call_count == 1
+        assert all(h.headers["Authorization"] == "JWT foo" for h in m.request_history)
+
+    @patch("jbcli.utils.asyncapi.get_admin_token")
+    def test_errors_and_expired_token(self, token_mock):
+        tokens = iter(["old", "new"])
+        token_mock.side_effect = lambda refresh, custom: next(tokens)
+
+        def respond(request, context):
+            if request.headers["Authorization"] == "JWT old":
+                context.status_code = 401
+            elif request.url.endswith("/missing/"):
+                context.status_code = 404
+            return "<html>"
+
+        with requests_mock.Mocker() as m:
+            m.get(requests_mock.ANY, text=respond)
+            results = stackbench.run_bench(stackbench.stack_urls("cookies", ["overview", "missing"]),
+                                           count=4, warmup=0)
+
+        assert [(r.stack, r.errors) for r in results] == [("overview", 0), ("missing", 4)]
+        assert results[1].p50 is None
+        assert token_mock.call_args_list[1][0] == (True, False)
+
+    @patch("jbcli.utils.asyncapi.get_admin_token", return_value=None)
+    def test_no_token(self, token_mock):
+        with pytest.raises(RuntimeError, match="Could not get admin token."):
+            stackbench.run_bench(stackbench.stack_urls("cookies", ["overview"]), count=1)
+
+    def test_save_and_last_run(self, tmpdir):
+        filename = str(tmpdir.join("bench", "results.jsonl"))
+        first = StackResult("overview", 50, 0, 2.5, 20.0, 0.3, 0.5, 0.6)
+        second = first._replace(p50=0.2)
+        assert stackbench.last_run("cookies", "develop-py3@main", filename=filename) is None
+
+        stackbench.save_run("cookies", "develop-py3@main", [first], filename=filename, image="develop-py3")
+        stackbench.save_run("cake", "develop-py3@main", [first], filename=filename)
+        stackbench.save_run("cookies", "develop-py3@main", [second], filename=filename)
+        stackbench.save_run("cookies", "develop-py3@faster", [first], filename=filename)
+
+        assert stackbench.last_run("cookies", "develop-py3@main", filename=filename) == {"overview": second}
+        assert stackbench.last_run("cookies", "other", filename=filename) is None
@@ -0,0 +1,126 @@
+import socket
+import subprocess
+import threading
+
+from mock import call, patch
+
+from ..utils import tunnel
+from ..utils.storageutil import Stash
+from ..utils.tunnel import Forward, TunnelManager
+
+
+def _result(returncode=0, stderr=b''):
+    return subprocess.CompletedProcess([], returncode, b'', stderr)
+
+
+def _server(answer):
+    """A local server that answers the first message it gets with `answer`."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1)
+
+    def serve():
+        conn, _ = sock.accept()
+        with conn:
+            conn.recv(8)
+            if answer:
+                conn.sendall(answer)
+        sock.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return sock.getsockname()[1]
+
+
+class TestProbe:
+    def test_healthy(self):
+        assert tunnel.probe(_server(b'N')) is not None
+
+    def test_closed_by_ssh(self):
+        assert tunnel.probe(_server(b'')) is None
+
+    def test_nothing_listening(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        assert tunnel.probe(port, timeout=1) is None
+
+
+@patch('jbcli.utils.tunnel.subprocess.run')
+class TestTunnelManager:
+    def _manager(self, tmpdir):
+        return TunnelManager(host='bastion', control_path=str(tmpdir.join('tunnel.sock')),
+                             stash=Stash(str(tmpdir.join('stash.toml'))))
+
+    def test_start_master(self, run_mock, tmpdir):
+        manager = self._manager(tmpdir)
+        sock = manager.control_path
+        run_mock.side_effect = [_result(255, b'Control socket connect: No such file'),
+                                _result(), _result()]
+
+        assert manager.ensure([Forward(5439, 'redshift.example.com')]) is False
+
+        assert [c[0][0] for c in run_mock.call_args_list] == [
+            ['ssh', '-S', sock, '-O', 'check', 'bastion'],
+            ['ssh', '-M', '-S', sock, '-o', 'ControlPersist=yes', '-f', '-N', '-T']
+            + tunnel.SSH_OPTIONS + ['bastion'],
+            ['ssh', '-S', sock, '-O', 'forward', '-L',
+             '0.0.0.0:5439:redshift.example.com:5439', 'bastion'],
+        ]
+        assert manager.forwards == [Forward(5439, 'redshift.example.com')]
+
+    def test_reuse_master(self, run_mock, tmpdir):
+        manager = self._manager(tmpdir)
+        manager._save([Forward(5439, 'old.example.com'), Forward(5438, 'hstm.example.com')])
+        run_mock.return_value = _result(0, b'Master running (pid=4321)\r\n')
+
+        assert manager.ensure([Forward(5438, 'hstm.example.com')]) is True
+
+        assert [c[0][0][3:-1] for c in run_mock.call_args_list] == [
+            ['-O', 'check'],
+            ['-O', 'cancel', '-L', '0.0.0.0:5439:old.example.com:5439'],
+            ['-O', 'forward', '-L', '0.0.0.0:5438:hstm.example.com:5439'],
+        ]
+        assert manager.master_pid() == 4321
+
+    def test_connect_fails(self, run_mock, tmpdir):
+        manager = self._manager(tmpdir)
+        run_mock.side_effect = [_result(255), _result(255, b'Permission denied (publickey).')]
+        try:
+            manager.ensure([Forward(5439, 'redshift.example.com')])
+        except RuntimeError as e:
+            assert str(e) == 'Could not connect to bastion: Permission denied (publickey).'
+        else:
+            assert False, 'RuntimeError not raised'
+
+    @patch('jbcli.utils.tunnel.probe')
+    def test_status(self, probe_mock, run_mock, tmpdir):
+        manager = self._manager(tmpdir)
+        manager._save([Forward(5439, 'a.example.com'), Forward(5438, 'b.example.com')])
+        run_mock.return_value = _result(0, b'Master running (pid=4321)')
+        probe_mock.side_effect = [0.02, None]
+
+        pid, checks = manager.status()
+
+        assert pid == 4321
+        assert checks == [(Forward(5439, 'a.example.com'), 0.02),
+                          (Forward(5438, 'b.example.com'), None)]
+        assert probe_mock.mock_calls == [call(5439), call(5438)]
+
+        run_mock.return_value = _result(255)
+        assert manager.status() == (None, [(Forward(5439, 'a.example.com'), None),
+                                           (Forward(5438, 'b.example.com'), None)])
+        assert manager.healthy() is False
+
+    def test_reconnect(self, run_mock, tmpdir):
+        manager = self._manager(tmpdir)
+        manager._save([Forward(5439, 'a.example.com')])
+        run_mock.return_value = _result()
+
+        manager.reconnect()
+
+        assert [c[0][0][1:5] for c in run_mock.call_args_list] == [
+            ['-S', manager.control_path, '-O', 'exit'],
+            ['-M', '-S', manager.control_path, '-o'],
+            ['-S', manager.control_path, '-O', 'forward'],
+        ]
@@ -1,19 +1,33 @@
 """Handles commands involving Juicebox packaged applications
 """
+import errno
+import fnmatch
+import hashlib
 import logging
 import os
+import re
 import shutil
+import subprocess
+import sys
 import tempfile
 from uuid import uuid4
 
 import click
+import yaml
 
 from .. import conf
 from .format import echo_warning, echo_success
-from .subprocess import check_call, CalledProcessError
+from .subprocess import check_call, check_output, CalledProcessError
 
 LOG = logging.getLogger(__name__)
-IGNORE_PATTERNS = shutil.ignore_patterns('*.pyc', '.git', 'tmp')
+# A `key:` at the start of a line, the key may be quoted
+TOP_LEVEL_KEY_RE = re.compile(r"""^(?P<quote>["']?)(?P<key>[A-Za-z_][\w.-]*)(?P=quote)\s*:(?=\s|$)""")
+# A single or double quoted YAML scalar at the start of a string
+QUOTED_RE = re.compile(r"'(?:[^']|'')*'" + r'|"(?:[^"\\]|\\.)*"')
+# Never copied when cloning an app, on top of what .gitignore excludes
+IGNORE_NAMES = ('*.pyc', '.git', 'tmp')
+# Directories that don't change what gets loaded into Juicebox
+HASH_IGNORE_DIRS = {'.git', '.idea', '__pycache__', 'builds', 'node_modules', 'tmp'}
 
 
 def make_github_repo_url(app):
@@ -42,7 +56,311 @@ def make_github_repo_link(app):
         app)
 
 
-def clone(name, source, dest, init_vcs=True, track_vcs=True, custom=False):
+def update_reference_store(app, repo_url):
+    """Fetch an app's branches into the object store shared by all app
+    checkouts, so it can be used with ``git clone --reference``.
+
+    Only the objects the store doesn't have yet are downloaded. Returns the
+    path of the store, or None if it couldn't be updated. Checkouts keep
+    borrowing objects from the store, so it never prunes the ones a force
+    push left unreachable.
+
+    :param app: The Juicebox packaged application name
+    :type app: str
+    :param repo_url: The url to fetch the application from
+    :type repo_url: str
+    """
+    store = os.path.join(conf.GIT_CACHE_DIR, 'objects.git')
+    try:
+        if not os.path.isdir(store):
+            os.makedirs(conf.GIT_CACHE_DIR, exist_ok=True)
+            check_output(['git', 'init', '--quiet', '--bare', store])
+            check_output(['git', '-C', store, 'config', 'gc.auto', '0'])
+            check_output(['git', '-C', store, 'config', 'gc.pruneExpire', 'never'])
+        click.echo(f'Updating shared git objects for {app}')
+        check_output([
+            'git', '-C', store, 'fetch', '--quiet', '--no-tags', repo_url,
+            f'+refs/heads/*:refs/remotes/{app}/*',
+        ])
+    except (CalledProcessError, OSError) as exc_info:
+        LOG.error(str(exc_info))
+        echo_warning('Could not update the shared git objects, doing a full clone.')
+        return None
+    return store
+
+
+def discover_apps(apps_dir='apps'):
+    """List the packaged applications in `apps_dir`, those that have an
+    app.yaml.
+
+    :param apps_dir: The directory holding the application checkouts
+    :type apps_dir: str
+    :rtype: ``list``
+    """
+    try:
+        names = os.listdir(apps_dir)
+    except OSError:
+        return []
+    return sorted(
+        name for name in names
+        if not name.startswith('.')
+        and os.path.isfile(os.path.join(apps_dir, name, 'app.yaml'))
+    )
+
+
+def discover_stacks(app, apps_dir='apps'):
+    """List the stacks of a packaged application, those in its app.yaml
+    first, then the stack directories the app.yaml doesn't list.
+
+    :param app: The application name
+    :type app: str
+    :rtype: ``list``
+    :raises ValueError: If the app.yaml is missing or isn't valid YAML
+    """
+    app_dir = os.path.join(apps_dir, app)
+    try:
+        with open(os.path.join(app_dir, 'app.yaml')) as f:
+            data = yaml.safe_load(f) or {}
+    except IOError:
+        raise ValueError(f'{app_dir} has no app.yaml.')
+    except yaml.YAMLError as e:
+        raise ValueError(f'{app_dir}/app.yaml is not valid YAML: {e}')
+    stacks = []
+    for stack in data.get('stacks') or []:
+        slug = stack.get('slug') or stack.get('id') if isinstance(stack, dict) else stack
+        if slug and str(slug) not in stacks:
+            stacks.append(str(slug))
+    stacks_dir = os.path.join(app_dir, 'stacks')
+    try:
+        names = sorted(os.listdir(stacks_dir))
+    except OSError:
+        names = []
+    stacks.extend(
+        name for name in names
+        if not name.startswith('.') and name not in stacks
+        and os.path.isdir(os.path.join(stacks_dir, name))
+    )
+    return stacks
+
+
+def content_hash(app_dir):
+    """Hash the files of an application so unchanged apps can be detected.
+
+    :param app_dir: The application directory
+    :type app_dir: str
+    :rtype: ``str``
+    """
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(app_dir):
+        dirs[:] = sorted(d for d in dirs if d not in HASH_IGNORE_DIRS)
+        for name in sorted(files):
+            if name.endswith('.pyc'):
+                continue
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, app_dir).replace(os.sep, '/')
+            digest.update(rel_path.encode('utf-8') + b'\0')
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), b''):
+                    digest.update(chunk)
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _git(app_dir, *args, check=True):
+    return subprocess.run(
+        ['git', '-C', app_dir] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=check,
+    )
+
+
+def current_branch(app_dir):
+    """The branch checked out in an app checkout, None when it isn't a git
+    checkout or no branch is checked out.
+
+    :param app_dir: The application directory
+    :type app_dir: str
+    """
+    try:
+        result = _git(app_dir, 'rev-parse', '--abbrev-ref', 'HEAD', check=False)
+    except OSError:
+        return None
+    branch = result.stdout.decode('utf-8').strip()
+    return branch if result.returncode == 0 and branch != 'HEAD' else None
+
+
+def checkout_branch(app_dir, branch):
+    """Fetch and check out `branch` in an app checkout, fast-forwarding it to
+    its upstream. The working directory is left alone so several apps can be
+    switched at the same time.
+
+    :param app_dir: The application directory
+    :type app_dir: str
+    :param branch: The branch to check out
+    :type branch: str
+    :returns: The commits checked out before and after
+    :rtype: ``tuple``
+    :raises CalledProcessError: If git fails, git's message is in ``stderr``
+    """
+    before = _git(app_dir, 'rev-parse', 'HEAD').stdout.decode('utf-8').strip()
+    _git(app_dir, 'fetch', '--quiet', '--prune', 'origin')
+    _git(app_dir, 'checkout', '--quiet', branch)
+    if _git(app_dir, 'rev-parse', '--abbrev-ref', '@{upstream}', check=False).returncode == 0:
+        _git(app_dir, 'merge', '--quiet', '--ff-only', '@{upstream}')
+    after = _git(app_dir, 'rev-parse', 'HEAD').stdout.decode('utf-8').strip()
+    return before, after
+
+
+def _ignored(rel_path, patterns):
+    """Whether a path relative to the app matches a gitignore style pattern.
+
+    Patterns with a slash are anchored to the app directory, the others
+    match any path component.
+    """
+    parts = rel_path.split('/')
+    for pattern in patterns:
+        anchored = pattern.strip('/')
+        if '/' in pattern.rstrip('/'):
+            if any(fnmatch.fnmatch('/'.join(parts[:i]), anchored)
+                   for i in range(1, len(parts) + 1)):
+                return True
+        elif any(fnmatch.fnmatch(part, anchored) for part in parts):
+            return True
+    return False
+
+
+def _read_gitignore(source):
+    try:
+        with open(os.path.join(source, '.gitignore')) as f:
+            lines = [line.strip() for line in f]
+    except OSError:
+        return []
+    # Negations aren't supported, the files they'd bring back stay excluded
+    return [line for line in lines if line and not line.startswith(('#', '!'))]
+
+
+def app_files(source):
+    """List the files of an app that a clone should copy, relative to the app.
+
+    Git checkouts use git's own view of what is ignored. Other apps are
+    walked with the patterns of their top level ``.gitignore``.
+
+    :param source: The application directory
+    :type source: str
+    :rtype: ``list``
+    """
+    toplevel = _git(source, 'rev-parse', '--show-toplevel', check=False)
+    if (toplevel.returncode == 0 and os.path.realpath(
+            toplevel.stdout.decode('utf-8').strip()) == os.path.realpath(source)):
+        listed = _git(source, 'ls-files', '-z', '--cached', '--others', '--exclude-standard')
+        files = [f for f in listed.stdout.decode('utf-8').split('\0') if f]
+        return sorted(
+            f for f in set(files)
+            if not _ignored(f, IGNORE_NAMES) and os.path.lexists(os.path.join(source, f))
+        )
+
+    patterns = list(IGNORE_NAMES) + _read_gitignore(source)
+    files = []
+    for root, dirs, names in os.walk(source):
+        rel_root = os.path.relpath(root, source).replace(os.sep, '/')
+        rel_root = '' if rel_root == '.' else rel_root + '/'
+        dirs[:] = [d for d in dirs if not _ignored(rel_root + d, patterns)]
+        files.extend(rel_root + n for n in names if not _ignored(rel_root + n, patterns))
+        # os.walk doesn't descend into symlinked directories, copy the link
+        files.extend(rel_root + d for d in dirs if os.path.islink(os.path.join(root, d)))
+    return sorted(files)
+
+
+FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    """Make `dst` share the blocks of `src` (btrfs, xfs, apfs). Returns False
+    when the filesystem can't.
+    """
+    if sys.platform.startswith('linux'):
+        import fcntl
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            except OSError:
+                return False
+        shutil.copymode(src, dst)
+        return True
+    if sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        clonefile = getattr(libc, 'clonefile', None)
+        return clonefile is not None and clonefile(
+            os.fsencode(src), os.fsencode(dst), 0) == 0
+    return False
+
+
+def copy_app(source, dest, hardlink=False):
+    """Copy the files of an app that aren't ignored as cheaply as possible.
+
+    Files are reflinked where the filesystem supports it and copied
+    otherwise. With `hardlink` they are hard linked instead, which is as fast
+    but means editing a file in place changes it in both apps.
+
+    :param source: The application directory to copy
+    :type source: str
+    :param dest: The directory to create
+    :type dest: str
+    :rtype: ``int`` the number of files copied
+    """
+    files = app_files(source)
+    os.makedirs(dest)
+    reflink = not hardlink
+    for rel_path in files:
+        src = os.path.join(source, rel_path)
+        dst = os.path.join(dest, rel_path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            continue
+        if hardlink:
+            try:
+                os.link(src, dst)
+                continue
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+        if reflink:
+            if _reflink(src, dst):
+                continue
+            # Stop trying for the rest of this filesystem
+            reflink = False
+        shutil.copy2(src, dst)
+    return len(files)
+
+
+def _yaml_scalar(value):
+    """Render `value` so it loads back as the same string, ids like
+    ``01234567`` would otherwise turn into numbers.
+    """
+    dumped = yaml.safe_dump({'k': value}, default_flow_style=False, width=float('inf'))
+    return dumped[len('k: '):].strip()
+
+
+def check_app_yaml(file_path, expected):
+    """Load an app.yaml and make sure the keys in `expected` have the
+    expected values.
+
+    :raises ValueError: If the file can't be parsed or a value is different
+    """
+    try:
+        with open(file_path) as f:
+            data = yaml.safe_load(f)
+    except yaml.YAMLError as e:
+        raise ValueError(f'{file_path} is not valid YAML: {e}')
+    if not isinstance(data, dict):
+        raise ValueError(f'{file_path} is not a mapping')
+    for key, value in expected.items():
+        if data.get(key) != value:
+            raise ValueError(f'{key} in {file_path} is {data.get(key)!r}, expected {value!r}')
+
+
+def clone(name, source, dest, init_vcs=True, track_vcs=True, custom=False, hardlink=False):
     """Create a Juicebox packaged application
 
     :param name: The packaged application name
@@ -56,20 +374,27 @@ def clone(name, source, dest, init_vcs=True, track_vcs=True, custom=False):
     :param track_vcs: Dictates if we will establish a remote tracking branch
                       (Only valid if init_vcs is also True)
     :type track_vcs: bool
+    :param hardlink: Hard link the files of the source app instead of copying
+    :type hardlink: bool
     """
 
     # TODO: Call the Juicebox App API to get a unique ID
     # and have Git repositories created.
 
     try:
-        shutil.copytree(source, dest, ignore=IGNORE_PATTERNS)
-    except shutil.ExecError:
+        copy_app(source, dest, hardlink=hardlink)
+    except (OSError, shutil.Error):
         echo_warning('Cloning failed on the copy step')
         return False
 
-    replacements = {'slug:': name, 'label:': name, 'id:': str(uuid4())[:8]}
+    replacements = {'slug': name, 'label': name, 'id': str(uuid4())[:8]}
     dest_app_yaml = os.path.join(dest, 'app.yaml')
     replace_in_yaml(dest_app_yaml, replacements)
+    try:
+        check_app_yaml(dest_app_yaml, replacements)
+    except ValueError:
+        shutil.rmtree(dest, ignore_errors=True)
+        raise
 
     if init_vcs:
         perform_init_vcs(name, dest, track_vcs)
@@ -131,32 +456,94 @@ $ git push -u origin master
             echo_warning('Failed to add to github desktop')
 
 
+def _split_comment(value):
+    """Return the trailing ``# comment`` of a single line YAML value,
+    including the whitespace in front of it, or an empty string.
+    """
+    stripped = value.lstrip()
+    if stripped[:1] in ('"', "'"):
+        match = QUOTED_RE.match(stripped)
+        rest = stripped[match.end():] if match else ''
+        return rest if rest.lstrip().startswith('#') else ''
+    match = re.search(r'\s+#.*$', value)
+    return match.group(0) if match else ''
+
+
+def _continues_value(content):
+    """Whether a line belongs to the value of the top level key above it."""
+    return content[:1] in (' ', '\t') or content == '-' or content.startswith('- ')
+
+
 def replace_in_yaml(file_path, replacements):
-    """ Replaces FLAT keys in a yaml file
+    """ Replaces top level keys in a yaml file
+
+    The file is streamed line by line, so comments, ordering and the rest of
+    the formatting are kept, and keys nested under other keys are never
+    touched. Keys that aren't in the file are appended to it. The new file
+    replaces the old one atomically.
 
     :param file_path: Path to the file we are working on
     :type file_path: str
-    :param replacements: YAML key and value
+    :param replacements: YAML key and value, values are written as YAML
+        scalars. For backwards compatibility keys may end with a ``:``.
     :type replacements: dict
 
     Example replacements:
-        {'slug:': name,
-         'label:': name,
-         'id:': str(uuid4())[:8]}
-
-    NOTICE: That you must include the : in the YAML key name
+        {'slug': name,
+         'label': name,
+         'id': str(uuid4())[:8]}
     """
-    # Create temp file
-    handle, abs_path = tempfile.mkstemp()
-    with open(abs_path, 'w') as new_file:
-        with open(file_path) as old_file:
+    replacements = {key.rstrip(':'): value for key, value in replacements.items()}
+    missing = list(replacements)
+    directory = os.path.dirname(os.path.abspath(file_path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, prefix='.jb-', suffix='.yaml')
+    try:
+        with open(file_path, newline='') as old_file, \
+                os.fdopen(handle, 'w', newline='') as new_file:
+            newline = '\n'
+            last_line = ''
+            # Set while dropping the continuation lines of a replaced value
+            replacing = False
+            blank_lines = []
             for line in old_file:
-                for key in replacements.keys():
-                    if key in line:
-                        line = f'{key} {replacements[key]}\n'
-                new_file.write(line)
-    os.close(handle)
-    # Remove original file
-    os.remove(file_path)
-    # Move new file
-    shutil.move(abs_path, file_path)
+                last_line = line
+                content = line.rstrip('\r\n')
+                if content != line:
+                    newline = line[len(content):]
+                if replacing:
+                    if not content.strip():
+                        # Only part of the value if more of it follows
+                        blank_lines.append(line)
+                        continue
+                    if _continues_value(content):
+                        blank_lines = []
+                        continue
+                    replacing = False
+                    new_file.writelines(blank_lines)
+                    blank_lines = []
+
+                match = TOP_LEVEL_KEY_RE.match(content)
+                if not match or match.group('key') not in replacements:
+                    new_file.write(line)
+                    continue
+                key = match.group('key')
+                if key in missing:
+                    missing.remove(key)
+                comment = _split_comment(content[match.end():])
+                new_file.write(
+                    f'{match.group(0)} {_yaml_scalar(replacements[key])}{comment}{newline}')
+                replacing = True
+            new_file.writelines(blank_lines)
+
+            if missing and last_line and not last_line.endswith(('\n', '\r')):
+                new_file.write(newline)
+            for key in missing:
+                new_file.write(f'{key}: {_yaml_scalar(replacements[key])}{newline}')
+            new_file.flush()
+            os.fsync(new_file.fileno())
+        shutil.copymode(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
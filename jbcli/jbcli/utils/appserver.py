@@ -0,0 +1,179 @@
+"""Gracefully reloads the app server in the Juicebox container for ``jb kick``.
+
+The processes are read from ``/proc`` inside the container, so nothing has
+to be installed in the image. How the workers are replaced depends on the
+server that's found:
+
+``gunicorn``
+    One worker at a time: ``TTIN`` makes the master start a new worker and,
+    once that one is up, ``TTOU`` makes it retire the oldest one. There is
+    always a full set of workers answering requests.
+
+``uwsgi``
+    ``HUP`` makes the master gracefully reload all workers.
+
+anything else
+    Every ``/venv/bin/python`` process gets a ``HUP``, which is what
+    ``jb kick`` always did.
+
+The kick is done once the replaced processes are gone and
+``/health_check`` answers again.
+"""
+import os
+import time
+from collections import namedtuple
+
+import requests
+
+__all__ = ['Process', 'Kick', 'processes', 'find_server', 'Kicker']
+
+# pid, the contents of /proc/<pid>/stat and the command line of every process
+LIST_PROCESSES = (
+    'for p in /proc/[0-9]*; do '
+    'printf "%s\\t%s\\t" "${p#/proc/}" "$(cat $p/stat)" && tr "\\0" " " < $p/cmdline && echo; '
+    'done 2>/dev/null'
+)
+SERVERS = ('gunicorn', 'uwsgi')
+FALLBACK = 'python'
+PYTHON = '/venv/bin/python'
+TIMEOUT = 120
+POLL_INTERVAL = 0.25
+
+Process = namedtuple('Process', ['pid', 'ppid', 'command'])
+Kick = namedtuple('Kick', ['server', 'workers', 'seconds'])
+
+
+def _parse(line):
+    try:
+        pid, stat, command = line.split('\t', 2)
+        # The process name in stat is in parentheses and may contain spaces
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        return Process(int(pid), ppid, command.strip())
+    except (ValueError, IndexError):
+        return None
+
+
+def processes(container):
+    """The user space processes running in `container`.
+
+    :rtype: list of `Process`
+    """
+    exit_code, output = container.exec_run(['sh', '-c', LIST_PROCESSES])
+    if exit_code != 0:
+        raise RuntimeError(f'Could not list the processes in {container.name}.')
+    parsed = (_parse(line) for line in output.decode('utf-8', 'replace').splitlines())
+    return [process for process in parsed if process and process.command]
+
+
+def _runs(process, name):
+    # "/venv/bin/gunicorn ...", "/venv/bin/python /venv/bin/gunicorn ..." or
+    # the "gunicorn: worker [fruition]" process title
+    return any(os.path.basename(word).startswith(name) for word in process.command.split()[:2])
+
+
+def find_server(procs):
+    """Find the app server master and its workers in `procs`.
+
+    :returns: The server name, the master `Process` and the worker
+        processes, or None when no known server runs
+    """
+    for name in SERVERS:
+        candidates = [p for p in procs if _runs(p, name)]
+        if not candidates:
+            continue
+        pids = {p.pid for p in candidates}
+        masters = [p for p in candidates if p.ppid not in pids]
+        if masters:
+            master = min(masters, key=lambda p: p.pid)
+            return name, master, [p for p in candidates if p.ppid == master.pid]
+    return None
+
+
+class Kicker(object):
+    """Replaces the app server workers in `container` without downtime.
+
+    :param container: The running Juicebox container
+    :param health_url: The health check of the Juicebox in the container
+    :type health_url: str
+    :param timeout: How many seconds each step may take
+    :type timeout: int
+    """
+
+    def __init__(self, container, health_url, timeout=TIMEOUT):
+        self.container = container
+        self.health_url = health_url
+        self.timeout = timeout
+
+    def _signal(self, pid, signal):
+        exit_code, output = self.container.exec_run(['kill', f'-{signal}', str(pid)])
+        if exit_code != 0:
+            raise RuntimeError(f'Could not send {signal} to process {pid}: '
+                               f'{output.decode("utf-8", "replace").strip()}')
+
+    def _wait_for(self, condition, what):
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return
+            time.sleep(POLL_INTERVAL)
+        raise RuntimeError(f'Timed out after {self.timeout}s waiting for {what}.')
+
+    def _workers(self, master):
+        return {p.pid for p in processes(self.container) if p.ppid == master.pid}
+
+    def healthy(self):
+        try:
+            return requests.get(self.health_url, timeout=2).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _roll_gunicorn(self, master, workers):
+        old = {w.pid for w in workers}
+        for _ in workers:
+            before = self._workers(master)
+            self._signal(master.pid, 'TTIN')
+            self._wait_for(lambda: self._workers(master) - before, 'a new gunicorn worker')
+            self._wait_for(self.healthy, 'the new gunicorn worker')
+            grown = self._workers(master)
+            self._signal(master.pid, 'TTOU')
+            self._wait_for(lambda: len(self._workers(master)) < len(grown),
+                           'an old gunicorn worker to stop')
+        if old & self._workers(master):
+            # The master retired a new worker instead of an old one
+            self._signal(master.pid, 'HUP')
+        return old
+
+    def kick(self):
+        """Replace the workers and wait until Juicebox answers again.
+
+        :rtype: `Kick`
+        :raises RuntimeError: When the reload doesn't finish in time
+        """
+        began = time.monotonic()
+        procs = processes(self.container)
+        found = find_server(procs)
+        if found is None:
+            server = FALLBACK
+            old = {p.pid for p in procs if p.command.split(' ', 1)[0] == PYTHON}
+            exit_code, output = self.container.exec_run(['killall', '-HUP', PYTHON])
+            if exit_code != 0:
+                raise RuntimeError(output.decode('utf-8', 'replace').strip())
+
+            # Processes that handle HUP themselves keep running
+            def restarted(running):
+                return bool(old - running)
+        else:
+            server, master, workers = found
+            if server == 'gunicorn' and workers:
+                old = self._roll_gunicorn(master, workers)
+            else:
+                old = {w.pid for w in workers}
+                self._signal(master.pid, 'HUP')
+
+            def restarted(running):
+                return not old & running
+
+        self._wait_for(lambda: restarted({p.pid for p in processes(self.container)}),
+                       'the old processes to stop')
+        self._wait_for(self.healthy, 'the health check')
+        return Kick(server, len(old), time.monotonic() - began)
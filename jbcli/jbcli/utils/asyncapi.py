@@ -0,0 +1,201 @@
+"""An asyncio variant of the Juicebox API client for loading many apps.
+
+The blocking `requests` calls run in a thread pool so that the loads share
+one HTTP connection pool and one admin token, while retries back off
+without holding up the other apps.
+"""
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .jbapiutil import get_admin_token, parse_result
+
+__all__ = ['AsyncApiClient', 'AsyncJuiceboxClient', 'LoadResult', 'load_apps']
+
+DEFAULT_CONCURRENCY = 4
+MAX_ATTEMPTS = 5
+# Backoff is drawn uniformly from [0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** n)]
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 16.0
+
+
+class LoadResult(object):
+    """The outcome of loading one app."""
+
+    def __init__(self, app, ok, status=None, report=None, duration=0.0,
+                 error=None, skipped=False):
+        self.app = app
+        self.ok = ok
+        self.status = status
+        self.report = report or {}
+        self.duration = duration
+        self.error = error
+        self.skipped = skipped
+
+    def as_dict(self):
+        return {
+            'app': self.app,
+            'ok': self.ok,
+            'status': self.status,
+            'duration': round(self.duration, 3),
+            'error': self.error,
+            'skipped': self.skipped,
+            'report': self.report,
+        }
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Full jitter exponential backoff for the given (0 based) attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AsyncApiClient(object):
+    """Runs blocking Juicebox API calls in a thread pool, sharing one HTTP
+    connection pool and one admin token.
+
+    :param custom: Talk to Juicebox Custom (8001) instead of Selfserve (8000)
+    :type custom: bool
+    :param concurrency: Maximum number of requests in flight
+    :type concurrency: int
+    """
+
+    def __init__(self, custom=False, concurrency=DEFAULT_CONCURRENCY):
+        self.custom = custom
+        self.server = 'http://localhost:8001' if custom else 'http://localhost:8000'
+        self.concurrency = max(int(concurrency), 1)
+        self._token = None
+        self._token_lock = None
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency + 1)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.concurrency)
+        self._session.mount('http://', adapter)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def token(self, stale=None):
+        """Return the admin token, fetching it at most once at a time.
+
+        :param stale: A token the server rejected. It is only refreshed if no
+            other request has refreshed it in the meantime.
+        """
+        async with self._token_lock:
+            if self._token is None or self._token == stale:
+                refresh = stale is not None
+                self._token = await self._call(get_admin_token, refresh, self.custom)
+            return self._token
+
+
+class AsyncJuiceboxClient(AsyncApiClient):
+    """Loads apps through the Juicebox API with bounded concurrency.
+
+    :param custom: Talk to Juicebox Custom (8001) instead of Selfserve (8000)
+    :type custom: bool
+    :param concurrency: Maximum number of app loads in flight
+    :type concurrency: int
+    """
+
+    def __init__(self, custom=False, concurrency=DEFAULT_CONCURRENCY):
+        super().__init__(custom=custom, concurrency=concurrency)
+        self._semaphore = None
+
+    def _post(self, url, token):
+        headers = {
+            'Authorization': f'JWT {token}',
+            'Content-Type': 'application-json',
+        }
+        return self._session.post(url, headers=headers)
+
+    async def load_app(self, app, cancelled=None):
+        """Load a single app, retrying connection errors with jittered backoff.
+
+        :param cancelled: Optional `asyncio.Event`, when it is set before the
+            load gets a slot the app is skipped.
+        :rtype: ``LoadResult``
+        """
+        url = f'{self.server}/api/v1/app/load/{app}/'
+        async with self._semaphore:
+            if cancelled is not None and cancelled.is_set():
+                return LoadResult(app, False, error='Skipped after an earlier failure.',
+                                  skipped=True)
+            start = time.perf_counter()
+            token = await self.token()
+            refreshed = False
+            attempt = 0
+            while True:
+                if not token:
+                    return LoadResult(app, False, error='Could not get admin token.',
+                                      duration=time.perf_counter() - start)
+                try:
+                    response = await self._call(self._post, url, token)
+                except requests.ConnectionError as e:
+                    attempt += 1
+                    if attempt >= MAX_ATTEMPTS:
+                        return LoadResult(app, False, error=str(e),
+                                          duration=time.perf_counter() - start)
+                    await asyncio.sleep(backoff_delay(attempt - 1))
+                    continue
+
+                if response.status_code == 401 and not refreshed:
+                    token = await self.token(stale=token)
+                    refreshed = True
+                    continue
+                break
+
+            duration = time.perf_counter() - start
+            report = {}
+            if response.status_code != 204:
+                try:
+                    report = parse_result(response.json())
+                except ValueError:
+                    report = {}
+            ok = response.status_code in (200, 204)
+            error = None if ok else f'Loading app status code was {response.status_code}'
+            return LoadResult(app, ok, status=response.status_code, report=report,
+                              duration=duration, error=error)
+
+    async def load_apps(self, apps, on_result=None, fail_fast=False):
+        """Load every app in `apps`, at most `concurrency` at a time.
+
+        :param on_result: Optional callback called with each `LoadResult` as
+            soon as it finishes.
+        :param fail_fast: Once an app fails, don't start loading any more
+            apps. The apps that were not started are returned as skipped.
+        :rtype: ``list`` of ``LoadResult`` in the order of `apps`
+        """
+        self._token_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        failed = asyncio.Event()
+
+        async def _load(app):
+            result = await self.load_app(app, cancelled=failed if fail_fast else None)
+            if not result.ok:
+                failed.set()
+            if on_result is not None:
+                on_result(result)
+            return result
+
+        return await asyncio.gather(*[_load(app) for app in apps])
+
+
+def load_apps(apps, custom=False, concurrency=DEFAULT_CONCURRENCY, on_result=None,
+              fail_fast=False):
+    """Blocking helper that loads `apps` with an `AsyncJuiceboxClient`.
+
+    :rtype: ``list`` of ``LoadResult``
+    """
+    client = AsyncJuiceboxClient(custom=custom, concurrency=concurrency)
+    try:
+        return asyncio.run(
+            client.load_apps(apps, on_result=on_result, fail_fast=fail_fast))
+    finally:
+        client.close()
@@ -0,0 +1,189 @@
+"""Builds the docker-compose configuration of a run in memory.
+
+The compose files of an environment and any overlays generated by jb (like
+the SSH tunnel hosts) are merged with the same rules docker-compose uses
+and written to a private file that is the only ``-f`` passed to
+docker-compose. Nothing is written into the devlandia checkout, so a
+crashed run can't leave overrides behind.
+
+Variables like ``${TAG}`` are left alone for docker-compose to fill in, so
+the merged file holds no secrets and only depends on its inputs. It is
+cached by a hash of them, a repeated ``jb start`` reuses it without
+merging again.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import yaml
+
+from .. import conf
+
+__all__ = ['merge', 'merged_config_file']
+
+# Bump when the merge rules change so cached files are rebuilt
+MERGE_VERSION = 1
+# How many merged files to keep around
+CACHE_SIZE = 20
+
+# Lists of KEY=VALUE or host:ip entries that are merged by key
+MAPPING_LISTS = {'environment': '=', 'labels': '=', 'sysctls': '=', 'args': '=',
+                 'extra_hosts': ':'}
+# Lists of mounts that are merged by their path in the container
+MOUNT_LISTS = {'volumes', 'devices'}
+# Replaced as a whole
+REPLACED = {'command', 'entrypoint'}
+
+
+class _NoAliasDumper(yaml.SafeDumper):
+    """Write shared objects out in full instead of as YAML anchors."""
+
+    def ignore_aliases(self, data):
+        return True
+
+
+def _as_mapping(value, separator):
+    if isinstance(value, dict):
+        return dict(value)
+    mapping = {}
+    for entry in value or []:
+        key, found, item = str(entry).partition(separator)
+        mapping[key] = item if found else None
+    return mapping
+
+
+def _mount_target(mount):
+    if isinstance(mount, dict):
+        return mount.get('target')
+    parts = str(mount).split(':')
+    return parts[1] if len(parts) > 1 else parts[0]
+
+
+def _merge_mounts(base, override):
+    merged = {_mount_target(mount): mount for mount in base or []}
+    merged.update((_mount_target(mount), mount) for mount in override or [])
+    return list(merged.values())
+
+
+def _merge_value(key, base, override):
+    if key in REPLACED:
+        return override
+    if key in MAPPING_LISTS:
+        merged = _as_mapping(base, MAPPING_LISTS[key])
+        merged.update(_as_mapping(override, MAPPING_LISTS[key]))
+        return merged
+    if key in MOUNT_LISTS and isinstance(base, list) and isinstance(override, list):
+        return _merge_mounts(base, override)
+    if isinstance(base, dict) and isinstance(override, dict):
+        return _merge_dicts(base, override)
+    if isinstance(base, list) and isinstance(override, list):
+        return base + [item for item in override if item not in base]
+    return override
+
+
+def _merge_dicts(base, override):
+    merged = dict(base or {})
+    for key, value in (override or {}).items():
+        if key not in merged:
+            merged[key] = value
+        elif value is not None:
+            merged[key] = _merge_value(key, merged[key], value)
+    return merged
+
+
+def _version(value):
+    return tuple(int(part) if part.isdigit() else 0 for part in str(value).split('.'))
+
+
+def merge(configs):
+    """Merge compose configurations the way ``docker-compose -f a -f b``
+    does, later configurations win.
+
+    :param configs: Loaded compose files and overlays
+    :type configs: list of dict
+    :rtype: ``dict``
+    """
+    merged = {}
+    for config in configs:
+        for section, value in (config or {}).items():
+            if section not in merged or value is None:
+                merged.setdefault(section, value)
+            elif section == 'version':
+                merged[section] = max(merged[section], value, key=_version)
+            elif isinstance(value, dict):
+                # Services, networks and volumes merge one entry at a time
+                entries = dict(merged[section] or {})
+                for name, entry in value.items():
+                    if name in entries:
+                        entry = _merge_dicts(entries[name], entry)
+                    entries[name] = entry
+                merged[section] = entries
+            else:
+                merged[section] = value
+    return merged
+
+
+def _cache_key(files, overlays):
+    digest = hashlib.sha256(f'v{MERGE_VERSION}'.encode('utf-8'))
+    for path in files:
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest.update(f'\0{path}\0{len(content)}\0'.encode('utf-8'))
+        digest.update(content)
+    digest.update(json.dumps(overlays, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _prune_cache(cache_dir, keep):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.yml'):
+            path = os.path.join(cache_dir, name)
+            entries.append((os.path.getmtime(path), path))
+    for _, path in sorted(entries, reverse=True)[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def merged_config_file(files, overlays=None, cache_dir=None):
+    """Return the path of a private file holding the merged configuration of
+    `files` and `overlays`, merging them only if they changed.
+
+    :param files: Compose files, in the order they'd be passed with ``-f``
+    :type files: list of str
+    :param overlays: Extra compose configuration generated by jb
+    :type overlays: list of dict
+    :rtype: ``str``
+    """
+    overlays = overlays or []
+    cache_dir = cache_dir or conf.COMPOSE_CACHE_DIR
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    path = os.path.join(cache_dir, f'{_cache_key(files, overlays)}.yml')
+    if os.path.exists(path):
+        # Keep recently used files when pruning
+        os.utime(path)
+        return path
+
+    configs = []
+    for compose_file in files:
+        with open(compose_file) as f:
+            configs.append(yaml.safe_load(f))
+    merged = merge(configs + overlays)
+    content = yaml.dump(merged, Dumper=_NoAliasDumper, default_flow_style=False,
+                        sort_keys=False)
+
+    handle, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w') as f:
+            f.write(f'# Merged by jb from {", ".join(files) or "overlays"}\n')
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _prune_cache(cache_dir, CACHE_SIZE)
+    return path
@@ -0,0 +1,248 @@
+"""Picks how jb drives docker compose.
+
+``docker-compose`` v1 is a Python program that takes a second or more just to
+start. Compose v2 ships as a Docker CLI plugin (``docker compose``) and
+starts in a fraction of that, but it names containers
+``devlandia-juicebox_selfserve-1`` where v1 uses
+``devlandia_juicebox_selfserve_1`` and recreates every container of a stack
+v1 created, so it's opt-in. Stopping and starting the containers of a
+project doesn't need compose at all, the native backend does it with the
+Docker SDK jb already has loaded.
+
+``JB_COMPOSE_BACKEND`` picks a backend: ``auto`` (the default) uses the
+native backend for ``stop`` and ``start`` and ``docker-compose`` for the
+rest, ``v1``, ``v2`` and ``native`` force one.
+"""
+import functools
+import re
+import shutil
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import docker.errors
+import yaml
+
+from .. import conf
+from .format import echo_warning
+
+__all__ = ['ComposeV1', 'ComposeV2', 'NativeBackend', 'select', 'available_backends',
+           'service_containers', 'normalize_project']
+
+BACKENDS = ('v1', 'v2', 'native')
+# The compose commands the native backend can run
+NATIVE_COMMANDS = {'stop', 'start'}
+PROJECT_LABEL = 'com.docker.compose.project'
+SERVICE_LABEL = 'com.docker.compose.service'
+# Seconds a container gets to shut down, the same as docker-compose
+STOP_TIMEOUT = 10
+# Services that need more, or less, time than that
+STOP_TIMEOUTS = {'postgres': 30, 'redis': 5, 'snapshot': 5}
+# Services that keep nothing worth shutting down cleanly for, `--fast` kills
+# them. Postgres always gets to shut down.
+KILLABLE = {'juicebox_selfserve', 'juicebox_custom', 'ganesha', 'snapshot', 'redis'}
+
+StopResult = namedtuple('StopResult', ['name', 'service', 'action', 'seconds', 'error'])
+
+
+class ComposeCLI(object):
+    """A compose command line tool."""
+    name = None
+    command = []
+
+    def available(self):
+        return shutil.which(self.command[0]) is not None
+
+    def command_line(self, args, config_file, project):
+        """The command that runs compose `args` on the merged `config_file`.
+
+        :rtype: ``list``
+        """
+        return self.command + [
+            '--project-directory', '.', '--project-name', project, '-f', config_file
+        ] + list(args)
+
+
+class ComposeV1(ComposeCLI):
+    """The Python ``docker-compose`` program."""
+    name = 'v1'
+    command = ['docker-compose']
+
+
+@functools.lru_cache(maxsize=None)
+def _has_compose_plugin():
+    if shutil.which('docker') is None:
+        return False
+    try:
+        subprocess.run(['docker', 'compose', 'version'], stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, timeout=10, check=True)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return True
+
+
+class ComposeV2(ComposeCLI):
+    """The ``docker compose`` CLI plugin."""
+    name = 'v2'
+    command = ['docker', 'compose']
+
+    def available(self):
+        return _has_compose_plugin()
+
+
+class NativeBackend(object):
+    """Stops and starts the containers of a project through the Docker SDK.
+
+    Anything else, or a ``start`` of services that have no container yet, is
+    left to `fallback`.
+
+    :param client: The Docker client
+    :param fallback: The compose CLI used for everything else
+    :type fallback: `ComposeCLI`
+    """
+    name = 'native'
+
+    def __init__(self, client, fallback):
+        self.client = client
+        self.fallback = fallback
+
+    def available(self):
+        return True
+
+    @staticmethod
+    def services(config_file):
+        """The names of the services in a compose file."""
+        with open(config_file) as f:
+            config = yaml.safe_load(f) or {}
+        return list(config.get('services') or {})
+
+    def containers(self, project, services):
+        """The containers compose created for `services` of `project`."""
+        containers = self.client.containers.list(
+            all=True, filters={'label': f'{PROJECT_LABEL}={project}'})
+        return [c for c in containers if c.labels.get(SERVICE_LABEL) in services]
+
+    def running(self, project):
+        """The running containers of `project`, whatever compose file made them."""
+        return self.client.containers.list(filters={'label': f'{PROJECT_LABEL}={project}'})
+
+    @staticmethod
+    def _stop(container, fast):
+        service = container.labels.get(SERVICE_LABEL)
+        began = time.perf_counter()
+        try:
+            if fast and service in KILLABLE:
+                container.kill()
+                action = 'killed'
+            else:
+                container.stop(timeout=STOP_TIMEOUTS.get(service, STOP_TIMEOUT))
+                action = 'stopped'
+        except docker.errors.APIError as e:
+            return StopResult(container.name, service, 'failed', time.perf_counter() - began,
+                              e.explanation or str(e))
+        return StopResult(container.name, service, action, time.perf_counter() - began, None)
+
+    def stop(self, containers, fast=False):
+        """Stop `containers` at the same time, each with the timeout of its
+        service.
+
+        :param fast: Kill the containers of `KILLABLE` services
+        :type fast: bool
+        :rtype: list of `StopResult`
+        """
+        if not containers:
+            return []
+        with ThreadPoolExecutor(max_workers=len(containers)) as executor:
+            return list(executor.map(lambda c: self._stop(c, fast), containers))
+
+    def run(self, args, config_file, project):
+        """Run compose `args` if this backend can.
+
+        :returns: False if the command has to go to the fallback
+        :rtype: ``bool``
+        """
+        command, services = args[0], list(args[1:])
+        if command not in NATIVE_COMMANDS or any(s.startswith('-') for s in services):
+            return False
+        services = services or self.services(config_file)
+        containers = self.containers(project, services)
+        if command == 'start':
+            created = {c.labels.get(SERVICE_LABEL) for c in containers}
+            if not set(services) <= created:
+                return False
+        if command == 'stop':
+            results = self.stop([c for c in containers if c.status == 'running'])
+            failed = [r for r in results if r.error]
+            for result in failed:
+                echo_warning(f"Could not stop {result.name}: {result.error}")
+            if failed:
+                sys.exit(1)
+            return True
+        try:
+            for container in containers:
+                if container.status != 'running':
+                    container.start()
+        except docker.errors.APIError as e:
+            echo_warning(f"Could not start {container.name}: {e.explanation or e}")
+            sys.exit(1)
+        return True
+
+
+def select(command=None, name=None, client=None):
+    """Pick the backend for a compose command.
+
+    :param command: The compose command, like ``stop``
+    :type command: str
+    :param name: One of `BACKENDS` or ``auto``, defaults to ``JB_COMPOSE_BACKEND``
+    :type name: str
+    :param client: The Docker client, the native backend needs one
+    """
+    name = name or conf.COMPOSE_BACKEND
+    if name not in BACKENDS + ('auto',):
+        raise ValueError(f'Unknown compose backend: {name}')
+    if name == 'v1':
+        return ComposeV1()
+    if name == 'v2':
+        return ComposeV2()
+    cli = ComposeV1()
+    # Compose v2 only when it's all there is
+    if not cli.available() and _has_compose_plugin():
+        cli = ComposeV2()
+    if command in NATIVE_COMMANDS and client is not None:
+        return NativeBackend(client, cli)
+    return cli
+
+
+def available_backends(client=None):
+    """The names of the backends that can run here."""
+    backends = [ComposeV1(), ComposeV2()]
+    if client is not None:
+        backends.append(NativeBackend(client, None))
+    return [backend.name for backend in backends if backend.available()]
+
+
+def normalize_project(name):
+    """The project name the way compose uses it in labels and network names."""
+    return re.sub(r'[^-_a-z0-9]', '', name.lower())
+
+
+def service_containers(client, project, services=(), all=True):
+    """The containers of a compose project by service name.
+
+    :param services: Only these services, all when empty
+    :param all: Include the stopped containers
+    :raises ValueError: When a requested service has no container
+    """
+    found = {}
+    for container in client.containers.list(
+            all=all, filters={'label': f'{PROJECT_LABEL}={project}'}):
+        found.setdefault(container.labels.get(SERVICE_LABEL, container.name), container)
+    missing = [service for service in services if service not in found]
+    if missing:
+        raise ValueError(f"No containers for {', '.join(missing)}, "
+                         f"the services are {', '.join(sorted(found)) or 'not running'}.")
+    if services:
+        return {service: found[service] for service in services}
+    return found
@@ -0,0 +1,169 @@
+"""Samples the resource use of the devlandia containers for ``jb stats``.
+
+Docker streams a stats document for every running container about once a
+second. Each container is read by its own thread, so a busy container
+doesn't hold back the others. CPU and memory are worked out the way
+``docker stats`` does, the disk and network rates from two documents in a
+row.
+"""
+import csv
+import json
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from .composebackend import service_containers
+from .logstream import parse_timestamp
+
+__all__ = ['Sample', 'sample', 'StatsStream', 'Recorder']
+
+FIELDS = ['time', 'service', 'cpu', 'memory', 'memory_limit', 'block_read',
+          'block_write', 'net_rx', 'net_tx', 'pids']
+# The file formats `Recorder` writes, by extension
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+# Seconds between refreshes
+INTERVAL = 2
+
+Sample = namedtuple('Sample', FIELDS)
+
+
+def _counters(stats):
+    blkio = (stats.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []
+    networks = (stats.get('networks') or {}).values()
+    return (
+        sum(entry['value'] for entry in blkio if entry['op'].lower() == 'read'),
+        sum(entry['value'] for entry in blkio if entry['op'].lower() == 'write'),
+        sum(network['rx_bytes'] for network in networks),
+        sum(network['tx_bytes'] for network in networks),
+    )
+
+
+def sample(service, stats, previous):
+    """Turn two stats documents of a container in a row into a `Sample`.
+
+    CPU is in percent of one core, memory in bytes and the disk and network
+    use in bytes per second.
+    """
+    cpu, precpu = stats['cpu_stats'], stats.get('precpu_stats') or {}
+    cpu_delta = (cpu['cpu_usage']['total_usage']
+                 - (precpu.get('cpu_usage') or {}).get('total_usage', 0))
+    system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+    cpus = (cpu.get('online_cpus')
+            or len(cpu['cpu_usage'].get('percpu_usage') or []) or 1)
+    cpu_percent = 0.0
+    if system_delta > 0 and cpu_delta > 0:
+        cpu_percent = cpu_delta / system_delta * cpus * 100
+
+    memory = stats.get('memory_stats') or {}
+    details = memory.get('stats') or {}
+    # The page cache can be dropped, cgroup v2 calls it inactive_file
+    cache = details.get('inactive_file', details.get('total_inactive_file', 0))
+
+    read = parse_timestamp(stats['read'])
+    seconds = (read - parse_timestamp(previous['read'])).total_seconds() or 1
+    # The counters start over when the container restarts
+    rates = [max(now - before, 0) / seconds
+             for now, before in zip(_counters(stats), _counters(previous))]
+    pids = (stats.get('pids_stats') or {}).get('current', 0)
+    return Sample(read, service, cpu_percent, max(memory.get('usage', 0) - cache, 0),
+                  memory.get('limit', 0), *rates, pids)
+
+
+class StatsStream(object):
+    """Streams the stats of the running containers of a compose project.
+
+    :param client: The Docker client
+    :param project: The compose project name
+    :param services: Only sample these services, all when empty
+    """
+
+    def __init__(self, client, project, services=()):
+        self.client = client
+        self.project = project
+        self.services = list(services)
+
+    def containers(self):
+        """The running containers to sample, by service name.
+
+        :raises ValueError: When a requested service isn't running
+        """
+        return service_containers(self.client, self.project, self.services, all=False)
+
+    def _read(self, service, container, samples):
+        previous = None
+        try:
+            for stats in container.stats(stream=True, decode=True):
+                # A stopped container keeps sending empty documents
+                if not stats.get('read') or stats['read'].startswith('0001-'):
+                    break
+                if previous is not None:
+                    samples.put(sample(service, stats, previous))
+                previous = stats
+        finally:
+            samples.put(None)
+
+    def samples(self, interval=INTERVAL):
+        """Yield the `Sample` taken in every `interval` seconds, until all
+        containers have stopped.
+        """
+        samples = queue.Queue()
+        readers = self.containers()
+        for service, container in readers.items():
+            threading.Thread(target=self._read, args=(service, container, samples),
+                             name=f'jb-stats-{service}', daemon=True).start()
+
+        running = len(readers)
+        while running:
+            deadline = time.monotonic() + interval
+            received = []
+            while running:
+                try:
+                    taken = samples.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if taken is None:
+                    running -= 1
+                else:
+                    received.append(taken)
+            if received:
+                yield received
+
+
+class Recorder(object):
+    """Writes samples to a CSV or JSON lines file, picked by its extension.
+
+    :param path: The file to write, it's replaced
+    :raises ValueError: When the extension isn't one of `FORMATS`
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.format = FORMATS.get(os.path.splitext(path)[1].lower())
+        if self.format is None:
+            raise ValueError(
+                f"Can't record to {path}, use a {' or '.join(FORMATS)} file.")
+        self.file = None
+        self.writer = None
+        self.count = 0
+
+    def __enter__(self):
+        self.file = open(self.path, 'w', newline='')
+        if self.format == 'csv':
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(FIELDS)
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+    def write(self, samples):
+        for taken in samples:
+            row = taken._replace(time=taken.time.isoformat())
+            if self.writer:
+                self.writer.writerow(row)
+            else:
+                self.file.write(json.dumps(row._asdict()) + '\n')
+        self.file.flush()
+        self.count += len(samples)
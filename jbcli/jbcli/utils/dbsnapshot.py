@@ -0,0 +1,242 @@
+"""Snapshots of the Juicebox databases in the devlandia postgres service.
+
+Snapshots live in the ``jb-db-snapshots`` Docker volume, one directory per
+snapshot, and are made by helper containers running the postgres image, so
+nothing has to be installed on the host. There are two methods:
+
+``volume``
+    Postgres is paused while its data directory is copied. This is the
+    fastest way to save and restore everything, the copy is what postgres
+    would find after a power cut and it recovers from it the same way.
+
+``dump``
+    Each database is dumped with ``pg_dump -Fd -j N`` while postgres keeps
+    running and restored with ``pg_restore -j N``. Dumps are smaller and
+    survive postgres version upgrades.
+
+The app manifest is saved with every snapshot and put back on restore, so
+only the apps that changed since the snapshot are reloaded.
+
+In ephemeral mode postgres keeps its data on a tmpfs instead of the data
+volume, so only ``dump`` snapshots can be taken and restored then.
+"""
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import docker.errors
+
+from . import ephemeral
+from .composebackend import PROJECT_LABEL, SERVICE_LABEL, normalize_project
+from .manifest import MANIFEST_KEY
+from .storageutil import stash as default_stash
+
+__all__ = ['Snapshot', 'Snapshots']
+
+SNAPSHOTS_KEY = 'db_snapshots'
+SNAPSHOT_VOLUME = 'jb-db-snapshots'
+METHODS = ('volume', 'dump')
+DEFAULT_JOBS = 4
+# Created by create_db.sh from POSTGRES_MULTIPLE_DATABASES
+DATABASES = ('juicebox', 'juicebox_custom')
+DB_USER = 'juicebox'
+DB_PASSWORD = 'juicebox'
+DATA_DIR = '/var/lib/postgresql/data'
+# Snapshot names end up in paths inside the helper containers
+NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+READY_TIMEOUT = 60
+
+Snapshot = namedtuple('Snapshot', ['name', 'method', 'size', 'seconds', 'created'])
+
+
+class Snapshots(object):
+    """Saves and restores snapshots of the postgres service of a project.
+
+    :param client: The Docker client
+    :param project: The docker compose project name
+    :type project: str
+    """
+
+    def __init__(self, client, project, stash=None):
+        self.client = client
+        self.project = normalize_project(project)
+        self.stash = stash or default_stash
+
+    def _all(self):
+        return self.stash.get(SNAPSHOTS_KEY, {}) or {}
+
+    def list(self):
+        """Every snapshot, oldest first.
+
+        :rtype: list of `Snapshot`
+        """
+        snapshots = [
+            Snapshot(name, info['method'], info['size'], info['seconds'], info['created'])
+            for name, info in self._all().items()
+        ]
+        return sorted(snapshots, key=lambda s: s.created)
+
+    def postgres(self):
+        """The running postgres container of the project."""
+        containers = self.client.containers.list(filters={'label': [
+            f'{PROJECT_LABEL}={self.project}', f'{SERVICE_LABEL}=postgres',
+        ]})
+        if not containers:
+            raise RuntimeError('Postgres is not running, start Juicebox first.')
+        return containers[0]
+
+    @staticmethod
+    def _data_volume(container):
+        for mount in container.attrs.get('Mounts', []):
+            if mount.get('Destination') == DATA_DIR:
+                return mount['Name']
+        raise RuntimeError(f'{container.name} keeps its data outside of a volume.')
+
+    def _helper(self, container, command, volumes, network=False):
+        """Run `command` in a throwaway container of the postgres image."""
+        kwargs = {}
+        if network:
+            kwargs['network'] = f'{self.project}_juice_net'
+        try:
+            output = self.client.containers.run(
+                container.image.id, ['sh', '-c', command], volumes=volumes, remove=True,
+                environment={'PGPASSWORD': DB_PASSWORD}, **kwargs)
+        except docker.errors.ContainerError as e:
+            stderr = (e.stderr or b'').decode('utf-8', 'replace').strip()
+            raise RuntimeError(stderr.splitlines()[-1] if stderr else str(e))
+        except docker.errors.APIError as e:
+            raise RuntimeError(e.explanation or str(e))
+        return output.decode('utf-8', 'replace')
+
+    def _wait_ready(self, container):
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            exit_code, _ = container.exec_run(['pg_isready', '-U', DB_USER])
+            if exit_code == 0:
+                return
+            time.sleep(0.5)
+        raise RuntimeError(f'Postgres did not come back within {READY_TIMEOUT} seconds.')
+
+    def snapshot(self, name, method='volume', jobs=DEFAULT_JOBS, force=False):
+        """Save the databases as snapshot `name`.
+
+        :param method: ``volume`` or ``dump``
+        :type method: str
+        :param jobs: How many tables ``pg_dump`` dumps at once
+        :type jobs: int
+        :param force: Replace an existing snapshot with the same name
+        :type force: bool
+        :rtype: `Snapshot`
+        :raises RuntimeError: If the snapshot can't be made
+        """
+        if not NAME_RE.match(name):
+            raise RuntimeError(f'Invalid snapshot name: {name}')
+        if method not in METHODS:
+            raise RuntimeError(f'Unknown snapshot method: {method}')
+        if name in self._all() and not force:
+            raise RuntimeError(f'Snapshot {name} already exists, use --force to replace it.')
+        if method == 'volume':
+            self._check_durable()
+        container = self.postgres()
+        target = f'/snapshots/{name}'
+        prepare = f'rm -rf {target} && mkdir -p {target}'
+        size = f'du -sk {target} | cut -f1'
+
+        began = time.perf_counter()
+        if method == 'volume':
+            volumes = {
+                self._data_volume(container): {'bind': '/data', 'mode': 'ro'},
+                SNAPSHOT_VOLUME: {'bind': '/snapshots', 'mode': 'rw'},
+            }
+            container.pause()
+            try:
+                output = self._helper(
+                    container, f'{prepare} && cp -a /data {target}/data && {size}', volumes)
+            finally:
+                container.unpause()
+        else:
+            dumps = ' && '.join(
+                f'pg_dump -h postgres -U {DB_USER} -Fd -j {jobs} -f {target}/{db} {db}'
+                for db in DATABASES
+            )
+            output = self._helper(
+                container, f'{prepare} && {dumps} && {size}',
+                {SNAPSHOT_VOLUME: {'bind': '/snapshots', 'mode': 'rw'}}, network=True)
+        seconds = time.perf_counter() - began
+
+        snapshot = Snapshot(name, method, int(output.split()[-1]) * 1024, round(seconds, 2),
+                            datetime.now().isoformat(timespec='seconds'))
+        snapshots = self._all()
+        snapshots[name] = {
+            'method': method,
+            'size': snapshot.size,
+            'seconds': snapshot.seconds,
+            'created': snapshot.created,
+            'manifest': self.stash.get(MANIFEST_KEY, {}) or {},
+        }
+        self.stash.put(SNAPSHOTS_KEY, snapshots)
+        return snapshot
+
+    def _check_durable(self):
+        if ephemeral.is_active(self.stash):
+            raise RuntimeError('Juicebox runs with --ephemeral, only snapshots made with '
+                               '--method dump can be taken and restored.')
+
+    def _restore_dump(self, container, name, db, jobs):
+        self._helper(container, ' && '.join([
+            f'dropdb -h postgres -U {DB_USER} --if-exists --force {db}',
+            f'createdb -h postgres -U {DB_USER} {db}',
+            f'pg_restore -h postgres -U {DB_USER} -j {jobs} -d {db} /snapshots/{name}/{db}',
+        ]), {SNAPSHOT_VOLUME: {'bind': '/snapshots', 'mode': 'ro'}}, network=True)
+
+    def restore(self, name, jobs=DEFAULT_JOBS):
+        """Replace the databases with snapshot `name`.
+
+        :param jobs: How many tables ``pg_restore`` restores at once
+        :type jobs: int
+        :returns: The snapshot, with how long restoring it took
+        :rtype: `Snapshot`
+        :raises RuntimeError: If the snapshot can't be restored
+        """
+        info = self._all().get(name)
+        if info is None:
+            raise RuntimeError(f'There is no snapshot named {name}.')
+        if info['method'] == 'volume':
+            self._check_durable()
+        container = self.postgres()
+
+        began = time.perf_counter()
+        if info['method'] == 'volume':
+            volumes = {
+                self._data_volume(container): {'bind': '/data', 'mode': 'rw'},
+                SNAPSHOT_VOLUME: {'bind': '/snapshots', 'mode': 'ro'},
+            }
+            container.stop(timeout=30)
+            try:
+                self._helper(container, f'find /data -mindepth 1 -delete && '
+                                        f'cp -a /snapshots/{name}/data/. /data/', volumes)
+            finally:
+                container.start()
+            self._wait_ready(container)
+        else:
+            with ThreadPoolExecutor(max_workers=len(DATABASES)) as executor:
+                futures = [executor.submit(self._restore_dump, container, name, db, jobs)
+                           for db in DATABASES]
+                for future in futures:
+                    future.result()
+        seconds = time.perf_counter() - began
+
+        self.stash.put(MANIFEST_KEY, info.get('manifest', {}))
+        return Snapshot(name, info['method'], info['size'], round(seconds, 2), info['created'])
+
+    def remove(self, name):
+        """Delete snapshot `name`."""
+        snapshots = self._all()
+        if name not in snapshots:
+            raise RuntimeError(f'There is no snapshot named {name}.')
+        self._helper(self.postgres(), f'rm -rf /snapshots/{name}',
+                     {SNAPSHOT_VOLUME: {'bind': '/snapshots', 'mode': 'rw'}})
+        del snapshots[name]
+        self.stash.put(SNAPSHOTS_KEY, snapshots)
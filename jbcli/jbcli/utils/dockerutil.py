@@ -21,15 +21,20 @@ import shutil
 
 import click
 import docker.errors
+from . import compose, composebackend, jswatch
 from .jbapiutil import load_app
 from .subprocess import check_call, check_output
 from .reload import refresh_browser
+from .reloadstats import Stopwatch, record_reload
 
 from .format import echo_warning, echo_success, human_readable_timediff
+from .storageutil import stash
 
 client = docker.from_env()
 toplog = structlog.get_logger()
 
+LEGACY_SSH_FILE = "docker-compose-ssh.yml"
+
 class WatchHandler(FileSystemEventHandler):
     def __init__(self, should_reload=False, custom=False):
         self.should_reload = should_reload
@@ -56,19 +61,31 @@ class WatchHandler(FileSystemEventHandler):
 
         if "builds" not in path and ".idea" not in path and ".git" not in path:
             click.echo(f"Change detected in {app}.")
+            event_time = time.time()
+            stopwatch = Stopwatch()
+            stopwatch.set("debounce", _event_delay(event.src_path, event_time))
             if is_python_change:
                 # We don't need to reload the app just refresh
                 # the browser after juicebox service restarts
                 if self.should_reload:
-                    refresh_browser(5, custom=self.custom)
+                    with stopwatch.time("refresh"):
+                        refresh_browser(5, custom=self.custom)
             else:
                 # Try to load app via api, fall back to calling docker.exec_run
                 echo_warning(f"{app} is loading...")
-                if not load_app(app, custom=self.custom):
-                    run(f"/venv/bin/python manage.py loadjuiceboxapp {app}", env=env)
+                loaded = load_app(app, custom=self.custom, stopwatch=stopwatch)
+                if not loaded:
+                    with stopwatch.time("fallback"):
+                        run(f"/venv/bin/python manage.py loadjuiceboxapp {app}", env=env)
                 echo_success(f"{app} was added successfully.")
+                stopwatch.set("api", loaded)
                 if self.should_reload:
-                    refresh_browser(custom=self.custom)
+                    with stopwatch.time("refresh"):
+                        refresh_browser(custom=self.custom)
+            stopwatch.set("python_change", is_python_change)
+            stopwatch.set("custom", self.custom)
+            stopwatch.set("total", round(time.time() - event_time, 3))
+            record_reload(app, stopwatch.timings, event_time=event_time)
 
         else:
             click.echo(f"Change to {event.src_path} ignored")
@@ -76,50 +93,170 @@ class WatchHandler(FileSystemEventHandler):
         click.echo("Waiting for changes...")
 
 
-def _intersperse(el, l):
-    return [y for x in zip([el] * len(l), l) for y in x]
+def _event_delay(src_path, event_time):
+    """Seconds between the file being saved and the watcher handling it."""
+    try:
+        return round(max(event_time - os.path.getmtime(src_path), 0), 3)
+    except OSError:
+        return None
 
 
-def docker_compose(args, env=None, ganesha=False, custom=False, arch=None, emulate=False):
-    # Since our docker-compose.selfserve.yml file is the first one we pass,
-    # we need to pass `--project-name` and `--project-directory`.
-    log = toplog.bind(function="docker-compose")
-    log.info(f"Running docker-compose with {args}")
-    compose_files = []
+def compose_files(ganesha=False, custom=False, arch=None, emulate=False):
+    """The compose files of an environment, in the order they're merged."""
+    files = []
     if ganesha:
-        compose_files.append("docker-compose.ganesha.yml")
+        files.append("docker-compose.ganesha.yml")
     if arch == "x86_64":
-        compose_files = ["common-services.yml"]
+        files = ["common-services.yml"]
         if custom:
-            compose_files.append("docker-compose.custom.yml")
+            files.append("docker-compose.custom.yml")
         else:
-            compose_files.append("docker-compose.selfserve.yml")
+            files.append("docker-compose.selfserve.yml")
     elif arch in ["arm", "i386"]:
-        compose_files = ["common-services.arm.yml", "docker-compose.arm.yml"]
+        files = ["common-services.arm.yml", "docker-compose.arm.yml"]
         if custom:
-            compose_files.remove("docker-compose.arm.yml")
-            compose_files.append("docker-compose.arm.custom.yml")
+            files.remove("docker-compose.arm.yml")
+            files.append("docker-compose.arm.custom.yml")
         if emulate and not custom:
-            compose_files.remove("docker-compose.arm.yml")
-            compose_files.append("docker-compose.selfserve.yml")
-
+            files.remove("docker-compose.arm.yml")
+            files.append("docker-compose.selfserve.yml")
 
-    compose_files.extend(glob("docker-compose-*.yml"))
-    if "docker-compose-ssh.yml" in compose_files and 'stop' in args:
-        compose_files.remove("docker-compose-ssh.yml")
+    # docker-compose-ssh.yml was written by older versions of jb, the tunnel
+    # hosts are passed as an overlay now
+    files.extend(f for f in glob("docker-compose-*.yml") if f != LEGACY_SSH_FILE)
     if ganesha:
-        compose_files.append("docker-compose.ganesha.yml")
-    file_args = _intersperse("-f", compose_files)
-    log.info(f"Running docker-compose with {file_args} files")
-    env_name = os.path.basename(os.path.abspath("."))
-    cmd = ["docker-compose", "--project-directory", ".", "--project-name", env_name]
-    return check_call(cmd + file_args + args, env=env)
+        files.append("docker-compose.ganesha.yml")
+    return files
+
+
+def docker_compose(args, env=None, ganesha=False, custom=False, arch=None, emulate=False,
+                   overlays=None, backend=None):
+    """Run a compose command on the merged configuration of an environment.
+
+    :param overlays: Extra compose configuration merged over the files
+    :type overlays: list of dict
+    :param backend: The compose backend to use, see `composebackend.select`
+    :type backend: str
+    """
+    # Since the merged file doesn't live in devlandia, we need to pass
+    # `--project-name` and `--project-directory`.
+    log = toplog.bind(function="docker-compose")
+    log.info(f"Running docker-compose with {args}")
+    files = compose_files(ganesha=ganesha, custom=custom, arch=arch, emulate=emulate)
+    log.info(f"Running docker-compose with {files} files")
+    merged = compose.merged_config_file(files, overlays=overlays)
+    env_name = project_name()
+    runner = composebackend.select(args[0], name=backend, client=client)
+    if isinstance(runner, composebackend.NativeBackend):
+        if runner.run(args, merged, env_name):
+            return
+        runner = runner.fallback
+    return check_call(runner.command_line(args, merged, env_name), env=env)
+
+
+def project_name():
+    """The docker-compose project name, the name of the current directory."""
+    return os.path.basename(os.path.abspath("."))
+
+
+HOST_IP_KEY = "host_ip"
+# Cached host addresses are rechecked once a day
+HOST_IP_TTL = 24 * 60 * 60
+# Only used when the Docker API can't tell us the host address
+HOST_LOOKUP_IMAGE = "busybox:stable"
+
+
+def docker_context():
+    """Identify the Docker engine jb talks to, host addresses differ per engine."""
+    if os.environ.get("DOCKER_HOST"):
+        return os.environ["DOCKER_HOST"]
+    if os.environ.get("DOCKER_CONTEXT"):
+        return os.environ["DOCKER_CONTEXT"]
+    config_dir = os.environ.get("DOCKER_CONFIG", os.path.expanduser("~/.docker"))
+    try:
+        with open(os.path.join(config_dir, "config.json")) as f:
+            return json.load(f).get("currentContext") or "default"
+    except (OSError, ValueError):
+        return "default"
+
 
+def _gateway_ip(project=None):
+    """The gateway of the compose network (or the default bridge), which is
+    the host's address on that network.
 
-def up(env=None, ganesha=False, arch=None, custom=False, emulate=False):
+    The devlandia services only join ``juice_net``. Before the first ``up``
+    that network doesn't exist yet and the default bridge is used, its
+    gateway is the host as well.
+
+    Docker Desktop and rootless Docker run the engine in a VM or namespace,
+    where the gateway isn't the host, so they return None.
+    """
+    info = client.info()
+    if "Docker Desktop" in info.get("OperatingSystem", ""):
+        return None
+    if any("rootless" in option for option in info.get("SecurityOptions") or []):
+        return None
+    names = [f"{composebackend.normalize_project(project)}_juice_net"] if project else []
+    for name in names + ["bridge"]:
+        try:
+            network = client.networks.get(name)
+        except docker.errors.NotFound:
+            continue
+        for config in (network.attrs.get("IPAM") or {}).get("Config") or []:
+            gateway = config.get("Gateway", "")
+            if gateway and ":" not in gateway:
+                return gateway.split("/")[0]
+    return None
+
+
+def _container_host_ip():
+    """Ask a throwaway container what host.docker.internal is."""
+    out = client.containers.run(
+        HOST_LOOKUP_IMAGE, "cat /etc/hosts", remove=True,
+        extra_hosts={"host.docker.internal": "host-gateway"},
+    )
+    # The line looks like
+    #   192.168.65.254    host.docker.internal
+    for line in out.decode("ascii").splitlines():
+        fields = line.split()
+        if "host.docker.internal" in fields[1:]:
+            return fields[0]
+    raise RuntimeError("Could not find the address of the Docker host")
+
+
+def get_host_ip(project=None, refresh=False):
+    """The address containers use to reach services on the host.
+
+    The address is cached per Docker context. Otherwise it comes from the
+    network gateways known to the Docker API, and only if those can't be
+    used from a tiny container.
+
+    :param project: The docker-compose project whose network to look at
+    :type project: str
+    :param refresh: Ignore the cached address
+    :type refresh: bool
+    :rtype: ``str``
+    """
+    context = docker_context()
+    cache = stash.get(HOST_IP_KEY, {}) or {}
+    entry = cache.get(context)
+    if entry and not refresh and time.time() - entry.get("checked_at", 0) < HOST_IP_TTL:
+        return entry["ip"]
+
+    ip = _gateway_ip(project)
+    if ip is None:
+        echo_warning("Looking up the Docker host address with a container, this happens once a day.")
+        ip = _container_host_ip()
+    cache[context] = {"ip": ip, "checked_at": time.time()}
+    stash.put(HOST_IP_KEY, cache)
+    return ip
+
+
+def up(env=None, ganesha=False, arch=None, custom=False, emulate=False, overlays=None):
     """Starts and optionally creates a Docker environment based on
     docker-compose.yml"""
-    docker_compose(["up"], env=env, ganesha=ganesha, arch=arch, custom=custom, emulate=emulate)
+    docker_compose(["up"], env=env, ganesha=ganesha, arch=arch, custom=custom, emulate=emulate,
+                   overlays=overlays)
 
 
 def run_jb(cmd, env=None, service="juicebox"):
@@ -132,9 +269,29 @@ def destroy(arch=None, custom=False, ganesha=False):
     docker_compose(["down"], arch=arch, custom=custom, ganesha=ganesha)
 
 
-def halt(arch=None, custom=False):
+def halt(arch=None, custom=False, backend=None):
     """Halts all containers defined in docker-compose file."""
-    docker_compose(["stop"], custom=custom, arch=arch)
+    docker_compose(["stop"], custom=custom, arch=arch, backend=backend)
+
+
+def stop_project(fast=False):
+    """Stop every running container of the project at once.
+
+    Containers are found by their compose labels, so services shared by
+    selfserve and custom are only stopped once and nothing that's already
+    stopped is touched.
+
+    :param fast: Kill the containers that are safe to kill
+    :type fast: bool
+    :rtype: list of `composebackend.StopResult`
+    """
+    backend = composebackend.NativeBackend(client, None)
+    return backend.stop(backend.running(project_name()), fast=fast)
+
+
+def resume(arch=None, custom=False, backend=None):
+    """Starts the stopped containers defined in docker-compose file."""
+    docker_compose(["start"], custom=custom, arch=arch, backend=backend)
 
 
 def is_running():
@@ -409,16 +566,19 @@ def get_state(container_name):
     return client.containers.get(container_name).status
 
 
-def jb_watch(app="", should_reload=False, custom=False):
-    """Run the Juicebox project watcher"""
+def jb_watch(app="", should_reload=False, custom=False, includejs=False):
+    """Run the Juicebox project watcher
+
+    :param includejs: Also run the webpack watcher, in a thread of this process
+    :type includejs: bool
+    """
     running = is_running()
-    if custom and running[0] and ensure_home():
-        handle_event(should_reload, custom, app)
-    elif not custom and running[1] and ensure_home():
-        handle_event(should_reload, custom, app)
-    else:
+    if not running[0 if custom else 1] or not ensure_home():
         echo_warning("Failed to start project watcher.")
         click.get_current_context().abort()
+    if includejs:
+        js_watch(custom=custom)
+    handle_event(should_reload, custom, app)
 
 
 def handle_event(should_reload, custom, app):
@@ -441,12 +601,29 @@ def observer_setup(event_handler, app, custom=False):
     observer.join()
 
 
+def juicebox_container(custom=False):
+    """The running Juicebox container of the project, or None."""
+    service = "juicebox_custom" if custom else "juicebox_selfserve"
+    containers = client.containers.list(filters={"label": [
+        f"{composebackend.PROJECT_LABEL}={project_name()}",
+        f"{composebackend.SERVICE_LABEL}={service}",
+    ]})
+    return containers[0] if containers else None
+
+
 def js_watch(custom=False):
-    running = is_running()
-    if running[0] and custom and ensure_home():
-        run("./node_modules/.bin/webpack --mode=development --progress --colors --watch", env='custom')
-    elif running[1] and not custom and ensure_home():
-        run("./node_modules/.bin/webpack --mode=development --progress --colors --watch", env='selfserve')
+    """Start the webpack watcher in the running Juicebox container.
+
+    :rtype: `jswatch.JSWatcher`
+    """
+    container = juicebox_container(custom)
+    if container is None:
+        echo_warning("Failed to start the JS watcher, Juicebox is not running.")
+        return None
+    watcher = jswatch.JSWatcher(container, custom=custom)
+    watcher.start()
+    return watcher
+
 
 def list_local():
     return check_output(["docker", "image", "list"])
@@ -0,0 +1,177 @@
+"""The ``jb start --ephemeral`` profile for throwaway sessions.
+
+Postgres keeps its data on a tmpfs with ``fsync``, ``synchronous_commit``
+and ``full_page_writes`` off, and redis doesn't persist anything. Postgres
+is pointed at a new ``PGDATA`` on the tmpfs instead of mounting the tmpfs
+over its data volume, so the durable databases stay untouched and come
+back on the next plain ``jb start``.
+
+Everything loaded in ephemeral mode is lost when postgres stops, so the app
+manifest of the durable databases is put aside while ephemeral mode is
+active. Startup (which runs the migrations) and app load times are
+recorded for both modes so jb can show what ephemeral mode saves.
+"""
+import threading
+import time
+from statistics import median
+
+import requests
+
+from .manifest import IMAGE_KEY, MANIFEST_KEY
+from .storageutil import stash as default_stash
+
+__all__ = ['overlay', 'is_active', 'switch', 'record_load', 'record_startup',
+           'load_speedup', 'startup_speedup', 'describe', 'time_startup']
+
+STASH_KEY = 'ephemeral'
+PGDATA_TMPFS = '/var/lib/postgresql/ephemeral'
+# How many startup times to keep for each mode
+KEEP = 10
+STARTUP_TIMEOUT = 15 * 60
+
+
+def overlay():
+    """The compose configuration of ephemeral mode."""
+    return {
+        'services': {
+            'postgres': {
+                'tmpfs': [PGDATA_TMPFS],
+                'environment': [f'PGDATA={PGDATA_TMPFS}/data'],
+                'command': ['postgres', '-c', 'fsync=off', '-c', 'synchronous_commit=off',
+                            '-c', 'full_page_writes=off'],
+            },
+            'redis': {
+                'command': ['redis-server', '--save', '', '--appendonly', 'no'],
+            },
+        },
+    }
+
+
+def _state(stash):
+    return stash.get(STASH_KEY, {}) or {}
+
+
+def _mode(ephemeral):
+    return 'ephemeral' if ephemeral else 'durable'
+
+
+def is_active(stash=None):
+    """Whether Juicebox was last started with ``--ephemeral``."""
+    return bool(_state(stash or default_stash).get('active'))
+
+
+def _without_apps(manifest):
+    return {
+        env: {key: entry for key, entry in entries.items() if key == IMAGE_KEY}
+        for env, entries in manifest.items()
+    }
+
+
+def switch(ephemeral, stash=None):
+    """Set up the app manifest for a start in ephemeral or durable mode.
+
+    Ephemeral databases always start empty. The durable manifest is kept
+    aside until the next durable start.
+    """
+    stash = stash or default_stash
+    state = _state(stash)
+    manifest = stash.get(MANIFEST_KEY, {}) or {}
+    if ephemeral:
+        if not state.get('active'):
+            state['manifest'] = manifest
+        stash.put(MANIFEST_KEY, _without_apps(manifest))
+    elif state.get('active'):
+        stash.put(MANIFEST_KEY, state.pop('manifest', {}) or {})
+    state['active'] = ephemeral
+    stash.put(STASH_KEY, state)
+
+
+def record_load(app, seconds, stash=None):
+    """Remember how long `app` took to load in the current mode."""
+    stash = stash or default_stash
+    state = _state(stash)
+    loads = state.setdefault('loads', {}).setdefault(app, {})
+    loads[_mode(state.get('active'))] = round(seconds, 3)
+    stash.put(STASH_KEY, state)
+
+
+def record_startup(seconds, ephemeral, stash=None):
+    """Remember how long Juicebox took to start in a mode."""
+    stash = stash or default_stash
+    state = _state(stash)
+    startups = state.setdefault('startup', {}).setdefault(_mode(ephemeral), [])
+    startups.append(round(seconds, 3))
+    state['startup'][_mode(ephemeral)] = startups[-KEEP:]
+    stash.put(STASH_KEY, state)
+
+
+def load_speedup(stash=None):
+    """Compare the loads of the apps loaded in both modes.
+
+    :returns: ``(durable seconds, ephemeral seconds)`` summed over those
+        apps, or None when no app was loaded in both modes
+    """
+    loads = _state(stash or default_stash).get('loads', {})
+    both = [times for times in loads.values() if 'durable' in times and 'ephemeral' in times]
+    if not both:
+        return None
+    return sum(t['durable'] for t in both), sum(t['ephemeral'] for t in both)
+
+
+def startup_speedup(stash=None):
+    """Compare the median startup times of both modes.
+
+    :returns: ``(durable seconds, ephemeral seconds)`` or None
+    """
+    startup = _state(stash or default_stash).get('startup', {})
+    if not startup.get('durable') or not startup.get('ephemeral'):
+        return None
+    return median(startup['durable']), median(startup['ephemeral'])
+
+
+def describe(what, speedup):
+    """Say how much faster `what` is in ephemeral mode."""
+    if speedup is None:
+        return None
+    durable, ephemeral = speedup
+    if not ephemeral:
+        return None
+    return (f"{what} {durable / ephemeral:.1f}x faster in ephemeral mode "
+            f"({ephemeral:.1f}s instead of {durable:.1f}s).")
+
+
+def time_startup(url, ephemeral, on_ready=None, stash=None, timeout=STARTUP_TIMEOUT):
+    """Time how long Juicebox takes to answer at `url` in a daemon thread.
+
+    Juicebox runs its migrations before it starts serving, so this is what
+    a start costs. Call it before starting the containers. When something
+    already answers at `url` there's no start to time and nothing is
+    recorded.
+
+    :param on_ready: Called with the seconds it took
+    :returns: The timer thread, or None when `url` already answers
+    """
+    try:
+        requests.get(url, timeout=2)
+    except requests.RequestException:
+        pass
+    else:
+        return None
+    began = time.monotonic()
+
+    def _wait():
+        while time.monotonic() - began < timeout:
+            try:
+                requests.get(url, timeout=5)
+            except requests.RequestException:
+                time.sleep(1)
+                continue
+            seconds = time.monotonic() - began
+            record_startup(seconds, ephemeral, stash=stash)
+            if on_ready is not None:
+                on_ready(seconds)
+            return
+
+    thread = threading.Thread(target=_wait, name='jb-startup-timer', daemon=True)
+    thread.start()
+    return thread
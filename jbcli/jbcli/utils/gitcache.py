@@ -0,0 +1,167 @@
+"""Keeps bare mirrors of app repositories so re-adding an app is local.
+
+Mirrors live in ``<GIT_CACHE_DIR>/mirrors/<app>.git``. Cloning from a local
+path hardlinks the git objects, so a checkout made from a mirror costs
+almost no extra disk and only the commits GitHub has that the mirror
+doesn't are downloaded.
+"""
+import logging
+import os
+import re
+import shutil
+import time
+
+import click
+
+from .. import conf
+from .format import echo_warning
+from .subprocess import check_output, CalledProcessError
+
+__all__ = ['mirror_path', 'update_mirror', 'list_mirrors', 'prune', 'parse_size']
+
+LOG = logging.getLogger(__name__)
+
+# Touched every time a mirror is used, for least recently used pruning
+LAST_USED_FILE = 'jb-last-used'
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def mirrors_dir():
+    return os.path.join(conf.GIT_CACHE_DIR, 'mirrors')
+
+
+def mirror_path(app):
+    """The path of the bare mirror of an app.
+
+    :param app: The Juicebox packaged application name
+    :type app: str
+    """
+    return os.path.join(mirrors_dir(), f'{app}.git')
+
+
+def _touch(mirror):
+    with open(os.path.join(mirror, LAST_USED_FILE), 'w') as f:
+        f.write(str(time.time()))
+
+
+def _init_mirror(mirror, repo_url):
+    """Create an empty mirror that tracks the branches and tags of `repo_url`.
+
+    Unlike ``git clone --mirror`` this leaves out the pull request refs
+    Github publishes, which can be larger than the branches themselves.
+    """
+    os.makedirs(mirrors_dir(), exist_ok=True)
+    check_output(['git', 'init', '--quiet', '--bare', mirror])
+    check_output(['git', '-C', mirror, 'remote', 'add', 'origin', repo_url])
+    check_output(['git', '-C', mirror, 'config', 'remote.origin.fetch',
+                  '+refs/heads/*:refs/heads/*'])
+    check_output(['git', '-C', mirror, 'config', '--add', 'remote.origin.fetch',
+                  '+refs/tags/*:refs/tags/*'])
+    # Clones from the mirror check out the default branch of the repo
+    head = check_output(['git', 'ls-remote', '--symref', repo_url, 'HEAD'])
+    match = re.search(r'^ref: (refs/heads/\S+)\s+HEAD', head.decode('utf-8'), re.M)
+    if match:
+        check_output(['git', '-C', mirror, 'symbolic-ref', 'HEAD', match.group(1)])
+
+
+def update_mirror(app, repo_url):
+    """Create or refresh the mirror of an app.
+
+    An existing mirror only fetches what changed on GitHub. Returns the
+    mirror path, or None if the mirror couldn't be brought up to date, in
+    which case the caller should clone from GitHub directly.
+
+    :param app: The Juicebox packaged application name
+    :type app: str
+    :param repo_url: The url of the application's repository
+    :type repo_url: str
+    """
+    mirror = mirror_path(app)
+    created = not os.path.isdir(mirror)
+    try:
+        if created:
+            click.echo(f'Creating a local mirror of {app}')
+            _init_mirror(mirror, repo_url)
+        else:
+            click.echo(f'Fetching changes for {app} into the local mirror')
+            check_output(['git', '-C', mirror, 'remote', 'set-url', 'origin', repo_url])
+        check_output(['git', '-C', mirror, 'fetch', '--quiet', '--prune', 'origin'])
+        _touch(mirror)
+    except (CalledProcessError, OSError) as exc_info:
+        LOG.error(str(exc_info))
+        if created:
+            shutil.rmtree(mirror, ignore_errors=True)
+        echo_warning(f'Could not update the local mirror of {app}, cloning from Github.')
+        return None
+    return mirror
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def _last_used(mirror):
+    marker = os.path.join(mirror, LAST_USED_FILE)
+    try:
+        return os.path.getmtime(marker)
+    except OSError:
+        return os.path.getmtime(mirror)
+
+
+def list_mirrors():
+    """List the mirrors as (app, path, size in bytes, last used) tuples,
+    most recently used first.
+    """
+    try:
+        names = os.listdir(mirrors_dir())
+    except OSError:
+        return []
+    mirrors = []
+    for name in names:
+        path = os.path.join(mirrors_dir(), name)
+        if not name.endswith('.git') or not os.path.isdir(path):
+            continue
+        mirrors.append((name[:-len('.git')], path, _dir_size(path), _last_used(path)))
+    mirrors.sort(key=lambda m: m[3], reverse=True)
+    return mirrors
+
+
+def parse_size(value):
+    """Parse sizes like ``500M`` or ``2G`` into bytes.
+
+    :rtype: ``int``
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', str(value), re.I)
+    if not match:
+        raise ValueError(f'Invalid size: {value}')
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def prune(max_size, dry_run=False):
+    """Delete the least recently used mirrors until they fit in `max_size`.
+
+    :param max_size: The disk space the mirrors may use, in bytes
+    :type max_size: int
+    :returns: The (app, path, size, last used) tuples that were removed
+    :rtype: ``list``
+    """
+    mirrors = list_mirrors()
+    total = sum(m[2] for m in mirrors)
+    removed = []
+    # Oldest first
+    for mirror in reversed(mirrors):
+        if total <= max_size:
+            break
+        if not dry_run:
+            shutil.rmtree(mirror[1], ignore_errors=True)
+        total -= mirror[2]
+        removed.append(mirror)
+    return removed
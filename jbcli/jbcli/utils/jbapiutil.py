@@ -1,7 +1,11 @@
+import contextlib
 import os
+import re
 import time
 
+import click
 from requests import post, ConnectionError
+from tabulate import tabulate
 
 from .format import *
 from .storageutil import stash
@@ -10,6 +14,15 @@ SERVER = None
 JB_ADMIN_USER = os.environ.get("JB_ADMIN_USER", "chris@juice.com")
 JB_ADMIN_PASSWORD = os.environ.get("JB_ADMIN_PASSWORD", "cremacuban0!")
 
+# Log entries describe the object they touched like "free-form for Basketball (Slice)"
+OBJECT_TYPE_RE = re.compile(r"\((\w+)\)\s*$")
+
+# Keys the server may use to report how long an object took to load
+TIMING_KEYS = ("duration", "elapsed", "duration_ms", "elapsed_ms")
+
+# How many of the slowest objects to show in the summary
+SLOWEST_COUNT = 10
+
 
 def get_admin_token(refresh_token=False, custom=False):
     """Get an admin user token. """
@@ -34,6 +47,16 @@ def get_admin_token(refresh_token=False, custom=False):
         return None
 
 
+def _format_log(log):
+    log = dict(log)
+    level = log.pop('level', 'unknown')
+    event = log.pop('event', 'unknown')
+    content = u'{:10s}{}\n\n'.format(f'[{level}]', event)
+    for k in sorted(log.keys()):
+        content += u'{:>20}: {}\n'.format(k, log[k])
+    return level, content
+
+
 def echo_result(result):
     """Format results like
 
@@ -50,21 +73,135 @@ def echo_result(result):
     """
     logs = result.get('details', {}).get('logs', [])
     for log in logs:
-        level = log.pop('level', 'unknown')
-        event = log.pop('event', 'unknown')
-        content = u'{:10s}{}\n\n'.format(f'[{level}]', event)
-        for k in sorted(log.keys()):
-            content += u'{:>20}: {}\n'.format(k, log[k])
+        level, content = _format_log(log)
         if level in ('error', 'warning'):
             echo_warning(content)
         else:
             echo_success(content)
 
 
-def load_app(app, refresh_token=False, custom=False):
-    """Attempt to load an app using jb API. If successful return True. """
+def _log_action(event):
+    event = event.lower()
+    if 'unchanged' in event:
+        return 'unchanged'
+    if 'created' in event or event.startswith('creat'):
+        return 'created'
+    if 'changed' in event or 'updated' in event:
+        return 'changed'
+    return 'other'
+
+
+def _log_duration(log):
+    for key in TIMING_KEYS:
+        value = log.get(key)
+        if isinstance(value, (int, float)):
+            return value / 1000.0 if key.endswith('_ms') else value
+    return None
+
+
+def parse_result(result):
+    """Aggregate the logs of an app load into a structured report.
+
+    The report counts created, changed, unchanged and other log entries per
+    object type, lists every object the server reported a timing for
+    (slowest first), and keeps the warning and error entries intact.
+
+    :param result: The JSON body returned by the app load API
+    :type result: dict
+    :rtype: ``dict``
+    """
+    objects = {}
+    timings = []
+    problems = []
+    logs = result.get('details', {}).get('logs', [])
+    for log in logs:
+        instance = str(log.get('instance', ''))
+        match = OBJECT_TYPE_RE.search(instance)
+        object_type = match.group(1) if match else 'Other'
+        action = _log_action(str(log.get('event', '')))
+        counts = objects.setdefault(
+            object_type,
+            {'created': 0, 'changed': 0, 'unchanged': 0, 'other': 0})
+        counts[action] += 1
+
+        duration = _log_duration(log)
+        if duration is not None:
+            timings.append({
+                'type': object_type,
+                'instance': instance,
+                'event': log.get('event'),
+                'duration': duration,
+            })
+        if log.get('level') in ('error', 'warning'):
+            problems.append(log)
+
+    timings.sort(key=lambda t: t['duration'], reverse=True)
+    return {
+        'objects': objects,
+        'timings': timings,
+        'problems': problems,
+        'total': len(logs),
+    }
+
+
+def echo_report(report):
+    """Print a compact summary of a report built by `parse_result`."""
+    rows = [
+        [object_type, c['created'], c['changed'], c['unchanged'], c['other']]
+        for object_type, c in sorted(report['objects'].items())
+    ]
+    if rows:
+        click.echo(tabulate(
+            rows, headers=['Type', 'Created', 'Changed', 'Unchanged', 'Other']))
+    if report['timings']:
+        click.echo()
+        echo_highlight('Slowest objects:')
+        click.echo(tabulate(
+            [[t['type'], t['instance'], t['duration']]
+             for t in report['timings'][:SLOWEST_COUNT]],
+            headers=['Type', 'Instance', 'Seconds'],
+            floatfmt='.3f'))
+    for log in report['problems']:
+        echo_warning(_format_log(log)[1])
+
+
+def _echo_load_result(result, output):
+    report = parse_result(result)
+    if output == 'logs':
+        echo_result(result)
+    elif output == 'summary':
+        echo_report(report)
+    return report
+
+
+def _record_report(stopwatch, report, report_out, app, status_code):
+    if stopwatch is not None:
+        stopwatch.set("stacks", sum(report['objects'].get("Stack", {}).values()))
+        stopwatch.set("slices", sum(report['objects'].get("Slice", {}).values()))
+    if report_out is not None:
+        report_out.update(report, app=app, status=status_code)
+
+
+def _timed(stopwatch, name):
+    if stopwatch is None:
+        return contextlib.nullcontext()
+    return stopwatch.time(name)
+
+
+def load_app(app, refresh_token=False, custom=False, stopwatch=None,
+             output="summary", report=None):
+    """Attempt to load an app using jb API. If successful return True.
+
+    :param stopwatch: Optional `reloadstats.Stopwatch` that collects the token
+        and server load times and the number of stacks and slices loaded.
+    :param output: How to print the load logs, ``summary`` for counts per
+        object type, ``logs`` for every log entry or ``none``.
+    :param report: Optional dict that is filled with the report built by
+        `parse_result`.
+    """
     SERVER = "http://localhost:8001" if custom else "http://localhost:8000"
-    admin_token = get_admin_token(refresh_token, custom=custom)
+    with _timed(stopwatch, "token"):
+        admin_token = get_admin_token(refresh_token, custom=custom)
     if admin_token:
         url = "{SERVER}/api/v1/app/load/{APP}/".format(SERVER=SERVER, APP=app)
         headers = {
@@ -74,7 +211,8 @@ def load_app(app, refresh_token=False, custom=False):
         retry_cnt = 0
         while retry_cnt < 5:
             try:
-                response = post(url, headers=headers)
+                with _timed(stopwatch, "load"):
+                    response = post(url, headers=headers)
             except ConnectionError:
                 echo_warning(f'Can not connect, retrying. {url}')
                 # Retry with backoffs of 1,2,4,8 seconds
@@ -86,7 +224,8 @@ def load_app(app, refresh_token=False, custom=False):
         if response.status_code == 200:
             result = response.json()
             echo_success(f"{app} was added successfully via API.")
-            echo_result(result)
+            _record_report(stopwatch, _echo_load_result(result, output), report,
+                           app, response.status_code)
             return True
         if response.status_code == 204:
             echo_success(f"{app} was added successfully via API.")
@@ -94,11 +233,13 @@ def load_app(app, refresh_token=False, custom=False):
             return True
         elif response.status_code == 401:
             echo_warning('Token is expired')
-            return load_app(app, refresh_token=True, custom=custom)
+            return load_app(app, refresh_token=True, custom=custom, stopwatch=stopwatch,
+                            output=output, report=report)
         else:
             result = response.json()
             echo_warning(f"Loading app status code was {response.status_code}")
-            echo_result(result)
+            _record_report(stopwatch, _echo_load_result(result, output), report,
+                           app, response.status_code)
             return False
     else:
         echo_warning("Could not get admin token.")
@@ -0,0 +1,113 @@
+"""Runs ``webpack --watch`` in the Juicebox container for ``jb watch --includejs``.
+
+The watcher is a thread of the jb process, so it shares the Docker client
+and the running check with the app watcher. Webpack caches its work in the
+``webpack_cache`` volume mounted at ``/webpack-cache``, so only the first
+build after the volume is created is cold:
+
+* webpack 5 gets ``--cache-type filesystem`` pointed at the volume.
+* For webpack 4 ``CACHE_DIR`` points the loaders and plugins that cache
+  through ``find-cache-dir`` (babel-loader, terser, cache-loader) at it.
+
+Every build is timed from webpack's own stats and recorded with the app
+reloads, so ``jb watch --stats`` shows it as ``webpack``.
+"""
+import re
+import threading
+
+import click
+
+from .format import echo_success, echo_warning
+from .reloadstats import record_reload
+
+__all__ = ['webpack_command', 'build_seconds', 'JSWatcher']
+
+WEBPACK = './node_modules/.bin/webpack'
+CACHE_DIR = '/webpack-cache'
+STATS_NAME = 'webpack'
+
+# "Time: 2345ms" in webpack 4 stats, "compiled successfully in 2345 ms" or
+# "compiled with 2 warnings in 1.2 s" in webpack 5
+TIME_RES = (
+    re.compile(r'^\s*Time:\s*(\d+)\s*ms'),
+    re.compile(r'\bcompiled\b.*\bin\s+([\d.]+)\s*(ms|s)\b'),
+)
+# Terminal colors in the webpack output
+ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def webpack_command(major_version):
+    """The webpack watch command for webpack `major_version`.
+
+    :type major_version: int
+    :rtype: ``list``
+    """
+    command = [WEBPACK, '--mode=development', '--watch']
+    if major_version >= 5:
+        command += ['--color', '--cache-type', 'filesystem', '--cache-cache-directory', CACHE_DIR]
+    else:
+        command += ['--colors']
+    return command
+
+
+def build_seconds(line):
+    """How long the build took when `line` is webpack's build summary.
+
+    :rtype: ``float`` or None
+    """
+    line = ANSI_RE.sub('', line)
+    for time_re in TIME_RES:
+        match = time_re.search(line)
+        if match:
+            seconds = float(match.group(1))
+            unit = match.group(2) if match.lastindex > 1 else 'ms'
+            return round(seconds / 1000 if unit == 'ms' else seconds, 3)
+    return None
+
+
+class JSWatcher(threading.Thread):
+    """Streams ``webpack --watch`` from `container` and times every build.
+
+    :param container: The running Juicebox container
+    :param custom: Whether it's Juicebox Custom
+    :type custom: bool
+    """
+
+    def __init__(self, container, custom=False):
+        super(JSWatcher, self).__init__(name='jb-js-watch', daemon=True)
+        self.container = container
+        self.custom = custom
+        self.builds = []
+
+    def webpack_version(self):
+        exit_code, output = self.container.exec_run([WEBPACK, '--version'])
+        match = re.search(rb'(\d+)\.\d+\.\d+', output or b'')
+        if exit_code != 0 or not match:
+            return 4
+        return int(match.group(1))
+
+    def run(self):
+        command = webpack_command(self.webpack_version())
+        click.echo(f"Running {' '.join(command)}")
+        _, stream = self.container.exec_run(
+            command, stream=True, environment={'CACHE_DIR': CACHE_DIR})
+        pending = ''
+        for chunk in stream:
+            pending += chunk.decode('utf-8', 'replace')
+            *lines, pending = pending.split('\n')
+            for line in lines:
+                self.handle_line(line)
+        if pending:
+            self.handle_line(pending)
+        echo_warning('The JS watcher stopped.')
+
+    def handle_line(self, line):
+        click.echo(line)
+        seconds = build_seconds(line)
+        if seconds is None:
+            return
+        self.builds.append(seconds)
+        kind = 'JS build' if len(self.builds) == 1 else 'JS rebuild'
+        echo_success(f'{kind} took {seconds:.2f}s.')
+        record_reload(STATS_NAME, {'total': seconds, 'build': len(self.builds),
+                                   'custom': self.custom})
@@ -0,0 +1,187 @@
+"""Streams the logs of the devlandia containers for ``jb logs``.
+
+Every container is read by its own thread through the Docker API, with
+timestamps. The threads parse and filter the lines as they arrive, so a
+chatty container (``JB_DEBUG_LOGGING=on``) only costs its own thread. The
+lines are merged by timestamp: they're held back for `MERGE_WINDOW`
+seconds, long enough for the other containers' lines of the same moment
+to arrive, and written in batches.
+"""
+import heapq
+import itertools
+import queue
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from .composebackend import service_containers
+
+__all__ = ['LogLine', 'LogFilter', 'LogStream', 'parse_since', 'parse_timestamp',
+           'level_of']
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+LEVEL_RE = re.compile(r'\b(DEBUG|INFO|WARN|WARNING|ERROR|CRITICAL|FATAL)\b')
+LEVEL_ALIASES = {'WARN': 'WARNING', 'FATAL': 'CRITICAL'}
+DURATION_RE = re.compile(r'^(\d+)\s*([smhd])$')
+DURATION_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
+# Seconds lines are held back so the lines of all containers come out in order
+MERGE_WINDOW = 0.25
+# Lines of history per container when there's no --since
+DEFAULT_TAIL = 100
+# The most lines taken off the queue at once
+MAX_BATCH = 5000
+
+LogLine = namedtuple('LogLine', ['time', 'service', 'text'])
+
+
+def parse_since(value, now=None):
+    """Turn ``10m``, ``2h``, ``1d`` or an ISO time into a UTC datetime.
+
+    :raises ValueError: When `value` is neither
+    """
+    match = DURATION_RE.match(value.strip())
+    if match:
+        now = now or datetime.now(timezone.utc)
+        return now - timedelta(**{DURATION_UNITS[match.group(2)]: int(match.group(1))})
+    try:
+        since = datetime.fromisoformat(re.sub(r'Z$', '+00:00', value.strip()))
+    except ValueError:
+        raise ValueError(f'Invalid time: {value}, use 10m, 2h, 1d or an ISO time.')
+    if since.tzinfo is None:
+        since = since.astimezone()
+    return since.astimezone(timezone.utc)
+
+
+def parse_timestamp(stamp):
+    """Parse the RFC 3339 UTC times with nanoseconds Docker writes, like
+    ``2024-05-02T10:11:12.123456789Z``.
+    """
+    whole, _, fraction = stamp.rstrip('Z').partition('.')
+    parsed = datetime.strptime(whole, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+    return parsed.replace(microsecond=int((fraction + '000000')[:6]))
+
+
+def level_of(text):
+    """The log level named in `text`, or None."""
+    match = LEVEL_RE.search(text)
+    if not match:
+        return None
+    name = match.group(1)
+    return LEVELS.index(LEVEL_ALIASES.get(name, name))
+
+
+class LogFilter(object):
+    """Decides which lines of one container are shown.
+
+    Lines without a level, like tracebacks, take the level of the line
+    before them.
+
+    :param pattern: A regular expression the lines have to match
+    :param level: The lowest level shown, one of `LEVELS`
+    """
+
+    def __init__(self, pattern=None, level=None):
+        self.pattern = re.compile(pattern) if pattern else None
+        self.level = LEVELS.index(level.upper()) if level else None
+        self.last_level = None
+
+    def __call__(self, text):
+        if self.level is not None:
+            level = level_of(text)
+            if level is None:
+                level = self.last_level
+            self.last_level = level
+            if level is None or level < self.level:
+                return False
+        return not self.pattern or bool(self.pattern.search(text))
+
+
+class LogStream(object):
+    """Merges the logs of the containers of a compose project.
+
+    :param client: The Docker client
+    :param project: The compose project name
+    :param services: Only show these services, all when empty
+    :param since: Only show lines after this UTC datetime
+    :param tail: How many lines of history to show per container
+    :param follow: Keep streaming new lines
+    """
+
+    def __init__(self, client, project, services=(), pattern=None, level=None,
+                 since=None, tail=None, follow=True):
+        self.client = client
+        self.project = project
+        self.services = list(services)
+        self.pattern = pattern
+        self.level = level
+        self.since = since
+        self.tail = tail if tail is not None else ('all' if since else DEFAULT_TAIL)
+        self.follow = follow
+
+    def containers(self):
+        """The containers to read, by service name.
+
+        :raises ValueError: When a requested service has no container
+        """
+        return service_containers(self.client, self.project, self.services)
+
+    def _read(self, service, container, lines):
+        keep = LogFilter(self.pattern, self.level)
+        # docker-py only understands naive datetimes, a timestamp is unambiguous
+        kwargs = {'since': int(self.since.timestamp())} if self.since else {}
+        pending = b''
+        try:
+            for chunk in container.logs(stream=True, follow=self.follow,
+                                        timestamps=True, tail=self.tail, **kwargs):
+                pending += chunk
+                *complete, pending = pending.split(b'\n')
+                for raw in complete:
+                    self._parse(service, raw, keep, lines)
+            if pending:
+                self._parse(service, pending, keep, lines)
+        finally:
+            lines.put(None)
+
+    @staticmethod
+    def _parse(service, raw, keep, lines):
+        stamp, _, text = raw.decode('utf-8', 'replace').rstrip('\r').partition(' ')
+        try:
+            logged = parse_timestamp(stamp)
+        except ValueError:
+            logged, text = datetime.now(timezone.utc), f'{stamp} {text}'
+        if keep(text):
+            lines.put(LogLine(logged, service, text))
+
+    def __iter__(self):
+        """Yield lists of `LogLine` ready to be shown, in time order."""
+        lines = queue.Queue()
+        readers = self.containers()
+        for service, container in readers.items():
+            threading.Thread(target=self._read, args=(service, container, lines),
+                             name=f'jb-logs-{service}', daemon=True).start()
+
+        running = len(readers)
+        held = []
+        order = itertools.count()
+        while running or held:
+            received = []
+            try:
+                if running:
+                    received.append(lines.get(timeout=MERGE_WINDOW / 2))
+                    while len(received) < MAX_BATCH:
+                        received.append(lines.get_nowait())
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            for line in received:
+                if line is None:
+                    running -= 1
+                else:
+                    heapq.heappush(held, (line.time, next(order), now, line))
+            ready = []
+            while held and (not running or held[0][2] + MERGE_WINDOW <= now):
+                ready.append(heapq.heappop(held)[3])
+            if ready:
+                yield ready
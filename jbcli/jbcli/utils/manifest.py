@@ -0,0 +1,152 @@
+"""Keeps track of which version of each app the running Juicebox has loaded.
+
+The manifest lives in the stash, one section per environment (``custom`` or
+``selfserve``)::
+
+    [manifest.custom.cookies]
+    hash = "git:4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+    loaded_at = "2024-05-02T10:11:12"
+    duration = 12.5
+
+App versions are git tree hashes of the working tree when the app is a git
+checkout, so uncommitted changes count, and a hash of the files otherwise.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+from datetime import datetime
+
+from .apps import content_hash
+from .storageutil import stash as default_stash
+
+__all__ = ['Manifest', 'tree_hash']
+
+MANIFEST_KEY = 'manifest'
+# Entries that describe the environment rather than an app
+IMAGE_KEY = '_image'
+
+
+def _git(app_dir, *args, env=None):
+    return subprocess.run(
+        ['git', '-C', app_dir] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, check=True,
+    ).stdout.decode('utf-8').strip()
+
+
+def git_tree_hash(app_dir):
+    """Hash the working tree of a git checkout the way git would.
+
+    The current index is copied to a temporary index so that ``git add``
+    can reuse its stat cache and only rehash files that changed, then the
+    tree is written from it. The real index is never touched. Returns None
+    if `app_dir` is not the top of a git checkout.
+    """
+    try:
+        toplevel = _git(app_dir, 'rev-parse', '--show-toplevel')
+        if os.path.realpath(toplevel) != os.path.realpath(app_dir):
+            return None
+        index = _git(app_dir, 'rev-parse', '--git-path', 'index')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    index = os.path.join(app_dir, index)
+    handle, tmp_index = tempfile.mkstemp(prefix='jb-index-')
+    os.close(handle)
+    try:
+        if os.path.isfile(index):
+            shutil.copyfile(index, tmp_index)
+        else:
+            os.remove(tmp_index)
+        env = dict(os.environ, GIT_INDEX_FILE=tmp_index)
+        _git(app_dir, 'add', '--all', '.', env=env)
+        return _git(app_dir, 'write-tree', env=env)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    finally:
+        if os.path.exists(tmp_index):
+            os.remove(tmp_index)
+
+
+def tree_hash(app_dir):
+    """Identify the current content of an app.
+
+    :param app_dir: The application directory
+    :type app_dir: str
+    :rtype: ``str``
+    """
+    git_hash = git_tree_hash(app_dir)
+    if git_hash:
+        return f'git:{git_hash}'
+    return f'files:{content_hash(app_dir)}'
+
+
+class Manifest(object):
+    """The apps loaded into one Juicebox environment.
+
+    :param env_name: ``custom`` or ``selfserve``
+    :type env_name: str
+    """
+
+    def __init__(self, env_name, stash=None):
+        self.env_name = env_name
+        self.stash = stash or default_stash
+
+    def _all(self):
+        return self.stash.get(MANIFEST_KEY, {}) or {}
+
+    @property
+    def entries(self):
+        return {
+            app: entry for app, entry in self._all().get(self.env_name, {}).items()
+            if app != IMAGE_KEY
+        }
+
+    def _save(self, entries):
+        manifest = self._all()
+        manifest[self.env_name] = entries
+        self.stash.put(MANIFEST_KEY, manifest)
+
+    def get(self, app):
+        return self.entries.get(app)
+
+    def is_current(self, app, app_hash):
+        """Whether `app` was last loaded with exactly this content."""
+        entry = self.get(app)
+        return entry is not None and entry.get('hash') == app_hash
+
+    def duration(self, app, default=None):
+        entry = self.get(app)
+        return entry.get('duration', default) if entry else default
+
+    def record(self, app, app_hash, duration=None):
+        """Remember that `app` was loaded successfully."""
+        entries = self._all().get(self.env_name, {})
+        entries[app] = {
+            'hash': app_hash,
+            'loaded_at': datetime.now().isoformat(timespec='seconds'),
+            'duration': round(duration, 3) if duration is not None else 0,
+        }
+        self._save(entries)
+
+    def forget(self, app=None):
+        """Forget one app, or every app when `app` is None."""
+        entries = self._all().get(self.env_name, {})
+        if app is None:
+            entries = {k: v for k, v in entries.items() if k == IMAGE_KEY}
+        else:
+            entries.pop(app, None)
+        self._save(entries)
+
+    def use_image(self, tag):
+        """Forget every app if the environment now runs a different image.
+
+        A new image can come with migrations or loaders that change how apps
+        are stored, so nothing loaded by the previous image is trusted.
+        """
+        entries = self._all().get(self.env_name, {})
+        previous = entries.get(IMAGE_KEY, {}).get('tag')
+        if previous == tag:
+            return False
+        self._save({IMAGE_KEY: {'tag': tag}})
+        return previous is not None
@@ -0,0 +1,163 @@
+"""Docker volumes that keep pip's work across ``core`` workflow starts.
+
+In the ``core`` workflow Juicebox installs the requirements of the local
+fruition checkout when it starts. Without help every new container does
+that from scratch. jb mounts two volumes to avoid it:
+
+* ``jb-pip-wheels`` is pip's cache, shared by everything, so wheels are
+  downloaded and built once.
+* ``jb-venv-<hash>`` is mounted over ``/venv``. The hash covers the
+  requirements files and the image, so switching fruition branches picks up
+  the virtualenv that was installed for those requirements before. A new
+  volume starts as a copy of the image's ``/venv``, Docker copies it in on
+  first mount.
+
+Once the requirements are installed the volume name is written to
+`VENV_STAMP` in the volume, and later starts with that volume skip pip.
+"""
+import hashlib
+import os
+import time
+
+import docker.errors
+
+from .storageutil import stash as default_stash
+
+__all__ = ['requirements_hash', 'VenvCache']
+
+WHEEL_VOLUME = 'jb-pip-wheels'
+VENV_PREFIX = 'jb-venv-'
+VENV_LABEL = 'com.juiceboxdata.jb.venv'
+PIP_CACHE_DIR = '/pip-cache'
+REQUIREMENTS = ('requirements.txt', 'requirements-arm.txt', 'requirements_dev.txt')
+VENVS_KEY = 'venvs'
+# Holds the name of the volume once the requirements are installed into it
+VENV_STAMP = '/venv/.jb-requirements'
+# How many virtualenvs `VenvCache.prune` keeps by default
+KEEP = 5
+
+
+def requirements_hash(code_dir, image_id):
+    """Identify the virtualenv the requirements of `code_dir` install into
+    `image_id`.
+
+    :param code_dir: The fruition checkout
+    :type code_dir: str
+    :rtype: ``str``
+    """
+    digest = hashlib.sha256(image_id.encode('utf-8'))
+    for name in REQUIREMENTS:
+        path = os.path.join(code_dir, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest.update(f'\0{name}\0{len(content)}\0'.encode('utf-8'))
+        digest.update(content)
+    return digest.hexdigest()[:16]
+
+
+class VenvCache(object):
+    """Creates, mounts and prunes the pip volumes.
+
+    :param client: The Docker client
+    """
+
+    def __init__(self, client, stash=None):
+        self.client = client
+        self.stash = stash or default_stash
+
+    def image_id(self, image):
+        """The id of `image`, or its name when it isn't pulled."""
+        try:
+            return self.client.images.get(image).id
+        except docker.errors.APIError:
+            return image
+
+    def _ensure_volume(self, name, labels):
+        try:
+            self.client.volumes.get(name)
+            return False
+        except docker.errors.NotFound:
+            self.client.volumes.create(name=name, labels=labels)
+            return True
+
+    def ensure(self, code_dir, image):
+        """Make sure the volumes for `code_dir` exist.
+
+        :param image: The Juicebox image the virtualenv comes from
+        :returns: The virtualenv volume name and whether it was just created
+        """
+        key = requirements_hash(code_dir, self.image_id(image) if image else '')
+        name = f'{VENV_PREFIX}{key}'
+        self._ensure_volume(WHEEL_VOLUME, {})
+        created = self._ensure_volume(name, {VENV_LABEL: key})
+        used = self.stash.get(VENVS_KEY, {}) or {}
+        used[name] = time.time()
+        self.stash.put(VENVS_KEY, used)
+        return name, created
+
+    @staticmethod
+    def command(venv_volume, requirements='requirements.txt'):
+        """The Juicebox command that only installs the requirements when
+        `venv_volume` doesn't have them yet.
+
+        :param requirements: The requirements file of the image's architecture
+        """
+        install = ' && '.join(f'/venv/bin/pip install -q -U -r {name}'
+                              for name in (requirements, 'requirements_dev.txt'))
+        return ['bash', '-c', (
+            f"if ! grep -qsx {venv_volume} {VENV_STAMP} ; then "
+            f"echo 'Installing requirements' && {install} "
+            f"&& echo {venv_volume} > {VENV_STAMP} ; fi ; "
+            "if [ '${RECIPE}' = 'recipe' ] ; then "
+            "/venv/bin/pip install -e recipe/ ; fi ; "
+            "/venv/bin/python docker/entrypoint.py"
+        )]
+
+    @classmethod
+    def overlay(cls, service, venv_volume, requirements='requirements.txt'):
+        """The compose configuration that mounts the volumes into `service`
+        and runs `command` instead of the compose file's install steps.
+        """
+        return {
+            'services': {
+                service: {
+                    'command': cls.command(venv_volume, requirements),
+                    'volumes': [f'{WHEEL_VOLUME}:{PIP_CACHE_DIR}', f'{venv_volume}:/venv'],
+                    'environment': [f'PIP_CACHE_DIR={PIP_CACHE_DIR}'],
+                },
+            },
+            'volumes': {
+                WHEEL_VOLUME: {'external': True},
+                venv_volume: {'external': True},
+            },
+        }
+
+    def list(self):
+        """The virtualenv volumes as (name, last used) tuples, most recently
+        used first.
+        """
+        used = self.stash.get(VENVS_KEY, {}) or {}
+        volumes = self.client.volumes.list(filters={'label': VENV_LABEL})
+        venvs = [(volume.name, used.get(volume.name, 0)) for volume in volumes]
+        return sorted(venvs, key=lambda v: v[1], reverse=True)
+
+    def prune(self, keep=KEEP):
+        """Remove all but the `keep` most recently used virtualenvs.
+
+        Volumes a container still uses are left alone.
+
+        :returns: The names of the removed volumes
+        """
+        used = self.stash.get(VENVS_KEY, {}) or {}
+        removed = []
+        for name, _ in self.list()[keep:]:
+            try:
+                self.client.volumes.get(name).remove()
+            except docker.errors.APIError:
+                continue
+            used.pop(name, None)
+            removed.append(name)
+        self.stash.put(VENVS_KEY, used)
+        return removed
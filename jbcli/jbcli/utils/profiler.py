@@ -0,0 +1,137 @@
+"""Profiles the app server in the Juicebox container with py-spy for ``jb profile``.
+
+py-spy runs in a short lived container next to Juicebox: it uses the
+Juicebox image, shares its process namespace and is allowed to ptrace, so
+neither the Juicebox container nor fruition has to change. py-spy is
+installed once into the `PY_SPY_VOLUME` volume. It samples the app server
+master and all its workers and writes a speedscope profile, which is
+copied out of the container and summed up into the hottest frames.
+"""
+import io
+import json
+import tarfile
+from collections import defaultdict, namedtuple
+
+import docker.errors
+import requests
+
+from .appserver import PYTHON, find_server, processes
+
+__all__ = ['Frame', 'Profiler', 'hot_frames']
+
+PY_SPY = 'py-spy==0.3.14'
+PY_SPY_VOLUME = 'jb-' + PY_SPY.replace('==', '-')
+OUTPUT = '/tmp/profile.speedscope.json'
+PROFILE_LABEL = 'com.juiceboxdata.jb.profile'
+DURATION = 30
+RATE = 100
+# Seconds installing py-spy may take the first time
+INSTALL_TIMEOUT = 180
+TOP = 15
+
+Frame = namedtuple('Frame', ['name', 'location', 'own', 'total'])
+
+
+def hot_frames(profile, top=TOP):
+    """The frames the most samples were taken in, of a speedscope profile.
+
+    :param profile: The decoded speedscope JSON
+    :returns: `Frame` with the share of the samples that were taken in the
+        frame itself (`own`) and in it or anything it called (`total`)
+    :rtype: list of `Frame`
+    """
+    own, total = defaultdict(float), defaultdict(float)
+    weight = 0
+    for thread in profile['profiles']:
+        for stack, sample_weight in zip(thread['samples'], thread['weights']):
+            weight += sample_weight
+            if stack:
+                own[stack[-1]] += sample_weight
+            for index in set(stack):
+                total[index] += sample_weight
+    if not weight:
+        return []
+    frames = profile['shared']['frames']
+    hottest = sorted(own, key=lambda index: (-own[index], -total[index]))[:top]
+    return [
+        Frame(frames[index]['name'], f"{frames[index].get('file', '?')}:{frames[index].get('line', '?')}",
+              own[index] / weight, total[index] / weight)
+        for index in hottest
+    ]
+
+
+class Profiler(object):
+    """Samples the Python processes in `container`.
+
+    :param client: The Docker client
+    :param container: The running Juicebox container
+    :param duration: Seconds to sample for
+    :param rate: Samples per second
+    """
+
+    def __init__(self, client, container, duration=DURATION, rate=RATE):
+        self.client = client
+        self.container = container
+        self.duration = duration
+        self.rate = rate
+
+    def target(self):
+        """The process to profile along with its children.
+
+        :returns: The pid and what it is
+        :raises RuntimeError: When there's no Python process
+        """
+        procs = processes(self.container)
+        found = find_server(procs)
+        if found is not None:
+            server, master, workers = found
+            return master.pid, f'the {server} master and its {len(workers)} workers'
+        pythons = {p.pid: p for p in procs if p.command.split(' ', 1)[0] == PYTHON}
+        roots = [p for p in pythons.values() if p.ppid not in pythons]
+        if not roots:
+            raise RuntimeError(f'There are no Python processes in {self.container.name}.')
+        root = min(roots, key=lambda p: p.pid)
+        return root.pid, f'{root.command[:60]} and its children'
+
+    def _script(self, pid):
+        return (
+            f'test -x /py-spy/bin/py-spy || {PYTHON} -m pip install --quiet --target /py-spy {PY_SPY} '
+            f'&& /py-spy/bin/py-spy record --pid {pid} --subprocesses --duration {self.duration} '
+            f'--rate {self.rate} --format speedscope --output {OUTPUT}'
+        )
+
+    def _copy_out(self, sidecar, path):
+        stream, _ = sidecar.get_archive(OUTPUT)
+        with tarfile.open(fileobj=io.BytesIO(b''.join(stream))) as archive:
+            member = archive.getmembers()[0]
+            data = archive.extractfile(member).read()
+        with open(path, 'wb') as f:
+            f.write(data)
+        return json.loads(data)
+
+    def record(self, pid, path):
+        """Profile `pid` and its children and write the profile to `path`.
+
+        :returns: The decoded speedscope profile
+        :raises RuntimeError: When py-spy fails
+        """
+        sidecar = self.client.containers.run(
+            self.container.image.id, ['-c', self._script(pid)], entrypoint='sh', user='root',
+            pid_mode=f'container:{self.container.id}', cap_add=['SYS_PTRACE'],
+            volumes={PY_SPY_VOLUME: {'bind': '/py-spy', 'mode': 'rw'}},
+            labels={PROFILE_LABEL: str(pid)}, detach=True,
+        )
+        try:
+            try:
+                result = sidecar.wait(timeout=self.duration + INSTALL_TIMEOUT)
+            except requests.exceptions.RequestException:
+                raise RuntimeError(f'py-spy did not finish within {self.duration + INSTALL_TIMEOUT}s.')
+            if result['StatusCode'] != 0:
+                output = sidecar.logs().decode('utf-8', 'replace').strip()
+                raise RuntimeError(f'py-spy failed: {output}')
+            return self._copy_out(sidecar, path)
+        finally:
+            try:
+                sidecar.remove(force=True)
+            except docker.errors.APIError:
+                pass
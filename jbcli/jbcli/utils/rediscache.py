@@ -0,0 +1,200 @@
+"""Inspects and clears the Juicebox cache in the devlandia redis service.
+
+jb talks to redis on its exposed port with a small RESP client, so nothing
+has to start Django. Keys are found with ``SCAN`` and removed with
+``UNLINK`` in batches, so redis keeps serving Juicebox while a large cache
+is cleared and frees the memory in the background.
+"""
+import re
+import socket
+import time
+from collections import namedtuple
+
+from .. import conf
+
+__all__ = ['RedisError', 'Redis', 'app_pattern', 'key_prefix', 'clear', 'stats']
+
+TIMEOUT = 5.0
+# How many keys one SCAN step returns and one UNLINK removes, roughly
+BATCH = 1000
+# Django keys look like ":1:<key>", so three segments are the first part of
+# the key itself
+PREFIX_DEPTH = 3
+GLOB_SPECIAL_RE = re.compile(r'([*?\[\]\\])')
+KEYSPACE_RE = re.compile(r'^db(\d+):keys=(\d+)')
+
+Cleared = namedtuple('Cleared', ['keys', 'seconds'])
+PrefixStats = namedtuple('PrefixStats', ['db', 'prefix', 'keys', 'size'])
+
+
+class RedisError(Exception):
+    """An error reply from redis."""
+
+
+class Redis(object):
+    """A minimal redis connection, enough for inspecting and clearing keys.
+
+    :param host: The redis host
+    :param port: The redis port
+    """
+
+    def __init__(self, host=None, port=None, timeout=TIMEOUT):
+        self.address = (host or conf.REDIS_HOST, port or conf.REDIS_PORT)
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connect(self):
+        if self._sock is None:
+            self._sock = socket.create_connection(self.address, timeout=self.timeout)
+            self._file = self._sock.makefile('rb')
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    @staticmethod
+    def _pack(args):
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(f'${len(arg)}\r\n'.encode() + arg + b'\r\n')
+        return b''.join(parts)
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('redis closed the connection')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            return RedisError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return self._file.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read() for _ in range(length)]
+        raise RedisError(f'Unexpected reply from redis: {line!r}')
+
+    def pipeline(self, commands):
+        """Send `commands` at once and read their replies.
+
+        Error replies are returned as `RedisError` instead of raised.
+        """
+        self.connect()
+        self._sock.sendall(b''.join(self._pack(command) for command in commands))
+        return [self._read() for _ in commands]
+
+    def execute(self, *args):
+        """Run one command and return its reply.
+
+        :raises RedisError: When redis answers with an error
+        """
+        reply = self.pipeline([args])[0]
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def databases(self):
+        """The numbers of the databases that hold keys."""
+        info = self.execute('INFO', 'keyspace').decode('utf-8')
+        return [int(m.group(1)) for m in map(KEYSPACE_RE.match, info.splitlines()) if m]
+
+    def scan(self, pattern='*', count=BATCH):
+        """Yield the keys of the selected database matching `pattern`, in
+        batches.
+        """
+        cursor = b'0'
+        while True:
+            cursor, keys = self.execute('SCAN', cursor, 'MATCH', pattern, 'COUNT', count)
+            if keys:
+                yield keys
+            if cursor == b'0':
+                return
+
+
+def app_pattern(app):
+    """A pattern to scan for the cache keys that mention `app`.
+
+    It also matches the keys of apps whose name contains `app`, filter the
+    keys with `app_key_re`.
+    """
+    escaped = GLOB_SPECIAL_RE.sub(r'\\\1', app)
+    return f'*{escaped}*'
+
+
+def app_key_re(app):
+    """Matches the keys that have `app` as one of their ``:`` separated
+    segments, so ``sales`` doesn't match the keys of ``salesforce``.
+    """
+    return re.compile(rb'(?:^|:)' + re.escape(app.encode('utf-8')) + rb'(?::|$)')
+
+
+def key_prefix(key, depth=PREFIX_DEPTH):
+    """The first `depth` ``:`` separated segments of `key`."""
+    if isinstance(key, bytes):
+        key = key.decode('utf-8', 'replace')
+    segments = key.split(':')
+    if len(segments) <= depth:
+        return key
+    return ':'.join(segments[:depth]) + ':*'
+
+
+def clear(redis, pattern, batch=BATCH, dry_run=False, only=None):
+    """Remove the keys matching `pattern` from every database.
+
+    :param redis: A `Redis` connection
+    :param dry_run: Only count the keys
+    :param only: A compiled bytes regular expression the keys also have to
+        match, like `app_key_re`
+    :rtype: `Cleared`
+    """
+    began = time.perf_counter()
+    removed = 0
+    for db in redis.databases():
+        redis.execute('SELECT', db)
+        for keys in redis.scan(pattern, count=batch):
+            if only is not None:
+                keys = [key for key in keys if only.search(key)]
+                if not keys:
+                    continue
+            if not dry_run:
+                redis.execute('UNLINK', *keys)
+            removed += len(keys)
+    return Cleared(removed, time.perf_counter() - began)
+
+
+def stats(redis, pattern='*', depth=PREFIX_DEPTH, batch=BATCH):
+    """Count the keys matching `pattern` and the memory they use by prefix.
+
+    :rtype: list of `PrefixStats`, largest first
+    """
+    totals = {}
+    for db in redis.databases():
+        redis.execute('SELECT', db)
+        for keys in redis.scan(pattern, count=batch):
+            sizes = redis.pipeline([('MEMORY', 'USAGE', key) for key in keys])
+            for key, size in zip(keys, sizes):
+                entry = totals.setdefault((db, key_prefix(key, depth)), [0, 0])
+                entry[0] += 1
+                if isinstance(size, int):
+                    entry[1] += size
+    rows = [PrefixStats(db, prefix, keys, size) for (db, prefix), (keys, size) in totals.items()]
+    return sorted(rows, key=lambda row: row.size, reverse=True)
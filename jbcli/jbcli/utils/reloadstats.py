@@ -0,0 +1,153 @@
+"""Records timings for the app reload cycle so slow apps can be found.
+
+Every reload performed by the watcher produces one record which is logged
+and appended to a JSON lines file next to the stash.
+"""
+import contextlib
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import click
+import structlog
+from tabulate import tabulate
+
+from .format import echo_highlight
+
+__all__ = ['Stopwatch', 'record_reload', 'read_records', 'percentile',
+           'summarize', 'print_summary']
+
+STATS_FILENAME = os.environ.get(
+    'JB_RELOAD_STATS', '~/.config/juicebox/reload-stats.jsonl')
+
+# Only the most recent records are considered when summarizing
+MAX_RECORDS = 5000
+
+toplog = structlog.get_logger()
+
+
+class Stopwatch(object):
+    """Collects named durations (in seconds) for one reload.
+    """
+
+    def __init__(self):
+        self.timings = OrderedDict()
+
+    @contextlib.contextmanager
+    def time(self, name):
+        """Time the wrapped block and store the duration under `name`.
+
+        Repeated blocks with the same name are summed, so retries add up.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = round(self.timings.get(name, 0) + elapsed, 3)
+
+    def set(self, name, value):
+        self.timings[name] = value
+
+    def get(self, name, default=None):
+        return self.timings.get(name, default)
+
+
+def _stats_path(filename=None):
+    return os.path.abspath(os.path.expanduser(filename or STATS_FILENAME))
+
+
+def record_reload(app, timings, event_time=None, filename=None):
+    """Log a reload record and append it to the stats file.
+
+    :param app: The Juicebox packaged application name
+    :type app: str
+    :param timings: Durations and counts collected during the reload
+    :type timings: dict
+    :param event_time: Unix time the change event was received
+    :type event_time: float
+    """
+    record = OrderedDict()
+    record['app'] = app
+    record['event_time'] = datetime.fromtimestamp(
+        event_time or time.time()).isoformat(timespec='seconds')
+    record.update(timings)
+    toplog.info('reload', **record)
+
+    path = _stats_path(filename)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    except IOError as e:
+        toplog.warning('Could not write reload stats', error=str(e))
+    return record
+
+
+def read_records(filename=None, limit=MAX_RECORDS):
+    """Read the most recent reload records from the stats file."""
+    records = []
+    try:
+        with open(_stats_path(filename)) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except IOError:
+        return []
+    return records[-limit:]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values`, None when there are no values.
+    """
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def summarize(records, key='total'):
+    """Build per app rows of p50/p95 timings, slowest apps first.
+
+    :param records: Reload records as returned by `read_records`
+    :param key: The timing the apps are ranked by
+    :rtype: ``list``
+    """
+    by_app = OrderedDict()
+    for record in records:
+        by_app.setdefault(record.get('app'), []).append(record)
+
+    rows = []
+    for app, app_records in by_app.items():
+        row = [app, len(app_records)]
+        for name in (key, 'load', 'refresh'):
+            values = [r.get(name) for r in app_records]
+            row.extend([percentile(values, 50), percentile(values, 95)])
+        row.append(max(r.get('slices', 0) or 0 for r in app_records))
+        rows.append(row)
+    rows.sort(key=lambda r: r[3] or 0, reverse=True)
+    return rows
+
+
+def print_summary(filename=None):
+    records = read_records(filename)
+    if not records:
+        echo_highlight('No reloads have been recorded yet.')
+        return []
+    rows = summarize(records)
+    click.echo(tabulate(
+        rows,
+        headers=['App', 'Reloads', 'Total p50', 'Total p95', 'Load p50',
+                 'Load p95', 'Refresh p50', 'Refresh p95', 'Slices'],
+        floatfmt='.2f',
+    ))
+    return rows
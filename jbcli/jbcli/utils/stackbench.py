@@ -0,0 +1,187 @@
+"""Measures how fast the stacks of an app render under load for ``jb bench``.
+
+`StackBench` is an `asyncapi.AsyncApiClient`, the blocking `requests` calls
+run in a thread pool driven by asyncio and share one connection pool and
+one admin token.
+The stacks are measured one after the other, each with `concurrency`
+requests in flight, so their latencies don't mix. Every run is appended to
+a JSON lines file next to the stash, labelled with the Juicebox image and
+the app's branch, to compare runs later.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+import requests
+
+from .asyncapi import AsyncApiClient
+from .reloadstats import percentile
+
+__all__ = ['StackResult', 'StackBench', 'stack_urls', 'run_bench', 'save_run', 'last_run']
+
+RESULTS_FILENAME = os.environ.get('JB_BENCH_RESULTS', '~/.config/juicebox/bench.jsonl')
+# The path a stack is rendered at, {app} and {stack} are filled in
+STACK_URL = '/stacks/{app}/{stack}/'
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REQUESTS = 50
+# Requests per stack that aren't measured, they fill the caches
+WARMUP = 1
+# Seconds a single request may take
+TIMEOUT = 60
+
+StackResult = namedtuple('StackResult', ['stack', 'requests', 'errors', 'seconds', 'throughput',
+                                         'p50', 'p95', 'p99'])
+
+
+class StackBench(AsyncApiClient):
+    """Requests stacks through Juicebox with bounded concurrency.
+
+    :param custom: Talk to Juicebox Custom (8001) instead of Selfserve (8000)
+    :type custom: bool
+    :param concurrency: Number of requests in flight
+    :type concurrency: int
+    """
+
+    def __init__(self, custom=False, concurrency=DEFAULT_CONCURRENCY, timeout=TIMEOUT):
+        super().__init__(custom=custom, concurrency=concurrency)
+        self.timeout = timeout
+
+    def _get(self, url, token):
+        start = time.perf_counter()
+        try:
+            response = self._session.get(url, headers={'Authorization': f'JWT {token}'},
+                                         timeout=self.timeout)
+        except requests.RequestException:
+            return None, time.perf_counter() - start
+        return response.status_code, time.perf_counter() - start
+
+    async def request(self, url):
+        """Request `url` once, with a fresh token if the server rejects it.
+
+        :returns: The status code, None when there was no response, and the
+            seconds the request took
+        :raises RuntimeError: When there's no admin token
+        """
+        token = await self.token()
+        status, seconds = await self._call(self._get, url, self._check(token))
+        if status == 401:
+            token = self._check(await self.token(stale=token))
+            status, seconds = await self._call(self._get, url, token)
+        return status, seconds
+
+    @staticmethod
+    def _check(token):
+        if not token:
+            raise RuntimeError('Could not get admin token.')
+        return token
+
+    async def stack(self, stack, url, count=DEFAULT_REQUESTS, warmup=WARMUP):
+        """Request a stack `count` times, `concurrency` at a time.
+
+        :rtype: `StackResult`
+        """
+        for _ in range(warmup):
+            await self.request(url)
+        remaining = iter(range(count))
+        latencies = []
+        errors = 0
+
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                status, seconds = await self.request(url)
+                if status is not None and 200 <= status < 300:
+                    latencies.append(seconds)
+                else:
+                    errors += 1
+
+        began = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(min(self.concurrency, count))])
+        elapsed = time.perf_counter() - began
+        return StackResult(stack, count, errors, elapsed, len(latencies) / elapsed if elapsed else 0.0,
+                           percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99))
+
+    async def run(self, urls, count=DEFAULT_REQUESTS, warmup=WARMUP, on_result=None):
+        """Measure every stack in `urls`, an ordered mapping of stack to URL.
+
+        :param on_result: Optional callback called with each `StackResult`
+        :rtype: ``list`` of `StackResult`
+        """
+        self._token_lock = asyncio.Lock()
+        results = []
+        for stack, url in urls.items():
+            result = await self.stack(stack, url, count=count, warmup=warmup)
+            if on_result is not None:
+                on_result(result)
+            results.append(result)
+        return results
+
+
+def stack_urls(app, stacks, custom=False, template=STACK_URL):
+    """The URLs of the `stacks` of `app` on the local Juicebox."""
+    server = 'http://localhost:8001' if custom else 'http://localhost:8000'
+    return OrderedDict(
+        (stack, server + template.format(app=app, stack=stack)) for stack in stacks)
+
+
+def run_bench(urls, custom=False, concurrency=DEFAULT_CONCURRENCY, count=DEFAULT_REQUESTS,
+              warmup=WARMUP, on_result=None):
+    """Blocking helper that measures `urls` with a `StackBench`.
+
+    :rtype: ``list`` of `StackResult`
+    """
+    bench = StackBench(custom=custom, concurrency=concurrency)
+    try:
+        return asyncio.run(bench.run(urls, count=count, warmup=warmup, on_result=on_result))
+    finally:
+        bench.close()
+
+
+def _results_path(filename=None):
+    return os.path.abspath(os.path.expanduser(filename or RESULTS_FILENAME))
+
+
+def save_run(app, label, results, filename=None, **details):
+    """Append a run to the results file.
+
+    :param details: More to remember about the run, like the image
+    :returns: The path of the results file
+    """
+    record = OrderedDict([
+        ('app', app),
+        ('label', label),
+        ('time', datetime.now().isoformat(timespec='seconds')),
+    ])
+    record.update(details)
+    record['stacks'] = [result._asdict() for result in results]
+    path = _results_path(filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    return path
+
+
+def last_run(app, label, filename=None):
+    """The results of the latest run of `app` saved as `label`, None when
+    there is none.
+
+    :rtype: ``dict`` of stack to `StackResult`
+    """
+    found = None
+    try:
+        with open(_results_path(filename)) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('app') == app and record.get('label') == label:
+                    found = record
+    except IOError:
+        return None
+    if found is None:
+        return None
+    return OrderedDict((stack['stack'], StackResult(**stack)) for stack in found['stacks'])
@@ -0,0 +1,233 @@
+"""Keeps the SSH tunnels to Redshift alive across ``jb start`` runs.
+
+One ssh ControlMaster connection to the bastion host carries every port
+forward. The master is left running when jb exits, so the next ``jb start``
+only has to check it and add its forwards. Forwards are health checked by
+sending a Postgres SSLRequest through them, which also measures the
+round trip to Redshift.
+"""
+import logging
+import os
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+from .. import conf
+from .format import echo_warning
+from .storageutil import stash as default_stash
+
+__all__ = ['Forward', 'TunnelManager']
+
+LOG = logging.getLogger(__name__)
+
+TUNNEL_KEY = 'tunnel'
+SSH_OPTIONS = [
+    '-o', 'ServerAliveInterval=30',
+    '-o', 'ServerAliveCountMax=3',
+    '-o', 'StrictHostKeyChecking=accept-new',
+    '-o', 'ExitOnForwardFailure=yes',
+]
+# Postgres SSLRequest, Redshift answers it with a single byte
+SSL_REQUEST = struct.pack('!ii', 8, 80877103)
+HEALTH_TIMEOUT = 5.0
+WATCH_INTERVAL = 30.0
+
+
+class Forward(object):
+    """A local port forwarded to `remote_host`:`remote_port`."""
+
+    def __init__(self, local_port, remote_host, remote_port=5439):
+        self.local_port = int(local_port)
+        self.remote_host = remote_host
+        self.remote_port = int(remote_port)
+
+    @property
+    def spec(self):
+        return f'0.0.0.0:{self.local_port}:{self.remote_host}:{self.remote_port}'
+
+    def as_dict(self):
+        return {
+            'local_port': self.local_port,
+            'remote_host': self.remote_host,
+            'remote_port': self.remote_port,
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, Forward) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return f'Forward({self.spec})'
+
+
+def probe(port, host='127.0.0.1', timeout=HEALTH_TIMEOUT):
+    """Time a Postgres SSLRequest through a forwarded port.
+
+    ssh accepts local connections before it knows whether the remote end is
+    reachable, so only an answer from the server proves the forward works.
+
+    :returns: The round trip in seconds, or None if the forward is broken
+    """
+    start = time.perf_counter()
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.sendall(SSL_REQUEST)
+            answer = sock.recv(1)
+    except OSError:
+        return None
+    if answer not in (b'S', b'N'):
+        return None
+    return time.perf_counter() - start
+
+
+def _run(args, timeout):
+    try:
+        return subprocess.run(
+            args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise RuntimeError(f'ssh failed: {e}')
+
+
+def _error(result):
+    return result.stderr.decode('utf-8', 'replace').strip()
+
+
+class TunnelManager(object):
+    """Manages the ControlMaster connection and its forwards.
+
+    :param host: The ssh host the tunnels go through
+    :type host: str
+    :param control_path: Where the ControlMaster socket lives
+    :type control_path: str
+    """
+
+    def __init__(self, host=None, control_path=None, stash=None):
+        self.host = host or conf.TUNNEL_HOST
+        self.control_path = control_path or conf.TUNNEL_CONTROL_PATH
+        self.stash = stash or default_stash
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def _ssh(self, *args, timeout=30):
+        return _run(['ssh', '-S', self.control_path] + list(args) + [self.host], timeout)
+
+    @property
+    def forwards(self):
+        """The forwards the last ``jb start --ssh`` asked for."""
+        saved = (self.stash.get(TUNNEL_KEY, {}) or {}).get('forwards', [])
+        return [Forward(**forward) for forward in saved]
+
+    def _save(self, forwards):
+        self.stash.put(TUNNEL_KEY, {
+            'host': self.host,
+            'forwards': [forward.as_dict() for forward in forwards],
+        })
+
+    def master_pid(self):
+        """The pid of the running ControlMaster, or None."""
+        try:
+            result = self._ssh('-O', 'check', timeout=10)
+        except RuntimeError:
+            return None
+        if result.returncode != 0:
+            return None
+        # "Master running (pid=1234)"
+        message = _error(result)
+        digits = ''.join(c for c in message.split('pid=')[-1] if c.isdigit())
+        return int(digits) if digits else 0
+
+    def _start_master(self):
+        os.makedirs(os.path.dirname(self.control_path), exist_ok=True)
+        if os.path.exists(self.control_path):
+            # Left behind by a master that died
+            os.remove(self.control_path)
+        result = _run(
+            ['ssh', '-M', '-S', self.control_path, '-o', 'ControlPersist=yes',
+             '-f', '-N', '-T'] + SSH_OPTIONS + [self.host],
+            timeout=60,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f'Could not connect to {self.host}: {_error(result)}')
+
+    def _add_forwards(self, forwards):
+        for forward in forwards:
+            result = self._ssh('-O', 'forward', '-L', forward.spec)
+            if result.returncode != 0:
+                raise RuntimeError(
+                    f'Could not forward port {forward.local_port}: {_error(result)}')
+
+    def _cancel_forwards(self, forwards):
+        for forward in forwards:
+            self._ssh('-O', 'cancel', '-L', forward.spec)
+
+    def ensure(self, forwards):
+        """Make sure the master runs and carries exactly `forwards`.
+
+        An existing master is reused, only the forwards that changed are
+        cancelled or added.
+
+        :param forwards: The ports to forward
+        :type forwards: list of `Forward`
+        :returns: Whether an existing master was reused
+        :raises RuntimeError: If ssh fails
+        """
+        with self._lock:
+            reused = self.master_pid() is not None
+            if reused:
+                self._cancel_forwards([f for f in self.forwards if f not in forwards])
+            else:
+                self._start_master()
+            self._add_forwards(forwards)
+            self._save(forwards)
+            return reused
+
+    def status(self):
+        """Check the master and every forward.
+
+        :returns: ``(pid, [(forward, latency), ...])``, the latency is None
+            for broken forwards and pid is None when the master isn't running
+        """
+        pid = self.master_pid()
+        if pid is None:
+            return None, [(forward, None) for forward in self.forwards]
+        return pid, [(forward, probe(forward.local_port)) for forward in self.forwards]
+
+    def healthy(self):
+        pid, checks = self.status()
+        return pid is not None and all(latency is not None for _, latency in checks)
+
+    def reconnect(self):
+        """Tear the master down and bring every forward back."""
+        forwards = self.forwards
+        with self._lock:
+            self._ssh('-O', 'exit', timeout=10)
+            self._start_master()
+            self._add_forwards(forwards)
+
+    def stop(self):
+        """Close the master and every forward it carries."""
+        self._stop.set()
+        if self.master_pid() is None:
+            return False
+        self._ssh('-O', 'exit', timeout=10)
+        return True
+
+    def watch(self, interval=WATCH_INTERVAL):
+        """Health check the tunnel in a daemon thread and reconnect it when a
+        forward breaks, until `stop` is called or the process exits.
+        """
+        def _watch():
+            while not self._stop.wait(interval):
+                try:
+                    if self.healthy():
+                        continue
+                    echo_warning('SSH tunnel is down, reconnecting...')
+                    self.reconnect()
+                except RuntimeError as e:
+                    LOG.error(str(e))
+                    echo_warning(f'Could not reconnect the SSH tunnel: {e}')
+
+        thread = threading.Thread(target=_watch, name='jb-tunnel-watch', daemon=True)
+        thread.start()
+        return thread